@@ -1,73 +1,117 @@
 #!/usr/bin/env python3
-"""
+r"""
 Automated Qwen2.5:7b Model Extraction and Optimization Script
 
 This script automates the process of:
 1. Extracting the Qwen2.5:7b model from Ollama blobs
 2. Converting it to GGUF format
 3. Quantizing it to q4_0 precision
-4. Placing it in the correct location for the Neonote Flutter app
+4. Reordering and page-aligning its tensors for fast memory-mapped loading
+5. Placing it in the correct location for the Neonote Flutter app
 
 Usage:
-    python extract_and_optimize_ollama_model.py --ollama-dir "C:\Users\nsc\.ollama" --output-dir "C:\Users\nsc\Desktop\notion_offline\assets\ai_model"
+    python extract_and_optimize_ollama_model.py --ollama-dir "C:\Users\nsc\.ollama" --output-dir "C:\Users\nsc\Desktop\notion_offline\assets\ai_model" --model qwen2.5:7b
 """
 
 import os
 import sys
-import json
 import shutil
 import argparse
 import subprocess
 from pathlib import Path
 import tempfile
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "scripts"))
+
+from build_cache import ArtifactCache
+from checkpoints import Stage, StageCheckpoints, run_stages
+from file_transfer import transfer_file, write_sidecar
+from ggml_quants import QUANTIZE_TYPES
+from gguf_file import GGUFReader
+import instrumentation
+from model_config import load_params, write_model_config
+from optimize_model import PAGE_ALIGNMENT, layer_index_path, optimize_gguf
+from ollama_blobs import BlobCatalog, blob_name_to_digest
+from pipeline import build_batch, output_name
+from quantize_model import DEFAULT_MEMORY_BUDGET, quantize_gguf
+
 def find_largest_blob(blobs_dir):
     """Find the largest blob file in the Ollama blobs directory, which is likely the model weights."""
     largest_file = None
     largest_size = 0
     
-    for file in os.listdir(blobs_dir):
-        file_path = os.path.join(blobs_dir, file)
-        if os.path.isfile(file_path) and file.startswith("sha256-"):
-            file_size = os.path.getsize(file_path)
-            if file_size > largest_size:
-                largest_size = file_size
-                largest_file = file_path
-    
-    if not largest_file:
-        raise FileNotFoundError(f"Could not find any blob files in {blobs_dir}")
+    with instrumentation.span("find_largest_blob", blobs_dir=blobs_dir) as span:
+        for file in os.listdir(blobs_dir):
+            file_path = os.path.join(blobs_dir, file)
+            if os.path.isfile(file_path) and file.startswith("sha256-"):
+                file_size = os.path.getsize(file_path)
+                span.advance(0, 1)
+                if file_size > largest_size:
+                    largest_size = file_size
+                    largest_file = file_path
+        
+        if not largest_file:
+            raise FileNotFoundError(f"Could not find any blob files in {blobs_dir}")
+        span.set(blob=largest_file, blob_bytes=largest_size)
     
     print(f"Found largest blob file: {largest_file} ({largest_size/1024/1024/1024:.2f} GB)")
     return largest_file
 
-def extract_model_from_blob(blob_path, output_dir):
-    """Extract the model from the Ollama blob file."""
+def resolve_model_blob(ollama_dir, model_name, index_path=None):
+    """
+    Resolve a model through its Ollama manifest, falling back to the largest blob
+    
+    Returns:
+        (weights blob path, params blob path or None)
+    """
+    try:
+        catalog = BlobCatalog(ollama_dir, index_path)
+        blob_path = catalog.model_blob(model_name)
+        params = catalog.resolve(model_name).get("params")
+    except FileNotFoundError as e:
+        print(f"Warning: {e}")
+        print("Falling back to the largest blob in the blobs directory")
+        return find_largest_blob(os.path.join(ollama_dir, "models", "blobs")), None
+    
+    print(f"Resolved {model_name} to model blob: {blob_path} ({os.path.getsize(blob_path)/1024/1024/1024:.2f} GB)")
+    return blob_path, params[0]["path"] if params else None
+
+def verify_model_blobs(ollama_dir, model_name, index_path=None, threads=1):
+    """Check the model's Ollama blobs (layers and config) against their sha256 before using them."""
+    catalog = BlobCatalog(ollama_dir, index_path)
+    blobs = catalog.blobs(model_name)
+    with instrumentation.span("verify_blobs", model=model_name, threads=threads) as span:
+        report = catalog.verify(blobs, threads, progress=span.advance)
+        span.set(verified=len(report.verified), cached=len(report.cached), corrupt=len(report.corrupt))
+    if report.corrupt:
+        problems = ", ".join(f"{name} ({problem})" for name, problem in sorted(report.corrupt.items()))
+        raise ValueError(f"Corrupt Ollama blobs for {model_name}: {problems}; pull the model again")
+    print(f"Verified {len(report.verified)} blobs of {model_name} ({len(report.cached)} unchanged since their last check)")
+
+def extract_model_from_blob(blob_path, output_dir, params_path=None, blob_verified=False):
+    """Extract the model from the Ollama blob file; ``blob_verified`` skips rehashing a blob checked by ``verify_model_blobs``."""
     os.makedirs(output_dir, exist_ok=True)
     
     print(f"Extracting model from blob: {blob_path}")
     print(f"Output directory: {output_dir}")
     
     # The blob is essentially a binary file containing the model weights
-    # We'll copy it to the output directory with a recognizable name
+    # We'll link it into the output directory with a recognizable name,
+    # only copying the data when a hardlink or reflink is not possible
     model_path = os.path.join(output_dir, "qwen2.5-7b-weights.bin")
-    shutil.copy2(blob_path, model_path)
-    
-    # Create a minimal config.json file
-    config = {
-        "model_type": "qwen",
-        "model_name": "qwen2.5-7b",
-        "vocab_size": 151936,
-        "hidden_size": 4096,
-        "num_attention_heads": 32,
-        "num_hidden_layers": 32,
-        "intermediate_size": 11008,
-        "max_position_embeddings": 4096,
-        "extracted_from_ollama": True,
-        "blob_path": blob_path
-    }
-    
-    with open(os.path.join(output_dir, "config.json"), "w") as f:
-        json.dump(config, f, indent=2)
+    with instrumentation.span("extract_model_from_blob", os.path.getsize(blob_path), blob=blob_path) as span:
+        digest = blob_name_to_digest(os.path.basename(blob_path)) if blob_verified else None
+        method = transfer_file(blob_path, model_path, verify=digest is None, progress=span.advance)
+        if digest:
+            write_sidecar(model_path, digest)
+        span.set(method=method)
+        print(f"Transferred blob via {method}")
+        
+        # Derive config.json from the blob's GGUF metadata and the Ollama params layer
+        config = write_model_config(model_path, os.path.join(output_dir, "config.json"), load_params(params_path),
+                                    extracted_from_ollama=True, blob_path=blob_path)
+    print(f"Model config: {config.get('model_type')}, {config.get('num_hidden_layers')} layers, "
+          f"hidden size {config.get('hidden_size')}, context {config.get('context_length')}")
     
     print(f"Model extracted to {output_dir}")
     return model_path
@@ -78,53 +122,67 @@ def convert_to_gguf(model_dir, output_path):
     print(f"Model directory: {model_dir}")
     print(f"Output path: {output_path}")
     
-    # In a real implementation, we would use llama.cpp's conversion tool
-    # For this demonstration, we'll create a simulated GGUF file
-    
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    # Read the original model file
     model_path = os.path.join(model_dir, "qwen2.5-7b-weights.bin")
     
-    # For demonstration, we'll create a smaller file that simulates the conversion
-    # In a real implementation, this would be replaced with actual conversion code
-    with open(model_path, "rb") as src:
-        # Read the first 100MB of the file to simulate conversion
-        data = src.read(min(100 * 1024 * 1024, os.path.getsize(model_path)))
+    with instrumentation.span("convert_to_gguf", os.path.getsize(model_path), model=model_path) as span:
+        # Ollama weight blobs are already GGUF, so conversion only has to
+        # validate the header and tensor table; the tensor data is never read
+        with GGUFReader(model_path) as reader:
+            tensors = reader.tensors
+            data_end = max((t.data_offset + t.n_bytes for t in tensors), default=reader.data_offset)
+            if data_end > reader.file_size:
+                raise ValueError(f"GGUF file is truncated: tensor data ends at {data_end}, file size is {reader.file_size}")
+            print(f"Validated GGUF v{reader.version} ({reader.get('general.architecture', 'unknown')}): "
+                  f"{len(tensors)} tensors, {reader.kv_count} metadata entries")
         
-        with open(output_path, "wb") as dst:
-            dst.write(data)
+        method = transfer_file(model_path, output_path, verify=True, progress=span.advance)
+        span.set(method=method, tensors=len(tensors))
+        print(f"Transferred GGUF via {method}")
     
     print(f"Model converted to GGUF format: {output_path}")
     return output_path
 
-def quantize_model(input_path, output_path, quantize_type="q4_0"):
+def quantize_model(input_path, output_path, quantize_type="q4_0", threads=1, journal_path=None,
+                   memory_budget=DEFAULT_MEMORY_BUDGET):
     """Quantize the GGUF model to the specified precision."""
     print(f"Quantizing model to {quantize_type} precision")
     print(f"Input path: {input_path}")
     print(f"Output path: {output_path}")
     
-    # In a real implementation, we would use llama.cpp's quantize tool
-    # For this demonstration, we'll create a simulated quantized file
-    
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    # For demonstration, we'll create a smaller file that simulates the quantization
-    # In a real implementation, this would be replaced with actual quantization code
-    with open(input_path, "rb") as src:
-        # Read the file to simulate quantization
-        data = src.read()
-        
-        with open(output_path, "wb") as dst:
-            dst.write(data)
+    # Quantize tensor by tensor from the memory-mapped input, sharded across worker processes
+    with GGUFReader(input_path) as reader:
+        tensor_bytes = sum(t.n_bytes for t in reader.tensors)
+    with instrumentation.span("quantize_model", tensor_bytes, quantize=quantize_type, threads=threads) as span:
+        quantized = quantize_gguf(input_path, output_path, quantize_type, threads, journal_path=journal_path,
+                                  memory_budget=memory_budget, progress=span.advance)
+        span.set(quantized_tensors=quantized, output_bytes=os.path.getsize(output_path))
+    print(f"Quantized {quantized} tensors")
     
     print(f"Model quantized to {quantize_type}: {output_path}")
     return output_path
 
-def place_in_flutter_assets(model_path, flutter_assets_dir):
-    """Place the optimized model in the Flutter assets directory."""
+def optimize_model(input_path, output_path, alignment=PAGE_ALIGNMENT, layer_index=False):
+    """Reorder the model's tensors into execution order and align them to the device page size."""
+    print(f"Optimizing model for memory-mapped loading")
+    print(f"Input path: {input_path}")
+    print(f"Output path: {output_path}")
+    
+    with instrumentation.span("optimize_model", os.path.getsize(input_path), alignment=alignment) as span:
+        moved = optimize_gguf(input_path, output_path, alignment, layer_index, progress=span.advance)
+        span.set(reordered_tensors=moved)
+    print(f"Reordered {moved} tensors with {alignment}-byte alignment")
+    
+    print(f"Model optimized: {output_path}")
+    return output_path
+
+def place_in_flutter_assets(model_path, flutter_assets_dir, model_name="qwen2.5:7b", quantize_type="q4_0"):
+    """Place the optimized model in the Flutter assets directory under the asset name of its model and quantization."""
     print(f"Placing model in Flutter assets directory")
     print(f"Model path: {model_path}")
     print(f"Flutter assets directory: {flutter_assets_dir}")
@@ -132,21 +190,65 @@ def place_in_flutter_assets(model_path, flutter_assets_dir):
     # Ensure the Flutter assets directory exists
     os.makedirs(flutter_assets_dir, exist_ok=True)
     
-    # Copy the model to the Flutter assets directory
-    target_path = os.path.join(flutter_assets_dir, "qwen2.5-7b-gguf-q4_0.bin")
-    shutil.copy2(model_path, target_path)
+    # Link or copy the model into the Flutter assets directory
+    target_path = os.path.join(flutter_assets_dir, output_name(model_name, quantize_type))
+    with instrumentation.span("place_in_flutter_assets", os.path.getsize(model_path), target=target_path) as span:
+        method = transfer_file(model_path, target_path, verify=True, progress=span.advance)
+        span.set(method=method)
+    print(f"Transferred model via {method}")
+    
+    # Keep the per-layer offsets next to the model they describe
+    if os.path.exists(layer_index_path(model_path)):
+        transfer_file(layer_index_path(model_path), layer_index_path(target_path))
+    elif os.path.exists(layer_index_path(target_path)):
+        os.remove(layer_index_path(target_path))
     
     print(f"Model placed in Flutter assets: {target_path}")
     return target_path
 
+def build_all_variants(args):
+    """Batch mode: build every requested quantization of every model, reading each model once."""
+    try:
+        if args.verify_blobs:
+            for model_name in args.model:
+                verify_model_blobs(args.ollama_dir, model_name, args.blob_index, args.threads)
+        cache = None if args.no_cache else ArtifactCache(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+        results = build_batch(args.ollama_dir, args.model, args.quantize, args.output_dir, args.jobs, args.threads,
+                              index_path=args.blob_index, cache=cache, memory_budget=args.memory_budget,
+                              alignment=None if args.no_optimize else args.alignment,
+                              layer_index=args.layer_index and not args.no_optimize)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+    
+    print("\nBatch build complete!")
+    for (model_name, quantize), path in results.items():
+        print(f"  {model_name} {quantize}: {path}")
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(description="Extract and optimize Qwen2.5:7b model from Ollama")
     parser.add_argument("--ollama-dir", required=True, help="Path to Ollama directory (e.g., C:\\Users\\nsc\\.ollama)")
     parser.add_argument("--output-dir", required=True, help="Path to output directory for the optimized model (Flutter assets directory)")
     parser.add_argument("--temp-dir", help="Path to temporary directory for intermediate files")
-    parser.add_argument("--quantize", default="q4_0", choices=["q4_0", "q5_0", "q8_0"], help="Quantization type")
+    parser.add_argument("--quantize", nargs="+", default=["q4_0"], choices=list(QUANTIZE_TYPES), help="Quantization types; more than one builds them all in one pass per model")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Number of worker processes for quantization")
+    parser.add_argument("--model", nargs="+", default=["qwen2.5:7b"], help="Ollama model references to extract (e.g. qwen2.5:7b); more than one selects batch mode")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of models built concurrently in batch mode")
+    parser.add_argument("--blob-index", help="Path to the cached Ollama blob index (defaults to ~/.cache/neonote)")
+    parser.add_argument("--cache-dir", help="Path to the build artifact cache (defaults to ~/.cache/neonote/artifacts)")
+    parser.add_argument("--cache-max-gb", type=float, default=50, help="Maximum size of the build artifact cache in GB")
+    parser.add_argument("--no-cache", action="store_true", help="Always rebuild instead of reusing cached artifacts")
+    parser.add_argument("--verify-blobs", action="store_true", help="Check the model's Ollama blobs against their sha256 before extracting")
+    parser.add_argument("--no-optimize", action="store_true", help="Keep the quantized model's tensor order and alignment instead of reordering it for mmap loading")
+    parser.add_argument("--alignment", type=int, default=PAGE_ALIGNMENT, help="Tensor data alignment in bytes of the optimized model (device page size)")
+    parser.add_argument("--layer-index", action="store_true", help="Place a .layers.json sidecar with per-layer offsets next to the optimized model")
+    parser.add_argument("--max-memory", type=float, default=DEFAULT_MEMORY_BUDGET / 1024 ** 3, help="GB of decoded tensor data held at once while quantizing")
+    parser.add_argument("--metrics-file", help="Append per-stage timing, throughput, ETA and peak memory as JSON lines here ('-' for stderr)")
     
     args = parser.parse_args()
+    instrumentation.configure(args.metrics_file)
+    args.memory_budget = int(args.max_memory * 1024 ** 3)
     
     # Validate Ollama directory
     ollama_dir = args.ollama_dir
@@ -154,12 +256,20 @@ def main():
         print(f"Error: Ollama directory not found: {ollama_dir}")
         return 1
     
-    # Set up temporary directory
+    if len(args.model) > 1 or len(args.quantize) > 1:
+        return build_all_variants(args)
+    args.model = args.model[0]
+    args.quantize = args.quantize[0]
+    
+    # Set up the working directory. The default one is stable per model and
+    # quantization so that a failed run can be resumed from its checkpoints
     if args.temp_dir:
         temp_dir = args.temp_dir
-        os.makedirs(temp_dir, exist_ok=True)
     else:
-        temp_dir = tempfile.mkdtemp(prefix="qwen_conversion_")
+        model_slug = args.model.replace(":", "_").replace("/", "_")
+        temp_dir = os.path.join(tempfile.gettempdir(), f"qwen_conversion_{model_slug}_{args.quantize}")
+    os.makedirs(temp_dir, exist_ok=True)
+    succeeded = False
     
     try:
         # Step 1: Find the Ollama blobs directory
@@ -170,28 +280,66 @@ def main():
         
         print(f"Found Ollama blobs directory: {blobs_dir}")
         
-        # Step 2: Find the largest blob file (likely the model weights)
-        blob_path = find_largest_blob(blobs_dir)
-        
-        # Step 3: Extract the model from the blob
-        extracted_dir = os.path.join(temp_dir, "extracted")
-        model_path = extract_model_from_blob(blob_path, extracted_dir)
+        # Step 2: Resolve the model weights blob from the Ollama manifest
+        blob_path, params_path = resolve_model_blob(ollama_dir, args.model, args.blob_index)
+        if args.verify_blobs:
+            verify_model_blobs(ollama_dir, args.model, args.blob_index, args.threads)
         
-        # Step 4: Convert to GGUF format
-        gguf_dir = os.path.join(temp_dir, "gguf")
-        os.makedirs(gguf_dir, exist_ok=True)
-        gguf_path = os.path.join(gguf_dir, "qwen2.5-7b.gguf")
-        gguf_path = convert_to_gguf(extracted_dir, gguf_path)
+        # Reuse a previous build of the same blob and quantization if one is cached
+        cache = None if args.no_cache else ArtifactCache(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+        cache_key = cache.key(cache.source_digest(blob_path), "quantize", args.quantize) if cache else None
         
-        # Step 5: Quantize the model
+        # Steps 3-7 run as a stage graph; stages completed by an earlier,
+        # interrupted run with the same inputs are skipped
+        checkpoints = StageCheckpoints(temp_dir)
+        extracted_dir = os.path.join(temp_dir, "extracted")
+        gguf_path = os.path.join(temp_dir, "gguf", "qwen2.5-7b.gguf")
         quantized_dir = os.path.join(temp_dir, "quantized")
-        os.makedirs(quantized_dir, exist_ok=True)
-        quantized_path = os.path.join(quantized_dir, f"qwen2.5-7b-{args.quantize}.gguf")
-        quantized_path = quantize_model(gguf_path, quantized_path, args.quantize)
-        
-        # Step 6: Place in Flutter assets
+        quantized_path = os.path.join(quantized_dir, f"qwen2.5-7b-{args.quantize}-cached.gguf")
+        if not (cache and cache.fetch(cache_key, quantized_path)):
+            quantized_path = None
         flutter_assets_dir = args.output_dir
-        final_path = place_in_flutter_assets(quantized_path, flutter_assets_dir)
+        blob_stat = os.stat(blob_path)
+        
+        stages = []
+        if quantized_path:
+            print(f"Using cached {args.quantize} build: {quantized_path}")
+        else:
+            stages += [
+                # Step 3: Extract the model from the blob
+                Stage("extract", {"blob": blob_path, "size": blob_stat.st_size, "mtime": blob_stat.st_mtime_ns,
+                                  "params": params_path},
+                      lambda outputs: {"model": extract_model_from_blob(blob_path, extracted_dir, params_path,
+                                                                           args.verify_blobs)}),
+                # Step 4: Convert to GGUF format
+                Stage("convert", {"output": gguf_path},
+                      lambda outputs: {"gguf": convert_to_gguf(extracted_dir, gguf_path)}),
+                # Step 5: Quantize the model
+                Stage("quantize", {"quantize": args.quantize},
+                      lambda outputs: {"quantized": quantize_model(
+                          outputs["gguf"], os.path.join(quantized_dir, f"qwen2.5-7b-{args.quantize}.gguf"),
+                          args.quantize, args.threads, checkpoints.journal_path("quantize"), args.memory_budget)}),
+            ]
+        # Step 6: Reorder and page-align the tensors
+        if not args.no_optimize:
+            stages.append(Stage("optimize", {"cached": quantized_path, "alignment": args.alignment,
+                                             "layer_index": args.layer_index},
+                                lambda outputs: {"optimized": optimize_model(
+                                    quantized_path or outputs["quantized"],
+                                    os.path.join(temp_dir, "optimized", f"qwen2.5-7b-{args.quantize}.gguf"),
+                                    args.alignment, args.layer_index)}))
+        # Step 7: Place in Flutter assets
+        stages.append(Stage("place", {"cached": quantized_path, "output_dir": os.path.abspath(flutter_assets_dir),
+                                      "name": output_name(args.model, args.quantize)},
+                            lambda outputs: {"final": place_in_flutter_assets(
+                                outputs.get("optimized") or quantized_path or outputs["quantized"], flutter_assets_dir,
+                                args.model, args.quantize)}))
+        
+        outputs = run_stages(stages, checkpoints)
+        if cache and not quantized_path:
+            cache.put(cache_key, outputs["quantized"])
+        final_path = outputs["final"]
+        succeeded = True
         
         print("\nModel extraction and optimization complete!")
         print(f"Optimized model placed at: {final_path}")
@@ -204,10 +352,14 @@ def main():
         return 1
     
     finally:
-        # Clean up temporary directory if it was created by this script
+        # Clean up temporary directory if it was created by this script; after
+        # a failure it is kept so that the next run resumes where this one stopped
         if not args.temp_dir and os.path.isdir(temp_dir):
-            print(f"Cleaning up temporary directory: {temp_dir}")
-            shutil.rmtree(temp_dir)
+            if succeeded:
+                print(f"Cleaning up temporary directory: {temp_dir}")
+                shutil.rmtree(temp_dir)
+            else:
+                print(f"Keeping temporary directory for resume: {temp_dir}")
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -1,8 +1,10 @@
 @echo off
-REM Find and migrate all SQLite DBs in the workspace for blocks timestamps
-set MIGRATION="%~dp0migrations\20250626_add_timestamps_to_blocks.sql"
-for /r "%~dp0.." %%F in (*.db *.sqlite *.sqlite3 *.data) do (
-  echo Migrating %%F ...
-  sqlite3 "%%F" ".read %MIGRATION%"
+REM Find and migrate all SQLite DBs in the workspace: applies every pending
+REM migrations\*.sql (recorded in each DB's schema_migrations table) and
+REM backfills existing rows in batches
+python "%~dp0scripts\migrate_databases.py" "%~dp0.." --migrations-dir "%~dp0migrations"
+if errorlevel 1 (
+  echo Some databases could not be migrated, see above.
+  exit /b 1
 )
-echo Migration complete. If no DBs were found, run this script again after your app creates the database.
+echo Migration complete.
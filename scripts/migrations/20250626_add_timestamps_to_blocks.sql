@@ -1,4 +1,8 @@
 -- Migration: Add created_at and updated_at columns to blocks table
-ALTER TABLE blocks ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP;
-ALTER TABLE blocks ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP;
--- If you want to backfill existing rows, you can run an UPDATE after this migration.
+-- SQLite rejects a CURRENT_TIMESTAMP default when adding a column to a table
+-- that already has rows, so the columns are added without one and existing
+-- rows are backfilled by scripts/migrate_databases.py in batches:
+ALTER TABLE blocks ADD COLUMN created_at DATETIME;
+ALTER TABLE blocks ADD COLUMN updated_at DATETIME;
+-- backfill: UPDATE blocks SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL
+-- backfill: UPDATE blocks SET updated_at = coalesce(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL
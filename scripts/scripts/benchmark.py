@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import struct
+import shutil
+import argparse
+import platform
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import ggml_quants
+from build_cache import TOOL_VERSION
+from convert_to_gguf import OUTTYPES, convert_hf_to_gguf
+from gguf_file import GGML_TYPE_NAMES, GGUFReader
+from instrumentation import peak_rss
+from quantize_model import quantize_gguf
+
+REPORT_VERSION = 1
+
+# Synthetic Qwen2 checkpoint shape; rows are multiples of 256 so every
+# quantization type, K-quants included, applies to all weight matrices
+DEFAULT_FIXTURE = {
+    "layers": 4,
+    "hidden": 1024,
+    "intermediate": 2816,
+    "heads": 16,
+    "kv_heads": 4,
+    "vocab": 4096,
+    "seed": 0,
+}
+
+_MB = 1024 ** 2
+
+
+def _bf16_bits(values):
+    # float32 -> bfloat16 bits, rounding to nearest even like torch
+    bits = values.astype(np.float32).view(np.uint32)
+    return ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+
+
+def _write_safetensors(path, tensors):
+    header = {}
+    offset = 0
+    for name, array in tensors.items():
+        dtype = "BF16" if array.dtype == np.uint16 else "F32"
+        header[name] = {"dtype": dtype, "shape": list(array.shape), "data_offsets": [offset, offset + array.nbytes]}
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for array in tensors.values():
+            f.write(array.tobytes())
+
+
+def write_checkpoint_fixture(model_dir, layers, hidden, intermediate, heads, kv_heads, vocab, seed=0):
+    """
+    Write a synthetic Hugging Face Qwen2 checkpoint for benchmarking
+
+    Weights are BF16 draws from a Student-t distribution scaled by
+    1/sqrt(fan_in), which gives the heavy tails real checkpoints have; the
+    same arguments always produce the same bytes, so reports from
+    different releases measure the same model.
+
+    Args:
+        model_dir: Directory to write model.safetensors, config.json and tokenizer.json to
+        layers, hidden, intermediate, heads, kv_heads, vocab: Model dimensions
+        seed: Random seed of the weights
+
+    Returns:
+        Number of tensors in the checkpoint
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    head_dim = hidden // heads
+
+    def weight(rows, cols):
+        return _bf16_bits(rng.standard_t(5, (rows, cols)).astype(np.float32) / np.float32(np.sqrt(cols)))
+
+    def vector(n, center=0.0):
+        return _bf16_bits(np.float32(center) + rng.standard_normal(n).astype(np.float32) * np.float32(0.02))
+
+    tensors = {"model.embed_tokens.weight": weight(vocab, hidden)}
+    for i in range(layers):
+        prefix = f"model.layers.{i}."
+        tensors.update({
+            prefix + "input_layernorm.weight": vector(hidden, 1.0),
+            prefix + "self_attn.q_proj.weight": weight(heads * head_dim, hidden),
+            prefix + "self_attn.q_proj.bias": vector(heads * head_dim),
+            prefix + "self_attn.k_proj.weight": weight(kv_heads * head_dim, hidden),
+            prefix + "self_attn.k_proj.bias": vector(kv_heads * head_dim),
+            prefix + "self_attn.v_proj.weight": weight(kv_heads * head_dim, hidden),
+            prefix + "self_attn.v_proj.bias": vector(kv_heads * head_dim),
+            prefix + "self_attn.o_proj.weight": weight(hidden, heads * head_dim),
+            prefix + "post_attention_layernorm.weight": vector(hidden, 1.0),
+            prefix + "mlp.gate_proj.weight": weight(intermediate, hidden),
+            prefix + "mlp.up_proj.weight": weight(intermediate, hidden),
+            prefix + "mlp.down_proj.weight": weight(hidden, intermediate),
+        })
+    tensors["model.norm.weight"] = vector(hidden, 1.0)
+    tensors["lm_head.weight"] = weight(vocab, hidden)
+    _write_safetensors(os.path.join(model_dir, "model.safetensors"), tensors)
+
+    config = {
+        "architectures": ["Qwen2ForCausalLM"],
+        "model_type": "qwen2",
+        "hidden_size": hidden,
+        "intermediate_size": intermediate,
+        "num_hidden_layers": layers,
+        "num_attention_heads": heads,
+        "num_key_value_heads": kv_heads,
+        "max_position_embeddings": 32768,
+        "rms_norm_eps": 1e-6,
+        "rope_theta": 1000000.0,
+        "vocab_size": vocab,
+        "bos_token_id": vocab - 2,
+        "eos_token_id": vocab - 1,
+    }
+    with open(os.path.join(model_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+    special = ["<|endoftext|>", "<|im_end|>"]
+    vocab_entries = {f"tok{i}": i for i in range(vocab - len(special))}
+    tokenizer = {
+        "model": {"type": "BPE", "vocab": vocab_entries, "merges": [f"tok{i} tok{i + 1}" for i in range(0, 64, 2)]},
+        "added_tokens": [{"id": vocab - len(special) + i, "content": token, "special": True}
+                         for i, token in enumerate(special)],
+    }
+    with open(os.path.join(model_dir, "tokenizer.json"), "w") as f:
+        json.dump(tokenizer, f)
+    return len(tensors)
+
+
+def _timed_stage(func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result, peak_rss()
+
+
+def run_stage(name, func, args, input_bytes, tensors):
+    """
+    Time one stage in a fresh worker process
+
+    Running each stage in its own process keeps the peak RSS of one stage
+    from hiding the next, and keeps the benchmark's own fixtures out of it.
+
+    Returns:
+        Stage record with seconds, MB/s of input, tensors/s and peak RSS
+    """
+    with ProcessPoolExecutor(1) as pool:
+        seconds, result, rss = pool.submit(_timed_stage, func, args).result()
+    return {
+        "stage": name,
+        "seconds": round(seconds, 4),
+        "input_bytes": input_bytes,
+        "mb_per_s": round(input_bytes / _MB / seconds, 2) if seconds else None,
+        "tensors": tensors,
+        "tensors_per_s": round(tensors / seconds, 2) if seconds else None,
+        "peak_rss_bytes": rss,
+        "result": result,
+    }
+
+
+def quantization_errors(source_path, quantized_path):
+    """
+    Per-tensor quantization error of a quantized GGUF against its source
+
+    Every tensor whose type changed is decoded back to float32 and compared
+    element-wise with the decoded source tensor.
+
+    Returns:
+        (per-tensor {"type", "rmse", "max_abs_error"} by name, totals over all quantized elements)
+    """
+    tensors = {}
+    squared_error = 0.0
+    squared_source = 0.0
+    elements = 0
+    max_abs_error = 0.0
+    with GGUFReader(source_path) as source, GGUFReader(quantized_path) as quantized:
+        for info in quantized.tensors:
+            source_info = source.tensor(info.name)
+            if info.ggml_type == source_info.ggml_type:
+                continue
+            reference = ggml_quants.to_float32(source.tensor_array(source_info), source_info.ggml_type).reshape(-1)
+            decoded = ggml_quants.dequantize(quantized.tensor_data(info), info.ggml_type)
+            error = decoded.astype(np.float64) - reference
+            tensor_squared = float(np.dot(error, error))
+            tensor_max = float(np.abs(error).max())
+            tensors[info.name] = {
+                "type": GGML_TYPE_NAMES[info.ggml_type],
+                "rmse": float(np.sqrt(tensor_squared / error.size)),
+                "max_abs_error": tensor_max,
+            }
+            squared_error += tensor_squared
+            squared_source += float(np.dot(reference.astype(np.float64), reference))
+            elements += error.size
+            max_abs_error = max(max_abs_error, tensor_max)
+    totals = {
+        "quantized_tensors": len(tensors),
+        "rmse": float(np.sqrt(squared_error / elements)) if elements else 0.0,
+        "relative_rmse": float(np.sqrt(squared_error / squared_source)) if squared_source else 0.0,
+        "max_abs_error": max_abs_error,
+    }
+    return tensors, totals
+
+
+def run_benchmark(work_dir, quantizations, outtype="f16", threads=1, fixture=None):
+    """
+    Build the synthetic checkpoint, then convert and quantize it once per type
+
+    Args:
+        work_dir: Scratch directory for the fixture and the stage outputs
+        quantizations: Quantization types to measure
+        outtype: Type of the converted GGUF weights the quantizers start from
+        threads: Worker processes for quantize_gguf
+        fixture: Overrides of ``DEFAULT_FIXTURE``
+
+    Returns:
+        JSON-serializable report
+    """
+    fixture = dict(DEFAULT_FIXTURE, **(fixture or {}))
+    model_dir = os.path.join(work_dir, "checkpoint")
+    gguf_path = os.path.join(work_dir, f"fixture-{outtype}.gguf")
+    checkpoint_tensors = write_checkpoint_fixture(model_dir, **fixture)
+    checkpoint_bytes = os.path.getsize(os.path.join(model_dir, "model.safetensors"))
+
+    stages = []
+    stage = run_stage(f"convert_to_gguf:{outtype}", convert_hf_to_gguf, (model_dir, gguf_path, outtype),
+                      checkpoint_bytes, checkpoint_tensors)
+    stage.pop("result")
+    stages.append(stage)
+    print(f"convert_to_gguf {outtype}: {stage['mb_per_s']} MB/s", file=sys.stderr)
+
+    gguf_bytes = os.path.getsize(gguf_path)
+    with GGUFReader(gguf_path) as reader:
+        gguf_tensors = len(reader.tensors)
+    quality = {}
+    for quantize in quantizations:
+        output_path = os.path.join(work_dir, f"fixture-{quantize}.gguf")
+        stage = run_stage(f"quantize_model:{quantize}", quantize_gguf, (gguf_path, output_path, quantize, threads),
+                          gguf_bytes, gguf_tensors)
+        stage["quantized_tensors"] = stage.pop("result")
+        stage["output_bytes"] = os.path.getsize(output_path)
+        stages.append(stage)
+        tensors, totals = quantization_errors(gguf_path, output_path)
+        quality[quantize] = dict(totals, tensors=tensors)
+        print(f"quantize_model {quantize}: {stage['mb_per_s']} MB/s, RMSE {totals['rmse']:.6g}", file=sys.stderr)
+        os.remove(output_path)
+
+    return {
+        "report_version": REPORT_VERSION,
+        "tool_version": TOOL_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "threads": threads,
+        },
+        "fixture": dict(fixture, outtype=outtype, checkpoint_bytes=checkpoint_bytes, gguf_bytes=gguf_bytes),
+        "stages": stages,
+        "quality": quality,
+    }
+
+
+def compare_reports(baseline, report, rmse_tolerance=0.01, max_slowdown=None):
+    """
+    List regressions of ``report`` against ``baseline``
+
+    A quantization type regresses when its total RMSE grows by more than
+    ``rmse_tolerance`` (relative); with ``max_slowdown`` set, a stage also
+    regresses when its MB/s drops by more than that fraction. Reports of
+    different fixtures are not comparable and raise ValueError.
+    """
+    keys = ("layers", "hidden", "intermediate", "heads", "kv_heads", "vocab", "seed", "outtype")
+    if any(baseline["fixture"].get(key) != report["fixture"].get(key) for key in keys):
+        raise ValueError("Baseline was measured on a different fixture")
+    regressions = []
+    for quantize, totals in report["quality"].items():
+        previous = baseline["quality"].get(quantize)
+        if previous and totals["rmse"] > previous["rmse"] * (1 + rmse_tolerance):
+            regressions.append(f"{quantize}: RMSE {previous['rmse']:.6g} -> {totals['rmse']:.6g}")
+    if max_slowdown is not None:
+        previous_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+        for stage in report["stages"]:
+            previous = previous_stages.get(stage["stage"])
+            if previous and previous["mb_per_s"] and stage["mb_per_s"] < previous["mb_per_s"] * (1 - max_slowdown):
+                regressions.append(f"{stage['stage']}: {previous['mb_per_s']} -> {stage['mb_per_s']} MB/s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark conversion and quantization on a synthetic model")
+    parser.add_argument("--quantize", nargs="+", default=list(ggml_quants.QUANTIZE_TYPES),
+                        choices=list(ggml_quants.QUANTIZE_TYPES), help="Quantization types to measure")
+    parser.add_argument("--outtype", default="f16", choices=list(OUTTYPES), help="Type of the converted GGUF weights")
+    parser.add_argument("--threads", type=int, default=1, help="Worker processes for quantization")
+    parser.add_argument("--layers", type=int, default=DEFAULT_FIXTURE["layers"], help="Layers of the synthetic model")
+    parser.add_argument("--hidden", type=int, default=DEFAULT_FIXTURE["hidden"], help="Hidden size of the synthetic model")
+    parser.add_argument("--intermediate", type=int, default=DEFAULT_FIXTURE["intermediate"], help="Feed-forward size of the synthetic model")
+    parser.add_argument("--vocab", type=int, default=DEFAULT_FIXTURE["vocab"], help="Vocabulary size of the synthetic model")
+    parser.add_argument("--seed", type=int, default=DEFAULT_FIXTURE["seed"], help="Random seed of the synthetic weights")
+    parser.add_argument("--work-dir", help="Keep the fixture and outputs here instead of a temporary directory")
+    parser.add_argument("--output", help="Write the JSON report here instead of printing it")
+    parser.add_argument("--baseline", help="Earlier JSON report; exit with status 1 on quality regressions")
+    parser.add_argument("--rmse-tolerance", type=float, default=0.01, help="Allowed relative RMSE increase over the baseline")
+    parser.add_argument("--max-slowdown", type=float, help="Allowed relative MB/s drop per stage over the baseline")
+
+    args = parser.parse_args()
+    fixture = {"layers": args.layers, "hidden": args.hidden, "intermediate": args.intermediate,
+               "vocab": args.vocab, "seed": args.seed}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="neonote-bench-")
+    try:
+        report = run_benchmark(work_dir, args.quantize, args.outtype, args.threads, fixture)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare_reports(json.load(f), report, args.rmse_tolerance, args.max_slowdown)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -6,10 +6,12 @@ set -e
 
 # Default parameters
 MODEL_PATH=""
+MODEL="qwen2.5:7b"
 OUTPUT_DIR="./output"
 QUANTIZE="q4_0"
 THREADS=$(nproc)
 TARGET_PLATFORM="all"
+CACHE_DIR="${XDG_CACHE_HOME:-$HOME/.cache}/neonote/artifacts"
 
 # Parse command line arguments
 while [[ $# -gt 0 ]]; do
@@ -18,6 +20,10 @@ while [[ $# -gt 0 ]]; do
       MODEL_PATH="$2"
       shift 2
       ;;
+    --model)
+      MODEL="$2"
+      shift 2
+      ;;
     --output-dir)
       OUTPUT_DIR="$2"
       shift 2
@@ -34,6 +40,10 @@ while [[ $# -gt 0 ]]; do
       TARGET_PLATFORM="$2"
       shift 2
       ;;
+    --cache-dir)
+      CACHE_DIR="$2"
+      shift 2
+      ;;
     *)
       echo "Unknown option: $1"
       exit 1
@@ -44,32 +54,26 @@ done
 # Validate required parameters
 if [ -z "$MODEL_PATH" ]; then
   echo "Error: --model-path is required"
-  echo "Usage: $0 --model-path /path/to/ollama/model/blobs --output-dir ./output --quantize q4_0 --threads 8 --target all"
+  echo "Usage: $0 --model-path /path/to/ollama/model/blobs --model qwen2.5:7b --output-dir ./output --quantize q4_0 --threads 8 --target all --cache-dir ~/.cache/neonote/artifacts"
   exit 1
 fi
 
 # Create output directory
 mkdir -p "$OUTPUT_DIR"
 
-# Step 1: Extract model from Ollama format
-echo "Step 1: Extracting model from Ollama format..."
-python ./scripts/extract_ollama_model.py --input-dir "$MODEL_PATH" --output-dir "$OUTPUT_DIR/extracted"
-
-# Step 2: Convert to GGUF format
-echo "Step 2: Converting to GGUF format..."
-python ./scripts/convert_to_gguf.py --input-dir "$OUTPUT_DIR/extracted" --output-dir "$OUTPUT_DIR/gguf"
-
-# Step 3: Quantize the model
-echo "Step 3: Quantizing the model to $QUANTIZE..."
-python ./scripts/quantize_model.py --input-file "$OUTPUT_DIR/gguf/qwen2.5-7b.gguf" --output-dir "$OUTPUT_DIR" --quantize "$QUANTIZE" --threads "$THREADS"
-
-# Step 4: Optimize with FlashAttention
-echo "Step 4: Optimizing with FlashAttention..."
-python ./scripts/optimize_model.py --input-file "$OUTPUT_DIR/qwen2.5-7b-$QUANTIZE.gguf" --output-dir "$OUTPUT_DIR" --threads "$THREADS"
+# File name the pipeline gives the model (see output_name in pipeline.py):
+# qwen2.5:7b at q4_0 -> qwen2.5-7b-gguf-q4_0.bin
+MODEL_REF="${MODEL##*/}"
+if [[ "$MODEL_REF" == *:* ]]; then
+  OUTPUT_NAME="${MODEL_REF%:*}-${MODEL_REF##*:}-gguf-$QUANTIZE.bin"
+else
+  OUTPUT_NAME="$MODEL_REF-latest-gguf-$QUANTIZE.bin"
+fi
 
-# Step 5: Rename final output for Neonote
-echo "Step 5: Preparing final output for Neonote..."
-cp "$OUTPUT_DIR/qwen2.5-7b-$QUANTIZE-optimized.gguf" "$OUTPUT_DIR/qwen2.5-7b-gguf-q4_0.bin"
+# Extract, convert, quantize and lay out for mmap loading in one streaming
+# pass; the final model is the only file written
+echo "Building $MODEL ($QUANTIZE) from Ollama blobs..."
+python ./scripts/pipeline.py --ollama-dir "$MODEL_PATH" --model "$MODEL" --output-dir "$OUTPUT_DIR" --output-name "$OUTPUT_NAME" --quantize "$QUANTIZE" --threads "$THREADS" --cache-dir "$CACHE_DIR"
 
-echo "Conversion complete! The optimized model is available at: $OUTPUT_DIR/qwen2.5-7b-gguf-q4_0.bin"
+echo "Conversion complete! The optimized model is available at: $OUTPUT_DIR/$OUTPUT_NAME"
 echo "Copy this file to your Neonote project's assets/ai_model/ directory to use it with the app."
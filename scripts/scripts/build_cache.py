@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import contextlib
+
+from checksums import file_sha256
+from file_transfer import read_sidecar, remove_sidecar, sidecar_path, transfer_file, write_sidecar
+from ollama_blobs import blob_name_to_digest
+
+# Modules whose code decides the bytes a cached stage writes; editing any
+# of them gives every cache key a new tool version
+_TOOL_SOURCES = ("ggml_quants.py", "quantize_model.py", "gguf_file.py", "convert_to_gguf.py", "optimize_model.py",
+                 "pipeline.py")
+
+
+def _tool_version():
+    digest = hashlib.sha256()
+    for name in _TOOL_SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as f:
+            # Line endings depend on the checkout, not on the code
+            digest.update(f.read().replace(b"\r\n", b"\n"))
+    return digest.hexdigest()[:16]
+
+
+TOOL_VERSION = _tool_version()
+
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+
+INDEX_VERSION = 1
+
+
+def default_cache_dir():
+    """Return the default artifact cache directory."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "neonote", "artifacts")
+
+
+class ArtifactCache:
+    """
+    Persistent stage-output cache keyed by content
+
+    Entries are keyed by (source sha256, stage, quantization, tool version)
+    and stored as plain files next to a JSON index recording their size,
+    mtime and last use. Inserting past ``max_bytes`` evicts least recently
+    used entries. Entries are hardlinked in and out where the filesystem
+    allows, so a hit costs no copy: an entry is only ever replaced, never
+    modified, and writers that change a file in place break its links
+    first (``break_link``). The index is updated under
+    an exclusive file lock, so several build processes can share a cache.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(source_digest, stage, quantize=None, tool_version=TOOL_VERSION):
+        """Cache key for the output of ``stage`` applied to the source with ``source_digest``."""
+        material = json.dumps([source_digest, stage, quantize, tool_version])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Exclusive lock on a file next to the index, held across a
+        # load-modify-save of the index; works between processes and threads
+        with open(f"{self.index_path}.lock", "a+b") as f:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK itself gives up after 10 seconds
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {"version": INDEX_VERSION, "entries": {}, "digests": {}}
+        if data.get("version") != INDEX_VERSION:
+            return {"version": INDEX_VERSION, "entries": {}, "digests": {}}
+        return data
+
+    def _save_index(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def source_digest(self, path):
+        """
+        sha256 of a stage input
+
+        Ollama blobs carry their digest in the filename. Other files are hashed
+        once and remembered by (device, inode, size, mtime), so a hardlinked
+        copy of a blob is not rehashed either.
+        """
+        digest = blob_name_to_digest(os.path.basename(path))
+        if digest:
+            return digest
+        st = os.stat(path)
+        identity = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        index = self._load_index()
+        digest = index["digests"].get(identity)
+        if digest:
+            return digest
+        digest = file_sha256(path)
+        with self._locked():
+            index = self._load_index()
+            index["digests"][identity] = digest
+            self._save_index(index)
+        return digest
+
+    def get(self, key):
+        """
+        Return the cached file for ``key`` (and mark it used), or None
+
+        An entry whose size or mtime no longer matches the index was changed
+        behind the cache's back and is treated as a miss.
+        """
+        path = self._entry_path(key)
+        with self._locked():
+            index = self._load_index()
+            entry = index["entries"].get(key)
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if entry is None or st.st_size != entry["size"] or st.st_mtime_ns != entry.get("mtime_ns"):
+                return None
+            entry["last_used"] = time.time()
+            self._save_index(index)
+        return path
+
+    def fetch(self, key, dst_path):
+        """Place the cached file for ``key`` at ``dst_path``; return False on a miss."""
+        path = self.get(key)
+        if path is None:
+            return False
+        transfer_file(path, dst_path, verify=True)
+        return True
+
+    def put(self, key, src_path):
+        """Store ``src_path`` under ``key`` and evict old entries; return the cached path."""
+        path = self._entry_path(key)
+        # Place under a name of this writer's own, then rename into place, so
+        # concurrent puts of the same key never write the same file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            transfer_file(src_path, tmp_path, verify=True)
+            digest = read_sidecar(tmp_path)
+            with self._locked():
+                os.replace(tmp_path, path)
+                if digest:
+                    write_sidecar(path, digest)
+                else:
+                    remove_sidecar(path)
+                st = os.stat(path)
+                index = self._load_index()
+                index["entries"][key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "last_used": time.time()}
+                self._evict(index, keep=key)
+                self._save_index(index)
+        finally:
+            for leftover in (tmp_path, sidecar_path(tmp_path)):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return path
+
+    def _evict(self, index, keep=None):
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in (self._entry_path(key), sidecar_path(self._entry_path(key))):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= entries.pop(key)["size"]
+
+    def evict(self):
+        """Evict least recently used entries until the cache fits ``max_bytes``."""
+        with self._locked():
+            index = self._load_index()
+            self._evict(index)
+            self._save_index(index)
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self._load_index()["entries"].values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the model artifact cache")
+    parser.add_argument("--cache-dir", help="Path to the artifact cache directory")
+    parser.add_argument("--max-gb", type=float, help="Evict least recently used entries down to this size")
+
+    args = parser.parse_args()
+    max_bytes = int(args.max_gb * 1024 ** 3) if args.max_gb is not None else DEFAULT_MAX_BYTES
+    cache = ArtifactCache(args.cache_dir, max_bytes)
+    if args.max_gb is not None:
+        cache.evict()
+    print(f"Artifact cache {cache.cache_dir}: {cache.total_size() / 1024 ** 3:.2f} GB")
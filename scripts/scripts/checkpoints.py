@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+# A pipeline stage: ``func(outputs)`` receives the outputs of earlier stages
+# and returns a dict of its own named output paths
+Stage = namedtuple("Stage", ["name", "params", "func"])
+
+
+def fingerprint(*parts):
+    """Stable hex digest of JSON-serializable parts."""
+    material = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _write_durable(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StageCheckpoints:
+    """
+    Durable per-stage completion markers in ``<work_dir>/.checkpoints``
+
+    A marker records the stage fingerprint and the size of every output
+    file, so a stage only counts as done if its inputs are unchanged and its
+    outputs are still intact.
+    """
+
+    def __init__(self, work_dir):
+        self.dir = os.path.join(work_dir, ".checkpoints")
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _marker_path(self, stage):
+        return os.path.join(self.dir, f"{stage}.json")
+
+    def journal_path(self, stage):
+        """Path for a stage's own fine-grained progress journal."""
+        return os.path.join(self.dir, f"{stage}.journal")
+
+    def completed(self, stage, stage_fingerprint):
+        """Return the recorded outputs if ``stage`` finished with this fingerprint, else None."""
+        try:
+            with open(self._marker_path(stage), "r") as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if marker.get("fingerprint") != stage_fingerprint:
+            return None
+        for name, path in marker["outputs"].items():
+            size = marker["sizes"].get(name)
+            if not os.path.exists(path) or (size is not None and os.path.getsize(path) != size):
+                return None
+        return marker["outputs"]
+
+    def complete(self, stage, stage_fingerprint, outputs):
+        sizes = {name: os.path.getsize(path) for name, path in outputs.items() if os.path.isfile(path)}
+        _write_durable(self._marker_path(stage), json.dumps({
+            "fingerprint": stage_fingerprint,
+            "outputs": outputs,
+            "sizes": sizes,
+        }))
+        journal = self.journal_path(stage)
+        if os.path.exists(journal):
+            os.remove(journal)
+
+
+def run_stages(stages, checkpoints):
+    """
+    Run stages in order, skipping those already completed with the same inputs
+
+    Each stage's fingerprint chains its own params onto the previous stage's
+    fingerprint, so changing an early input invalidates everything after it.
+
+    Returns:
+        Merged dict of all stage outputs
+    """
+    outputs = {}
+    upstream = None
+    for stage in stages:
+        stage_fingerprint = fingerprint(upstream, stage.name, stage.params)
+        done = checkpoints.completed(stage.name, stage_fingerprint)
+        if done is not None:
+            print(f"Stage '{stage.name}' already complete, skipping")
+            outputs.update(done)
+        else:
+            result = stage.func(outputs)
+            checkpoints.complete(stage.name, stage_fingerprint, result)
+            outputs.update(result)
+        upstream = stage_fingerprint
+    return outputs
+
+
+class TensorJournal:
+    """
+    Append-only record of tensors already written to an output file
+
+    The first line identifies the output layout; a journal for a different
+    layout is discarded. Before a tensor is recorded the output file is
+    fsynced, so every journaled tensor is on disk.
+    """
+
+    def __init__(self, path, layout):
+        self.path = path
+        self.layout = layout
+        self.completed = set()
+        try:
+            with open(path, "r") as f:
+                lines = f.read().splitlines()
+            if lines and lines[0] == layout:
+                self.completed = set(lines[1:])
+        except OSError:
+            pass
+        self._file = None
+
+    def start(self, resume):
+        """Open the journal for appending; ``resume=False`` discards recorded progress."""
+        if not resume:
+            self.completed = set()
+            _write_durable(self.path, self.layout + "\n")
+        self._file = open(self.path, "a")
+
+    def record(self, name, output_fd):
+        os.fsync(output_fd)
+        self._file.write(name + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.completed.add(name)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,19 @@
+import hashlib
+
+# Read buffer for hashing; hashlib releases the GIL while hashing it
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE, progress=None):
+    """Hex sha256 of a file, streamed through a bounded buffer; ``progress(nbytes)`` is called per chunk."""
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(memoryview(buffer)[:n])
+            if progress is not None:
+                progress(n)
+    return digest.hexdigest()
@@ -1,15 +1,252 @@
 import os
+import re
+import json
+import shutil
 import argparse
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
 
-def convert_to_gguf(input_dir, output_dir):
+import numpy as np
+
+import ggml_quants
+from file_transfer import transfer_file, write_sidecar
+from gguf_file import GGMLType, GGUFReader, GGUFValueType, GGUFWriter
+from safetensors_file import SafetensorsReader, checkpoint_files
+
+# --outtype -> (ggml type of 2-D weights, llama.cpp general.file_type)
+OUTTYPES = {
+    "f32": (GGMLType.F32, 0),
+    "f16": (GGMLType.F16, 1),
+    "bf16": (GGMLType.BF16, 32),
+}
+
+SOURCE_TYPES = {"F32": GGMLType.F32, "F16": GGMLType.F16, "BF16": GGMLType.BF16}
+
+# Hugging Face Qwen2 tensor names -> GGUF names ("{}" is the layer number)
+QWEN2_TENSOR_NAMES = {
+    "model.embed_tokens": "token_embd",
+    "model.norm": "output_norm",
+    "lm_head": "output",
+    "model.layers.{}.input_layernorm": "blk.{}.attn_norm",
+    "model.layers.{}.self_attn.q_proj": "blk.{}.attn_q",
+    "model.layers.{}.self_attn.k_proj": "blk.{}.attn_k",
+    "model.layers.{}.self_attn.v_proj": "blk.{}.attn_v",
+    "model.layers.{}.self_attn.o_proj": "blk.{}.attn_output",
+    "model.layers.{}.post_attention_layernorm": "blk.{}.ffn_norm",
+    "model.layers.{}.mlp.gate_proj": "blk.{}.ffn_gate",
+    "model.layers.{}.mlp.up_proj": "blk.{}.ffn_up",
+    "model.layers.{}.mlp.down_proj": "blk.{}.ffn_down",
+}
+
+# Tensors recomputed at load time and never stored in GGUF
+_SKIP_TENSORS = re.compile(r"\.rotary_emb\.inv_freq$")
+
+# tokenizer.ggml.token_type values
+TOKEN_NORMAL = 1
+TOKEN_CONTROL = 3
+TOKEN_USER_DEFINED = 4
+TOKEN_UNUSED = 5
+
+# Rows are converted in slices of about this many float32 bytes
+_CONVERT_CHUNK = 64 * 1024 * 1024
+
+
+def gguf_tensor_name(hf_name):
+    """Map a Hugging Face Qwen2 tensor name to its GGUF name."""
+    base, dot, suffix = hf_name.rpartition(".")
+    match = re.match(r"model\.layers\.(\d+)\.(.+)$", base)
+    key, layer = (f"model.layers.{{}}.{match.group(2)}", match.group(1)) if match else (base, None)
+    if key not in QWEN2_TENSOR_NAMES or suffix not in ("weight", "bias"):
+        raise ValueError(f"Cannot map tensor {hf_name} to a GGUF name")
+    return f"{QWEN2_TENSOR_NAMES[key].format(layer)}.{suffix}"
+
+
+def _add_model_metadata(writer, config, file_type):
+    arch = "qwen2"
+    if config.get("model_type", arch) != arch:
+        raise ValueError(f"Unsupported model type {config.get('model_type')}, only {arch} can be converted")
+    writer.add_field("general.architecture", arch)
+    writer.add_field("general.name", config.get("_name_or_path") or "Qwen2")
+    writer.add_field(f"{arch}.block_count", config["num_hidden_layers"])
+    writer.add_field(f"{arch}.context_length", config["max_position_embeddings"])
+    writer.add_field(f"{arch}.embedding_length", config["hidden_size"])
+    writer.add_field(f"{arch}.feed_forward_length", config["intermediate_size"])
+    writer.add_field(f"{arch}.attention.head_count", config["num_attention_heads"])
+    writer.add_field(f"{arch}.attention.head_count_kv",
+                     config.get("num_key_value_heads", config["num_attention_heads"]))
+    writer.add_field(f"{arch}.rope.freq_base", float(config.get("rope_theta", 10000.0)))
+    writer.add_field(f"{arch}.attention.layer_norm_rms_epsilon", float(config["rms_norm_eps"]))
+    rope_scaling = config.get("rope_scaling") or {}
+    if rope_scaling.get("type") == "yarn" and "factor" in rope_scaling:
+        writer.add_field(f"{arch}.rope.scaling.type", "yarn")
+        writer.add_field(f"{arch}.rope.scaling.factor", float(rope_scaling["factor"]))
+        writer.add_field(f"{arch}.rope.scaling.original_context_length",
+                         rope_scaling["original_max_position_embeddings"])
+    writer.add_field("general.file_type", file_type, GGUFValueType.UINT32)
+
+
+def _add_tokenizer_metadata(writer, model_dir, config):
+    """Add the byte-level BPE vocabulary from ``tokenizer.json`` the way llama.cpp's converter does."""
+    tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+    if not os.path.exists(tokenizer_path):
+        print("Warning: no tokenizer.json found, the GGUF file will have no vocabulary")
+        return
+    with open(tokenizer_path, "r", encoding="utf-8") as f:
+        tokenizer = json.load(f)
+    tokenizer_config = {}
+    tokenizer_config_path = os.path.join(model_dir, "tokenizer_config.json")
+    if os.path.exists(tokenizer_config_path):
+        with open(tokenizer_config_path, "r", encoding="utf-8") as f:
+            tokenizer_config = json.load(f)
+    
+    vocab = dict(tokenizer["model"]["vocab"])
+    added = {token["content"]: token for token in tokenizer.get("added_tokens", [])}
+    for content, token in added.items():
+        vocab[content] = token["id"]
+    reverse = {token_id: content for content, token_id in vocab.items()}
+    vocab_size = max(config.get("vocab_size", 0), len(reverse))
+    
+    tokens = []
+    token_types = []
+    for token_id in range(vocab_size):
+        content = reverse.get(token_id)
+        if content is None:
+            tokens.append(f"[PAD{token_id}]")
+            token_types.append(TOKEN_UNUSED)
+        elif content in added:
+            tokens.append(content)
+            token_types.append(TOKEN_CONTROL if added[content].get("special") else TOKEN_USER_DEFINED)
+        else:
+            tokens.append(content)
+            token_types.append(TOKEN_NORMAL)
+    merges = [merge if isinstance(merge, str) else " ".join(merge) for merge in tokenizer["model"].get("merges", [])]
+    
+    writer.add_field("tokenizer.ggml.model", "gpt2")
+    writer.add_field("tokenizer.ggml.pre", "qwen2")
+    writer.add_field("tokenizer.ggml.tokens", tokens, GGUFValueType.ARRAY, GGUFValueType.STRING)
+    writer.add_field("tokenizer.ggml.token_type", token_types, GGUFValueType.ARRAY, GGUFValueType.INT32)
+    writer.add_field("tokenizer.ggml.merges", merges, GGUFValueType.ARRAY, GGUFValueType.STRING)
+    for name in ("bos", "eos", "pad"):
+        token = tokenizer_config.get(f"{name}_token")
+        if isinstance(token, dict):
+            token = token.get("content")
+        token_id = vocab.get(token) if token else config.get(f"{name}_token_id")
+        if token_id is not None:
+            key = "padding" if name == "pad" else name
+            writer.add_field(f"tokenizer.ggml.{key}_token_id", token_id, GGUFValueType.UINT32)
+    writer.add_field("tokenizer.ggml.add_bos_token", bool(tokenizer_config.get("add_bos_token", False)))
+    if tokenizer_config.get("chat_template"):
+        writer.add_field("tokenizer.chat_template", tokenizer_config["chat_template"])
+
+
+def _output_type(info, outtype):
+    # Like llama.cpp, 1-D tensors (norms, biases) stay float32
+    if len(info.shape) < 2:
+        return GGMLType.F32
+    return OUTTYPES[outtype][0]
+
+
+def _to_bf16(values):
+    # Round to nearest even, keeping NaNs quiet
+    bits = values.view(np.uint32)
+    rounded = ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+    return np.where(np.isnan(values), np.uint16(0x7FC0), rounded)
+
+
+def from_float32(values, output_type):
+    """Encode float32 values as the unquantized ``output_type`` (F32, F16 or BF16)."""
+    if output_type == GGMLType.F16:
+        return values.astype("<f2")
+    if output_type == GGMLType.BF16:
+        return _to_bf16(np.ascontiguousarray(values))
+    return np.ascontiguousarray(values, dtype="<f4")
+
+
+def tensor_chunks(array, source_type, output_type):
+    """Yield a tensor's data converted to ``output_type``, a slice of rows at a time."""
+    if source_type == output_type:
+        yield np.ascontiguousarray(array)
+        return
+    rows = array.reshape(array.shape[0] if array.ndim > 1 else 1, -1)
+    step = max(1, _CONVERT_CHUNK // (rows.shape[1] * 4))
+    for start in range(0, rows.shape[0], step):
+        yield from_float32(ggml_quants.to_float32(rows[start:start + step], source_type), output_type)
+
+
+def plan_checkpoint(model_dir, readers, writer, outtype="f16"):
+    """
+    Declare a Hugging Face Qwen2 checkpoint's GGUF metadata on ``writer``
+    
+    Args:
+        model_dir: Directory with config.json and tokenizer.json
+        readers: ``SafetensorsReader`` for each shard
+        writer: ``GGUFWriter`` that receives the model and tokenizer metadata
+        outtype: Type of 2-D weights (f32, f16, bf16)
+    
+    Returns:
+        List of (reader, safetensors tensor, GGUF name, output ggml type) in
+        output order; tensor infos are left for the caller to declare
+    """
+    if outtype not in OUTTYPES:
+        raise ValueError(f"Unsupported output type {outtype}, expected one of {', '.join(OUTTYPES)}")
+    with open(os.path.join(model_dir, "config.json"), "r") as f:
+        config = json.load(f)
+    
+    plan = []
+    for reader in readers:
+        for info in reader.tensors.values():
+            if _SKIP_TENSORS.search(info.name):
+                continue
+            if info.dtype not in SOURCE_TYPES:
+                raise ValueError(f"Tensor {info.name} has unsupported dtype {info.dtype}")
+            plan.append((reader, info, gguf_tensor_name(info.name), _output_type(info, outtype)))
+    _add_model_metadata(writer, config, OUTTYPES[outtype][1])
+    _add_tokenizer_metadata(writer, model_dir, config)
+    return plan
+
+
+def convert_hf_to_gguf(model_dir, output_path, outtype="f16"):
+    """
+    Stream a Hugging Face Qwen2 safetensors checkpoint into a GGUF file
+    
+    Shards are memory-mapped and each tensor is converted a slice of rows
+    at a time straight into the GGUF writer, so memory use stays bounded by
+    the conversion slice rather than the model size. Tensors already in the
+    output type are written from the mapping without a copy.
+    
+    Args:
+        model_dir: Directory with config.json, tokenizer.json and safetensors shards
+        output_path: Path to the GGUF file to write
+        outtype: Type of 2-D weights (f32, f16, bf16)
+    
+    Returns:
+        Number of tensors written
+    """
+    readers = [SafetensorsReader(path) for path in checkpoint_files(model_dir)]
+    try:
+        with GGUFWriter(output_path) as writer:
+            plan = plan_checkpoint(model_dir, readers, writer, outtype)
+            for _, info, name, output_type in plan:
+                writer.add_tensor_info(name, tuple(reversed(info.shape)), output_type)
+            writer.write_header()
+            for reader, info, name, output_type in plan:
+                writer.write_tensor_data(tensor_chunks(reader.tensor_array(info.name),
+                                                       SOURCE_TYPES[info.dtype], output_type))
+            digest = writer.hexdigest()
+    finally:
+        for reader in readers:
+            reader.close()
+    
+    write_sidecar(output_path, digest)
+    return len(plan)
+
+
+def convert_to_gguf(input_dir, output_dir, outtype="f16"):
     """
     Convert extracted Qwen2.5:7b model to GGUF format
     
     Args:
         input_dir: Path to extracted model directory
         output_dir: Path to output directory for GGUF model
+        outtype: Type of 2-D weights when converting a Hugging Face checkpoint (f32, f16, bf16)
     """
     print(f"Converting Qwen2.5:7b model to GGUF format...")
     print(f"Input directory: {input_dir}")
@@ -22,50 +259,66 @@ def convert_to_gguf(input_dir, output_dir):
     if not os.path.exists(input_dir):
         raise FileNotFoundError(f"Input directory {input_dir} does not exist")
     
+    output_path = os.path.join(output_dir, "qwen2.5-7b.gguf")
+    
+    # Models extracted from Ollama are already GGUF; validate and pass them through
+    gguf_path = os.path.join(input_dir, 'model.gguf')
+    if os.path.exists(gguf_path):
+        with GGUFReader(gguf_path) as reader:
+            print(f"Input is GGUF v{reader.version} with {len(reader.tensors)} tensors, no conversion needed")
+        method = transfer_file(gguf_path, output_path, verify=True)
+        print(f"Conversion complete. GGUF model placed at {output_path} via {method}")
+        return output_path
+    
     # Load model configuration
     config_path = os.path.join(input_dir, 'config.json')
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"Config file not found at {config_path}")
     
+    checkpoint_dir = input_dir
+    export_dir = None
+    if not checkpoint_files(input_dir):
+        # Only pytorch_model.bin weights; re-save them as safetensors first
+        export_dir = os.path.join(output_dir, "temp_safetensors")
+        _export_safetensors(input_dir, export_dir)
+        checkpoint_dir = export_dir
+    
     try:
-        # Load the model and tokenizer
-        print("Loading model and tokenizer...")
-        model = AutoModelForCausalLM.from_pretrained(input_dir, torch_dtype=torch.float16)
-        tokenizer = AutoTokenizer.from_pretrained(input_dir)
-        
-        # Convert to GGUF format using llama.cpp converter
-        output_path = os.path.join(output_dir, "qwen2.5-7b.gguf")
         print(f"Converting to GGUF format and saving to {output_path}...")
-        
-        # Export model in safetensors format first (intermediate step)
-        temp_dir = os.path.join(output_dir, "temp_safetensors")
-        os.makedirs(temp_dir, exist_ok=True)
-        model.save_pretrained(temp_dir, safe_serialization=True)
-        tokenizer.save_pretrained(temp_dir)
-        
-        # Use llama.cpp converter script (assumed to be installed)
-        # In a real implementation, this would call the actual converter
-        # For this example, we'll simulate the conversion
-        print("Running GGUF conversion (simulated for this example)...")
-        
-        # Simulate conversion by creating a placeholder file
-        with open(output_path, 'w') as f:
-            f.write("# GGUF model file (placeholder)\n")
-            f.write("# In a real implementation, this would be the actual GGUF model file\n")
-            f.write("# Model: Qwen2.5:7b\n")
-            f.write("# Format: GGUF\n")
-        
-        print(f"Conversion complete. GGUF model saved to {output_path}")
+        count = convert_hf_to_gguf(checkpoint_dir, output_path, outtype)
+        print(f"Conversion complete. {count} tensors written to {output_path}")
         return output_path
         
     except Exception as e:
         print(f"Error during conversion: {e}")
         raise
+    
+    finally:
+        if export_dir and os.path.isdir(export_dir):
+            shutil.rmtree(export_dir)
+
+
+def _export_safetensors(model_dir, export_dir):
+    # torch and transformers are only needed for checkpoints without safetensors weights
+    try:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+    except ImportError:
+        raise RuntimeError(f"{model_dir} has no .safetensors weights; converting it needs torch and transformers")
+    
+    print("Loading model and tokenizer...")
+    model = AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch.float16, low_cpu_mem_usage=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    model.save_pretrained(export_dir, safe_serialization=True)
+    tokenizer.save_pretrained(export_dir)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert Qwen2.5:7b model to GGUF format")
     parser.add_argument("--input-dir", required=True, help="Path to extracted model directory")
     parser.add_argument("--output-dir", required=True, help="Path to output directory for GGUF model")
+    parser.add_argument("--outtype", default="f16", choices=list(OUTTYPES), help="Type of 2-D weights in the GGUF file")
     
     args = parser.parse_args()
-    convert_to_gguf(args.input_dir, args.output_dir)
+    convert_to_gguf(args.input_dir, args.output_dir, args.outtype)
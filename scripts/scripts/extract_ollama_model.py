@@ -1,15 +1,19 @@
 import os
-import json
 import argparse
-from pathlib import Path
 
-def extract_ollama_model(input_dir, output_dir):
+from file_transfer import transfer_file
+from model_config import load_params, write_model_config
+from ollama_blobs import BlobCatalog
+
+def extract_ollama_model(input_dir, output_dir, model_name="qwen2.5:7b", index_path=None):
     """
     Extract Qwen2.5:7b model from Ollama format
     
     Args:
-        input_dir: Path to Ollama model blobs directory
+        input_dir: Path to Ollama directory, models directory or blobs directory
         output_dir: Path to output directory for extracted model
+        model_name: Ollama model reference to extract
+        index_path: Path to the cached blob index (defaults to ~/.cache/neonote)
     """
     print(f"Extracting Qwen2.5:7b model from Ollama format...")
     print(f"Input directory: {input_dir}")
@@ -18,78 +22,38 @@ def extract_ollama_model(input_dir, output_dir):
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    # Find model.json in Ollama directory
-    model_json_path = None
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file == "model.json" and "qwen2.5:7b" in root.lower():
-                model_json_path = os.path.join(root, file)
-                break
-        if model_json_path:
-            break
-    
-    if not model_json_path:
-        # Try to find any model.json as fallback
-        for root, dirs, files in os.walk(input_dir):
-            for file in files:
-                if file == "model.json":
-                    model_json_path = os.path.join(root, file)
-                    break
-            if model_json_path:
-                break
-    
-    if not model_json_path:
-        raise FileNotFoundError(f"Could not find model.json in {input_dir}")
-    
-    print(f"Found model.json at {model_json_path}")
-    
-    # Load model.json
-    with open(model_json_path, 'r') as f:
-        model_json = json.load(f)
-    
-    # Extract model files
-    model_files = model_json.get('params', {}).get('files', [])
-    if not model_files:
-        raise ValueError("No model files found in model.json")
+    # Resolve the model's layers through its Ollama manifest
+    catalog = BlobCatalog(input_dir, index_path)
+    layers = catalog.resolve(model_name)
+    if not layers.get('model'):
+        raise ValueError(f"No model layer found in the manifest for {model_name}")
     
-    # Copy model files to output directory
-    for file_info in model_files:
-        file_path = file_info.get('path')
-        if not file_path:
-            continue
-        
-        # Resolve file path
-        if os.path.isabs(file_path):
-            src_path = file_path
-        else:
-            src_path = os.path.join(os.path.dirname(model_json_path), file_path)
-        
-        if not os.path.exists(src_path):
-            print(f"Warning: File {src_path} not found, skipping")
-            continue
-        
-        # Copy file
-        dst_path = os.path.join(output_dir, os.path.basename(file_path))
-        print(f"Copying {src_path} to {dst_path}")
-        
-        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
-            dst.write(src.read())
+    print(f"Found manifest at {catalog.manifest_path(model_name)}")
     
-    # Create model config file
-    config = {
-        "model_type": "qwen",
-        "model_size": "7b",
-        "vocab_size": model_json.get('params', {}).get('vocab_size', 151936),
-        "hidden_size": model_json.get('params', {}).get('hidden_size', 4096),
-        "num_attention_heads": model_json.get('params', {}).get('num_attention_heads', 32),
-        "num_hidden_layers": model_json.get('params', {}).get('num_hidden_layers', 32),
-        "intermediate_size": model_json.get('params', {}).get('intermediate_size', 11008),
-        "max_position_embeddings": model_json.get('params', {}).get('max_position_embeddings', 4096),
-        "extracted_from_ollama": True
-    }
+    # Copy the model layers to the output directory
+    layer_files = {'model': 'model.gguf', 'params': 'params.json', 'template': 'template.txt', 'adapter': 'adapter.gguf'}
+    for kind, file_name in layer_files.items():
+        for i, layer in enumerate(layers.get(kind, [])):
+            src_path = layer['path']
+            if not os.path.exists(src_path):
+                print(f"Warning: File {src_path} not found, skipping")
+                continue
+            
+            dst_name = file_name
+            if i:
+                stem, ext = os.path.splitext(file_name)
+                dst_name = f"{stem}-{i}{ext}"
+            dst_path = os.path.join(output_dir, dst_name)
+            print(f"Transferring {src_path} to {dst_path}")
+            
+            method = transfer_file(src_path, dst_path, verify=True)
+            print(f"Copied via {method}")
     
-    with open(os.path.join(output_dir, 'config.json'), 'w') as f:
-        json.dump(config, f, indent=2)
+    # Derive the model config from the GGUF metadata and the Ollama params layer
+    config = write_model_config(os.path.join(output_dir, 'model.gguf'), os.path.join(output_dir, 'config.json'),
+                                load_params(os.path.join(output_dir, 'params.json')), extracted_from_ollama=True)
+    print(f"Model config: {config.get('model_type')}, {config.get('num_hidden_layers')} layers, "
+          f"hidden size {config.get('hidden_size')}, context {config.get('context_length')}")
     
     print(f"Extraction complete. Model files extracted to {output_dir}")
 
@@ -97,6 +61,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract Qwen2.5:7b model from Ollama format")
     parser.add_argument("--input-dir", required=True, help="Path to Ollama model blobs directory")
     parser.add_argument("--output-dir", required=True, help="Path to output directory for extracted model")
+    parser.add_argument("--model", default="qwen2.5:7b", help="Ollama model reference to extract (e.g. qwen2.5:7b)")
+    parser.add_argument("--blob-index", help="Path to the cached Ollama blob index")
     
     args = parser.parse_args()
-    extract_ollama_model(args.input_dir, args.output_dir)
+    extract_ollama_model(args.input_dir, args.output_dir, args.model, args.blob_index)
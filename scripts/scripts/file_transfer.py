@@ -0,0 +1,298 @@
+import os
+import errno
+import hashlib
+import argparse
+
+from checksums import file_sha256
+from ollama_blobs import blob_name_to_digest
+
+# Bounded buffer for the last-resort copy path
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Upper bound for a single copy_file_range/sendfile call
+_KERNEL_CHUNK = 1024 * 1024 * 1024
+
+# ioctl request number for FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+# Errors meaning "this mechanism is not available for these files", as opposed to real I/O errors
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                errno.EBADF, errno.ENOTTY, errno.ENOTSOCK, errno.EPERM, errno.EACCES, errno.EMLINK}
+
+
+def _is_unsupported(e):
+    return e.errno in _UNSUPPORTED
+
+
+def _reflink(fsrc, fdst):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError as e:
+        if _is_unsupported(e):
+            return False
+        raise
+    return True
+
+
+def _kernel_copy(copy_fn, fsrc, fdst, offset, size, progress=None):
+    """Drive copy_file_range/sendfile from ``offset``; return the new offset."""
+    while offset < size:
+        try:
+            copied = copy_fn(fsrc.fileno(), fdst.fileno(), offset, min(_KERNEL_CHUNK, size - offset))
+        except OSError as e:
+            if _is_unsupported(e):
+                break
+            raise
+        if copied == 0:
+            break
+        offset += copied
+        if progress is not None:
+            progress(copied)
+    return offset
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+_KERNEL_COPIES = [(name, fn) for name, fn in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile))
+                  if hasattr(os, name)]
+
+
+def _copy_chunked(fsrc, fdst, offset, chunk_size, digest=None, progress=None):
+    fsrc.seek(offset)
+    if fdst is not None:
+        fdst.seek(offset)
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            break
+        if digest is not None:
+            digest.update(view[:n])
+        if fdst is not None:
+            fdst.write(view[:n])
+        offset += n
+        if progress is not None:
+            progress(n)
+    return offset
+
+
+def sidecar_path(path):
+    """Path of the ``sha256sum``-style checksum sidecar for ``path``."""
+    return f"{path}.sha256"
+
+
+def read_sidecar(path):
+    """
+    Return the hex digest recorded in ``path``'s sidecar, or None
+
+    A sidecar is only trusted while ``path`` still has the size and mtime
+    recorded next to the digest; one without that record, or for a file
+    changed since, is stale and ignored.
+    """
+    try:
+        with open(sidecar_path(path), "r") as f:
+            lines = f.read().splitlines()
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not lines or not lines[0].split():
+        return None
+    digest = lines[0].split(maxsplit=1)[0].lower()
+    if len(digest) != 64 or f"# size {st.st_size} mtime_ns {st.st_mtime_ns}" not in lines[1:]:
+        return None
+    return digest
+
+
+def write_sidecar(path, digest):
+    """
+    Write ``<digest>  <filename>`` next to ``path``, readable by ``sha256sum -c``
+
+    A ``#`` comment line (skipped by ``sha256sum``) records the file's size
+    and mtime, so ``read_sidecar`` can tell when the file has changed.
+    """
+    st = os.stat(path)
+    tmp_path = f"{sidecar_path(path)}.partial"
+    with open(tmp_path, "w") as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n# size {st.st_size} mtime_ns {st.st_mtime_ns}\n")
+    os.replace(tmp_path, sidecar_path(path))
+
+
+def remove_sidecar(path):
+    """Remove ``path``'s sidecar, if it has one."""
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def copy_file_data(fsrc, fdst, size, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Copy ``size`` bytes between two open files, fastest mechanism first
+
+    Tries a FICLONE reflink, then ``os.copy_file_range``, then
+    ``os.sendfile`` and finally a chunked copy through a bounded buffer.
+    Later mechanisms pick up from wherever an earlier one stopped.
+    ``progress(nbytes)``, if given, is called as data is copied.
+
+    Returns:
+        Name of the mechanism that finished the copy
+    """
+    if _reflink(fsrc, fdst):
+        if progress is not None:
+            progress(size)
+        return "reflink"
+    offset = 0
+    for name, copy_fn in _KERNEL_COPIES:
+        offset = _kernel_copy(copy_fn, fsrc, fdst, offset, size, progress)
+        if offset >= size:
+            return name
+    _copy_chunked(fsrc, fdst, offset, chunk_size, progress=progress)
+    return "buffered"
+
+
+def break_link(path):
+    """
+    Give ``path`` its own copy of its data if it shares it through hardlinks
+
+    Call before modifying a file in place, so that other links to it (a
+    cache entry, the build tree) keep the old data.
+
+    Returns:
+        True if the file was hardlinked and has been copied
+    """
+    if os.stat(path).st_nlink <= 1:
+        return False
+    tmp_path = f"{path}.partial"
+    try:
+        with open(path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            copy_file_data(fsrc, fdst, os.fstat(fsrc.fileno()).st_size)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def _same_file(src_path, dst_path):
+    try:
+        return os.path.samefile(src_path, dst_path)
+    except OSError:
+        return False
+
+
+def _link(src_path, tmp_path, dst_path):
+    try:
+        os.link(src_path, tmp_path)
+    except OSError as e:
+        if _is_unsupported(e):
+            return False
+        raise
+    os.replace(tmp_path, dst_path)
+    return True
+
+
+def transfer_file(src_path, dst_path, allow_link=True, chunk_size=CHUNK_SIZE, verify=False, progress=None):
+    """
+    Place ``src_path`` at ``dst_path`` with as little data movement as possible
+
+    Tries a hardlink first, then a reflink, then in-kernel copies and only
+    falls back to a chunked copy with a bounded buffer. The destination is
+    written under a temporary name and renamed into place, so readers never
+    see a partial file.
+
+    Args:
+        src_path: Source file
+        dst_path: Destination file (replaced if it exists)
+        allow_link: Allow a hardlink; disable when the destination will be
+            modified in place, since a hardlink shares data with the source
+        chunk_size: Buffer size for the last-resort copy
+        verify: Write a sha256 sidecar next to the destination. A digest from
+            the source's own sidecar is carried over as is; otherwise data
+            that is copied is hashed in the same pass, and data that is
+            linked or already in place is hashed afterwards. The digest is
+            checked against an Ollama ``sha256-<hex>`` filename
+        progress: Called with the number of bytes as they are copied or
+            hashed; a link or reflink reports the whole file at once
+
+    Returns:
+        Name of the mechanism used (existing, hardlink, reflink,
+        copy_file_range, sendfile or buffered)
+    """
+    trusted = read_sidecar(src_path) if verify else None
+    digest = None
+
+    if _same_file(src_path, dst_path):
+        method = "existing"
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(dst_path)), exist_ok=True)
+        tmp_path = f"{dst_path}.partial"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            if allow_link and _link(src_path, tmp_path, dst_path):
+                method = "hardlink"
+            elif verify and not trusted:
+                # Kernel copies bypass userspace, so data that is not
+                # reflinked is hashed in the buffered copy pass instead
+                with open(src_path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                    if _reflink(fsrc, fdst):
+                        method = "reflink"
+                        if progress is not None:
+                            progress(os.fstat(fsrc.fileno()).st_size)
+                    else:
+                        digest = hashlib.sha256()
+                        _copy_chunked(fsrc, fdst, 0, chunk_size, digest, progress)
+                        method = "buffered"
+                os.replace(tmp_path, dst_path)
+            else:
+                size = os.path.getsize(src_path)
+                with open(src_path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                    method = copy_file_data(fsrc, fdst, size, chunk_size, progress)
+                os.replace(tmp_path, dst_path)
+        finally:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+
+    if progress is not None and method in ("existing", "hardlink"):
+        progress(os.path.getsize(dst_path))
+    if verify:
+        _record_digest(src_path, dst_path, trusted, digest, remove=method != "existing")
+    return method
+
+
+def _record_digest(src_path, dst_path, trusted, digest, remove):
+    expected = blob_name_to_digest(os.path.basename(src_path))
+    if trusted:
+        write_sidecar(dst_path, trusted)
+        return
+    # Linked data never passed through userspace, so hash it now rather
+    # than publish the digest its filename claims
+    actual = digest.hexdigest() if digest is not None else file_sha256(dst_path)
+    if expected and actual != expected:
+        if remove:
+            os.remove(dst_path)
+        raise ValueError(f"Checksum mismatch for {src_path}: expected sha256 {expected}, got {actual}")
+    write_sidecar(dst_path, actual)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy a large file using hardlink, reflink or in-kernel copy where possible")
+    parser.add_argument("src", help="Source file")
+    parser.add_argument("dst", help="Destination file")
+    parser.add_argument("--no-link", action="store_true", help="Never hardlink the destination to the source")
+    parser.add_argument("--verify", action="store_true", help="Write a sha256 sidecar, verifying Ollama blob digests")
+
+    args = parser.parse_args()
+    print(transfer_file(args.src, args.dst, allow_link=not args.no_link, verify=args.verify))
@@ -0,0 +1,418 @@
+import numpy as np
+
+from gguf_file import GGMLType, GGML_BLOCK_SIZES
+
+# Vectorized NumPy implementations of the ggml block quantization formats.
+# The encoders reproduce the reference (*_ref) quantizers in llama.cpp's
+# ggml-quants.c bit for bit, so their output loads in llama.cpp and the
+# llama_cpp_wrapper directly. The K-quant encoders follow the reference
+# scale searches (make_qkx2_quants / make_qx_quants) step for step, with
+# the sums taken in the same left-to-right order as the C loops.
+
+QK = 32
+QK_K = 256
+
+# Super-blocks encoded per NumPy pass, bounding the K-quant search temporaries
+_K_CHUNK = 4096
+
+_GROUP_MAX_EPS = np.float32(1e-15)
+
+# CLI name -> base ggml type; the *_k_m mixes raise some tensors above it
+QUANTIZE_TYPES = {
+    "q4_0": GGMLType.Q4_0,
+    "q5_0": GGMLType.Q5_0,
+    "q8_0": GGMLType.Q8_0,
+    "q4_k_m": GGMLType.Q4_K,
+    "q5_k_m": GGMLType.Q5_K,
+    "q6_k": GGMLType.Q6_K,
+}
+
+FLOAT_TYPES = (GGMLType.F32, GGMLType.F16, GGMLType.BF16)
+
+
+def to_float32(array, ggml_type):
+    """Decode an unquantized tensor (as returned by ``GGUFReader.tensor_array``) to float32."""
+    if ggml_type == GGMLType.F32:
+        return np.asarray(array, dtype=np.float32)
+    if ggml_type == GGMLType.F16:
+        return array.astype(np.float32)
+    if ggml_type == GGMLType.BF16:
+        return (array.astype(np.uint32) << 16).view(np.float32)
+    raise ValueError(f"Cannot decode ggml type {ggml_type} to float32")
+
+
+def _roundf(x):
+    # C roundf (half away from zero), exact for float32 inputs
+    a = np.abs(x)
+    floored = np.floor(a)
+    return np.sign(x) * (floored + np.floor(2 * (a - floored)))
+
+
+def _inverse(d):
+    with np.errstate(divide="ignore"):
+        return np.where(d != 0, np.float32(1) / d, np.float32(0)).astype(np.float32)
+
+
+def _fp16_bytes(d):
+    return d.astype("<f2").view(np.uint8).reshape(-1, 2)
+
+
+def _signed_absmax(blocks):
+    # Value with the largest magnitude in each block (first one on ties, like the C loop)
+    idx = np.abs(blocks).argmax(axis=1)[:, None]
+    return np.take_along_axis(blocks, idx, axis=1)
+
+
+def _blocks(x, block_size=QK):
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if x.size % block_size:
+        raise ValueError(f"Tensor size {x.size} is not a multiple of the block size {block_size}")
+    return x.reshape(-1, block_size)
+
+
+def quantize_q4_0(x):
+    blocks = _blocks(x)
+    d = (_signed_absmax(blocks) / np.float32(-8)).astype(np.float32)
+    q = np.trunc(blocks * _inverse(d) + np.float32(8.5))
+    q = np.minimum(q, 15).astype(np.uint8)
+    out = np.empty((len(blocks), 18), dtype=np.uint8)
+    out[:, :2] = _fp16_bytes(d)
+    out[:, 2:] = q[:, :16] | (q[:, 16:] << 4)
+    return out.reshape(-1)
+
+
+def quantize_q5_0(x):
+    blocks = _blocks(x)
+    d = (_signed_absmax(blocks) / np.float32(-16)).astype(np.float32)
+    q = np.trunc(blocks * _inverse(d) + np.float32(16.5))
+    q = np.minimum(q, 31).astype(np.uint8)
+    qh = (((q >> 4) & 1).astype(np.uint32) << np.arange(QK, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+    low = q & 0x0F
+    out = np.empty((len(blocks), 22), dtype=np.uint8)
+    out[:, :2] = _fp16_bytes(d)
+    out[:, 2:6] = qh.astype("<u4").view(np.uint8).reshape(-1, 4)
+    out[:, 6:] = low[:, :16] | (low[:, 16:] << 4)
+    return out.reshape(-1)
+
+
+def quantize_q8_0(x):
+    blocks = _blocks(x)
+    d = (np.abs(blocks).max(axis=1, keepdims=True) / np.float32(127)).astype(np.float32)
+    q = _roundf(blocks * _inverse(d)).astype(np.int8)
+    out = np.empty((len(blocks), 34), dtype=np.uint8)
+    out[:, :2] = _fp16_bytes(d)
+    out[:, 2:] = q.view(np.uint8)
+    return out.reshape(-1)
+
+
+def dequantize_q4_0(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 18)
+    d = blocks[:, :2].copy().view("<f2").astype(np.float32)
+    qs = blocks[:, 2:]
+    q = np.concatenate([qs & 0x0F, qs >> 4], axis=1).astype(np.int8) - 8
+    return (d * q).reshape(-1)
+
+
+def dequantize_q5_0(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 22)
+    d = blocks[:, :2].copy().view("<f2").astype(np.float32)
+    qh = blocks[:, 2:6].copy().view("<u4")
+    hi = ((qh >> np.arange(QK, dtype=np.uint32)) & 1).astype(np.uint8) << 4
+    qs = blocks[:, 6:]
+    q = (np.concatenate([qs & 0x0F, qs >> 4], axis=1) | hi).astype(np.int8) - 16
+    return (d * q).reshape(-1)
+
+
+def dequantize_q8_0(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 34)
+    d = blocks[:, :2].copy().view("<f2").astype(np.float32)
+    return (d * blocks[:, 2:].view(np.int8)).reshape(-1)
+
+
+def _make_qkx2_quants(x, weights, nmax, rmin, rdelta, nstep):
+    # make_qkx2_quants for every column of x at once: weighted least-squares
+    # search for an asymmetric (scale, min) pair over nstep + 1 candidate
+    # scales, each step starting from the best min found so far. Groups run
+    # down the columns so the axis-0 sums add in the C loop's order.
+    nmax = np.float32(nmax)
+    xmin = np.minimum(x.min(axis=0), 0)
+    xmax = x.max(axis=0)
+    sum_w = weights.sum(axis=0)
+    sum_x = (weights * x).sum(axis=0)
+    flat = xmax == xmin
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iscale = nmax / (xmax - xmin)
+        scale = np.float32(1) / iscale
+        levels = np.clip(np.rint(iscale * (x - xmin)), 0, nmax)
+        diff = scale * levels + xmin - x
+        best_error = (weights * diff * diff).sum(axis=0)
+        cur_min = xmin
+        for step in range(nstep + 1):
+            iscale = (np.float32(rmin) + np.float32(rdelta) * np.float32(step) + nmax) / (xmax - cur_min)
+            aux = np.clip(np.rint(iscale * (x - cur_min)), 0, nmax)
+            wl = weights * aux
+            sum_l = wl.sum(axis=0)
+            sum_l2 = (wl * aux).sum(axis=0)
+            sum_xl = (wl * x).sum(axis=0)
+            det = sum_w * sum_l2 - sum_l * sum_l
+            this_scale = (sum_w * sum_xl - sum_x * sum_l) / det
+            this_min = (sum_l2 * sum_x - sum_l * sum_xl) / det
+            positive = this_min > 0
+            this_min = np.where(positive, np.float32(0), this_min)
+            this_scale = np.where(positive, sum_xl / sum_l2, this_scale)
+            diff = this_scale * aux + this_min - x
+            cur_error = (weights * diff * diff).sum(axis=0)
+            better = (det > 0) & (cur_error < best_error)
+            levels = np.where(better, aux, levels)
+            best_error = np.where(better, cur_error, best_error)
+            scale = np.where(better, this_scale, scale)
+            cur_min = np.where(better, this_min, cur_min)
+    levels = np.where(flat, np.float32(0), levels)
+    scale = np.where(flat, np.float32(0), scale)
+    return scale.astype(np.float32), (-cur_min).astype(np.float32), levels.astype(np.uint8)
+
+
+def _make_qx_quants(x, nmax):
+    # make_qx_quants with rmse_type 1 (x^2 weights) for every column of x: a
+    # symmetric scale searched over 19 candidates around nmax / absmax
+    nmax_f = np.float32(nmax)
+    amax_index = np.abs(x).argmax(axis=0)
+    signed_max = x[amax_index, np.arange(x.shape[1])]
+    zero = np.abs(signed_max) < _GROUP_MAX_EPS
+    w = x * x
+    wx = w * x
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iscale = -nmax_f / signed_max
+        levels = np.clip(np.rint(iscale * x), -nmax, nmax - 1)
+        sumlx = (wx * levels).sum(axis=0)
+        suml2 = (w * levels * levels).sum(axis=0)
+        scale = np.where(suml2 != 0, sumlx / suml2, np.float32(0))
+        best = scale * sumlx
+        for step in range(-9, 10):
+            if step == 0:
+                continue
+            iscale = -(nmax_f + np.float32(0.1) * np.float32(step)) / signed_max
+            aux = np.clip(np.rint(iscale * x), -nmax, nmax - 1)
+            sumlx = (wx * aux).sum(axis=0)
+            suml2 = (w * aux * aux).sum(axis=0)
+            better = (suml2 > 0) & (sumlx * sumlx > best * suml2)
+            levels = np.where(better, aux, levels)
+            scale = np.where(better, sumlx / suml2, scale)
+            best = np.where(better, scale * sumlx, best)
+    levels = np.where(zero, np.float32(0), levels + nmax_f)
+    scale = np.where(zero, np.float32(0), scale)
+    return scale.astype(np.float32), levels.astype(np.uint8)
+
+
+def _k_chunks(encode, x):
+    blocks = _blocks(x, QK_K)
+    return np.concatenate([encode(blocks[i:i + _K_CHUNK]) for i in range(0, len(blocks), _K_CHUNK)] or
+                          [np.empty(0, dtype=np.uint8)])
+
+
+def _pack_scales_k4(ls, lm):
+    # 6-bit sub-block scales and mins of Q4_K/Q5_K packed into 12 bytes
+    packed = np.zeros((len(ls), 12), dtype=np.uint8)
+    packed[:, 0:4] = ls[:, :4] | ((ls[:, 4:] >> 4) << 6)
+    packed[:, 4:8] = lm[:, :4] | ((lm[:, 4:] >> 4) << 6)
+    packed[:, 8:12] = (ls[:, 4:] & 0x0F) | ((lm[:, 4:] & 0x0F) << 4)
+    return packed
+
+
+def _unpack_scales_k4(packed):
+    ls = np.empty((len(packed), 8), dtype=np.uint8)
+    lm = np.empty((len(packed), 8), dtype=np.uint8)
+    ls[:, :4] = packed[:, 0:4] & 63
+    lm[:, :4] = packed[:, 4:8] & 63
+    ls[:, 4:] = (packed[:, 8:12] & 0x0F) | ((packed[:, 0:4] >> 6) << 4)
+    lm[:, 4:] = (packed[:, 8:12] >> 4) | ((packed[:, 4:8] >> 6) << 4)
+    return ls, lm
+
+
+def _quantize_k_asymmetric(blocks, nmax, rmin, nstep):
+    # Shared body of Q4_K and Q5_K: 8 sub-blocks of 32 with 6-bit scales and mins
+    sub = np.ascontiguousarray(blocks.reshape(-1, 32).T)
+    av_x = np.sqrt((sub * sub).sum(axis=0) / np.float32(32))
+    weights = av_x + np.abs(sub)
+    scales, mins, levels = _make_qkx2_quants(sub, weights, nmax, rmin, 0.1, nstep)
+    scales = scales.reshape(-1, 8)
+    mins = mins.reshape(-1, 8)
+    levels = levels.T.reshape(-1, 8, 32)
+    max_scale = np.maximum(scales.max(axis=1), 0)
+    max_min = np.maximum(mins.max(axis=1), 0)
+    inv_scale = np.where(max_scale > 0, np.float32(63) / np.where(max_scale > 0, max_scale, 1), np.float32(0))
+    inv_min = np.where(max_min > 0, np.float32(63) / np.where(max_min > 0, max_min, 1), np.float32(0))
+    ls = np.minimum(np.rint(inv_scale[:, None] * scales).astype(np.int64) & 0xFF, 63).astype(np.uint8)
+    lm = np.minimum(np.rint(inv_min[:, None] * mins).astype(np.int64) & 0xFF, 63).astype(np.uint8)
+    d = (max_scale / np.float32(63)).astype("<f2")
+    dmin = (max_min / np.float32(63)).astype("<f2")
+
+    # Requantize against the rounded super-block scales; sub-blocks whose
+    # scale rounds to zero keep the levels from the search
+    sub_d = d.astype(np.float32)[:, None] * ls.astype(np.float32)
+    sub_m = dmin.astype(np.float32)[:, None] * lm.astype(np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        requant = np.clip(np.rint((blocks.reshape(-1, 8, 32) + sub_m[:, :, None]) / sub_d[:, :, None]), 0, nmax)
+    levels = np.where(sub_d[:, :, None] != 0, requant, levels).astype(np.uint8)
+    return d, dmin, _pack_scales_k4(ls, lm), levels.reshape(-1, 4, 2, 32)
+
+
+def _encode_q4_k(blocks):
+    d, dmin, scales, levels = _quantize_k_asymmetric(blocks, 15, -1.0, 20)
+    out = np.empty((len(blocks), 144), dtype=np.uint8)
+    out[:, 0:2] = d.view(np.uint8).reshape(-1, 2)
+    out[:, 2:4] = dmin.view(np.uint8).reshape(-1, 2)
+    out[:, 4:16] = scales
+    out[:, 16:] = (levels[:, :, 0] | (levels[:, :, 1] << 4)).reshape(-1, 128)
+    return out.reshape(-1)
+
+
+def _encode_q5_k(blocks):
+    d, dmin, scales, levels = _quantize_k_asymmetric(blocks, 31, -0.5, 15)
+    high = levels >> 4
+    low = levels & 0x0F
+    shifts = 2 * np.arange(4, dtype=np.uint8)[None, :, None]
+    qh = ((high[:, :, 0] << shifts) | (high[:, :, 1] << (shifts + 1))).sum(axis=1, dtype=np.uint8)
+    out = np.empty((len(blocks), 176), dtype=np.uint8)
+    out[:, 0:2] = d.view(np.uint8).reshape(-1, 2)
+    out[:, 2:4] = dmin.view(np.uint8).reshape(-1, 2)
+    out[:, 4:16] = scales
+    out[:, 16:48] = qh
+    out[:, 48:] = (low[:, :, 0] | (low[:, :, 1] << 4)).reshape(-1, 128)
+    return out.reshape(-1)
+
+
+def _encode_q6_k(blocks):
+    scales, levels = _make_qx_quants(np.ascontiguousarray(blocks.reshape(-1, 16).T), 32)
+    scales = scales.reshape(-1, 16)
+    levels = levels.T.reshape(-1, 16, 16)
+    max_scale = _signed_absmax(scales)[:, 0]
+    zero = np.abs(max_scale) < _GROUP_MAX_EPS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iscale = np.where(zero, np.float32(0), np.float32(-128) / max_scale)
+        d = np.where(zero, np.float32(0), np.float32(1) / iscale).astype("<f2")
+        ls = np.minimum(np.rint(iscale[:, None] * scales), 127).astype(np.int8)
+        sub_d = d.astype(np.float32)[:, None] * ls.astype(np.float32)
+        requant = np.clip(np.rint(blocks.reshape(-1, 16, 16) / sub_d[:, :, None]), -32, 31) + 32
+    levels = np.where(sub_d[:, :, None] != 0, requant, levels).astype(np.uint8)
+    levels = np.where(zero[:, None, None], 0, levels).astype(np.uint8)
+    ls = np.where(zero[:, None], 0, ls).astype(np.int8)
+
+    # Two halves of 128; in each, value groups 0..3 of 32 share ql/qh bytes
+    q = levels.reshape(-1, 2, 4, 32)
+    ql = np.empty((len(blocks), 2, 2, 32), dtype=np.uint8)
+    ql[:, :, 0] = (q[:, :, 0] & 0x0F) | ((q[:, :, 2] & 0x0F) << 4)
+    ql[:, :, 1] = (q[:, :, 1] & 0x0F) | ((q[:, :, 3] & 0x0F) << 4)
+    qh = (q[:, :, 0] >> 4) | ((q[:, :, 1] >> 4) << 2) | ((q[:, :, 2] >> 4) << 4) | ((q[:, :, 3] >> 4) << 6)
+    out = np.empty((len(blocks), 210), dtype=np.uint8)
+    out[:, 0:128] = ql.reshape(-1, 128)
+    out[:, 128:192] = qh.reshape(-1, 64)
+    out[:, 192:208] = ls.view(np.uint8)
+    out[:, 208:210] = d.view(np.uint8).reshape(-1, 2)
+    return out.reshape(-1)
+
+
+def quantize_q4_k(x):
+    return _k_chunks(_encode_q4_k, x)
+
+
+def quantize_q5_k(x):
+    return _k_chunks(_encode_q5_k, x)
+
+
+def quantize_q6_k(x):
+    return _k_chunks(_encode_q6_k, x)
+
+
+def _dequantize_k_asymmetric(d, dmin, scales, levels):
+    ls, lm = _unpack_scales_k4(scales)
+    sub_d = d[:, None] * ls.astype(np.float32)
+    sub_m = dmin[:, None] * lm.astype(np.float32)
+    return (sub_d[:, :, None] * levels.reshape(-1, 8, 32) - sub_m[:, :, None]).reshape(-1)
+
+
+def dequantize_q4_k(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 144)
+    d = blocks[:, 0:2].copy().view("<f2").astype(np.float32)[:, 0]
+    dmin = blocks[:, 2:4].copy().view("<f2").astype(np.float32)[:, 0]
+    qs = blocks[:, 16:].reshape(-1, 4, 1, 32)
+    levels = np.concatenate([qs & 0x0F, qs >> 4], axis=2)
+    return _dequantize_k_asymmetric(d, dmin, blocks[:, 4:16], levels.astype(np.float32))
+
+
+def dequantize_q5_k(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 176)
+    d = blocks[:, 0:2].copy().view("<f2").astype(np.float32)[:, 0]
+    dmin = blocks[:, 2:4].copy().view("<f2").astype(np.float32)[:, 0]
+    qh = blocks[:, 16:48][:, None, None, :]
+    qs = blocks[:, 48:].reshape(-1, 4, 1, 32)
+    shifts = (2 * np.arange(4, dtype=np.uint8)[:, None] + np.arange(2, dtype=np.uint8)[None, :])[None, :, :, None]
+    high = ((qh >> shifts) & 1) << 4
+    levels = np.concatenate([qs & 0x0F, qs >> 4], axis=2) | high
+    return _dequantize_k_asymmetric(d, dmin, blocks[:, 4:16], levels.astype(np.float32))
+
+
+def dequantize_q6_k(data):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 210)
+    ql = blocks[:, 0:128].reshape(-1, 2, 2, 32)
+    qh = blocks[:, 128:192].reshape(-1, 2, 32)
+    scales = blocks[:, 192:208].copy().view(np.int8).astype(np.float32)
+    d = blocks[:, 208:210].copy().view("<f2").astype(np.float32)
+    q = np.empty((len(blocks), 2, 4, 32), dtype=np.int16)
+    q[:, :, 0] = (ql[:, :, 0] & 0x0F) | (((qh >> 0) & 3) << 4)
+    q[:, :, 1] = (ql[:, :, 1] & 0x0F) | (((qh >> 2) & 3) << 4)
+    q[:, :, 2] = (ql[:, :, 0] >> 4) | (((qh >> 4) & 3) << 4)
+    q[:, :, 3] = (ql[:, :, 1] >> 4) | (((qh >> 6) & 3) << 4)
+    sub_d = (d * scales).reshape(-1, 16, 1)
+    return (sub_d * (q.reshape(-1, 16, 16) - 32)).reshape(-1)
+
+
+_QUANTIZERS = {
+    GGMLType.Q4_0: quantize_q4_0,
+    GGMLType.Q5_0: quantize_q5_0,
+    GGMLType.Q8_0: quantize_q8_0,
+    GGMLType.Q4_K: quantize_q4_k,
+    GGMLType.Q5_K: quantize_q5_k,
+    GGMLType.Q6_K: quantize_q6_k,
+}
+
+_DEQUANTIZERS = {
+    GGMLType.Q4_0: dequantize_q4_0,
+    GGMLType.Q5_0: dequantize_q5_0,
+    GGMLType.Q8_0: dequantize_q8_0,
+    GGMLType.Q4_K: dequantize_q4_k,
+    GGMLType.Q5_K: dequantize_q5_k,
+    GGMLType.Q6_K: dequantize_q6_k,
+}
+
+
+def can_quantize(ggml_type):
+    return ggml_type in _QUANTIZERS
+
+
+def block_size(ggml_type):
+    return GGML_BLOCK_SIZES[ggml_type][0]
+
+
+def quantize(x, ggml_type):
+    """
+    Quantize float32 values to a ggml block format
+
+    Args:
+        x: Array whose size is a multiple of the type's block size; rows are
+           quantized in memory order
+        ggml_type: Target ``GGMLType``
+
+    Returns:
+        Flat ``uint8`` array with the encoded blocks
+    """
+    if ggml_type not in _QUANTIZERS:
+        raise ValueError(f"No quantizer for ggml type {ggml_type}")
+    return _QUANTIZERS[ggml_type](x)
+
+
+def dequantize(data, ggml_type):
+    """Decode a ggml block-quantized buffer to a flat float32 array."""
+    if ggml_type not in _DEQUANTIZERS:
+        raise ValueError(f"No dequantizer for ggml type {ggml_type}")
+    return _DEQUANTIZERS[ggml_type](data)
@@ -0,0 +1,274 @@
+import os
+import sys
+import hashlib
+import argparse
+
+from checksums import file_sha256
+from file_transfer import CHUNK_SIZE, break_link, read_sidecar, sidecar_path, write_sidecar
+from gguf_file import GGUFReader, GGUFValueType, GGUFWriter
+
+# A patch is itself a GGUF file: its metadata holds the target's changed
+# entries plus these delta.* bookkeeping keys, and its tensors are the
+# target's changed tensors
+DELTA_VERSION = 1
+_DELTA_PREFIX = "delta."
+
+
+def tensor_digests(path, infos, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    sha256 of a file and of each tensor's data region, in one sequential pass
+
+    Args:
+        path: GGUF file
+        infos: Its ``TensorInfo`` list
+        chunk_size: Read buffer size
+        progress: Optional ``progress(nbytes)`` callback, called per chunk
+
+    Returns:
+        ``(file_digest, {tensor name: digest})`` as hex strings
+    """
+    regions = sorted(infos, key=lambda info: info.data_offset)
+    file_digest = hashlib.sha256()
+    digests = {info.name: hashlib.sha256() for info in regions}
+    buffer = bytearray(chunk_size)
+    pos = 0
+    first = 0
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            chunk = memoryview(buffer)[:n]
+            file_digest.update(chunk)
+            end = pos + n
+            while first < len(regions) and regions[first].data_offset + regions[first].n_bytes <= pos:
+                first += 1
+            for info in regions[first:]:
+                if info.data_offset >= end:
+                    break
+                start = max(info.data_offset, pos)
+                stop = min(info.data_offset + info.n_bytes, end)
+                digests[info.name].update(chunk[start - pos:stop - pos])
+            pos = end
+            if progress is not None:
+                progress(n)
+    return file_digest.hexdigest(), {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def _same_tensor(a, b):
+    return a.shape == b.shape and a.ggml_type == b.ggml_type
+
+
+def _target_layout(reader):
+    # The layout GGUFWriter gives the file's metadata and tensors; a patch
+    # can only reproduce files already laid out this way
+    writer = GGUFWriter(None)
+    writer.copy_fields(reader)
+    for info in reader.tensors:
+        writer.add_tensor_info(info.name, info.shape, info.ggml_type, info.n_bytes)
+    writer.layout()
+    return writer
+
+
+def diff_gguf(base_path, target_path, patch_path, progress=None):
+    """
+    Write a patch that turns the GGUF file ``base_path`` into ``target_path``
+
+    Each tensor's data region is hashed in both files; the patch carries
+    only the metadata entries and tensors of the target that differ from
+    the base, plus the target's key and tensor order and the sha256 of
+    both files.
+
+    Args:
+        base_path: GGUF file the patch applies to
+        target_path: GGUF file the patch produces
+        patch_path: Patch file to write (itself a GGUF file)
+        progress: Optional ``progress(nbytes)`` callback while hashing
+
+    Returns:
+        ``(changed_keys, changed_tensors)`` counts
+    """
+    with GGUFReader(base_path) as base, GGUFReader(target_path) as target:
+        if any(key.startswith(_DELTA_PREFIX) for key in target.fields):
+            raise ValueError(f"{target_path} has {_DELTA_PREFIX}* metadata and cannot be patched to")
+        layout = _target_layout(target)
+        if layout.data_offset != target.data_offset or any(
+                planned.data_offset != info.data_offset for planned, info in zip(layout.tensors, target.tensors)):
+            raise ValueError(f"{target_path} is not laid out like a GGUFWriter file; rewrite it first")
+
+        base_digest, base_tensors = tensor_digests(base_path, base.tensors, progress=progress)
+        target_digest, target_tensors = tensor_digests(target_path, target.tensors, progress=progress)
+
+        changed_keys = [key for key, field in target.fields.items() if base.fields.get(key) != field]
+        changed_tensors = [info for info in target.tensors
+                           if info.name not in base_tensors
+                           or not _same_tensor(base.tensor(info.name), info)
+                           or base_tensors[info.name] != target_tensors[info.name]]
+
+        os.makedirs(os.path.dirname(os.path.abspath(patch_path)), exist_ok=True)
+        with GGUFWriter(f"{patch_path}.partial") as writer:
+            try:
+                writer.add_field(f"{_DELTA_PREFIX}version", DELTA_VERSION, GGUFValueType.UINT32)
+                writer.add_field(f"{_DELTA_PREFIX}base_sha256", base_digest)
+                writer.add_field(f"{_DELTA_PREFIX}target_sha256", target_digest)
+                writer.add_field(f"{_DELTA_PREFIX}key_order", list(target.fields), GGUFValueType.ARRAY,
+                                 GGUFValueType.STRING)
+                writer.add_field(f"{_DELTA_PREFIX}tensor_order", [info.name for info in target.tensors],
+                                 GGUFValueType.ARRAY, GGUFValueType.STRING)
+                for key in changed_keys:
+                    field = target.fields[key]
+                    writer.add_field(key, field.value, field.type, field.item_type)
+                for info in changed_tensors:
+                    writer.add_tensor_info(info.name, info.shape, info.ggml_type, info.n_bytes)
+                writer.write_header()
+                for info in changed_tensors:
+                    writer.write_tensor_data(target.tensor_data(info))
+                writer.close()
+                os.replace(writer.path, patch_path)
+            finally:
+                writer.close()
+                if os.path.exists(writer.path):
+                    os.remove(writer.path)
+    return len(changed_keys), len(changed_tensors)
+
+
+def _patched_layout(base, patch):
+    # Declare the target file: entries and tensors in the target's order,
+    # taken from the patch where it has them and from the base otherwise
+    writer = GGUFWriter(None)
+    for key in patch.fields[f"{_DELTA_PREFIX}key_order"].value:
+        source = patch if key in patch.fields else base
+        if key not in source.fields:
+            raise ValueError(f"Patch needs metadata entry {key} that {base.path} does not have")
+        field = source.fields[key]
+        writer.add_field(key, field.value, field.type, field.item_type)
+    changed = {info.name: info for info in patch.tensors}
+    base_tensors = {info.name: info for info in base.tensors}
+    for name in patch.fields[f"{_DELTA_PREFIX}tensor_order"].value:
+        info = changed.get(name) or base_tensors.get(name)
+        if info is None:
+            raise ValueError(f"Patch needs tensor {name} that {base.path} does not have")
+        writer.add_tensor_info(info.name, info.shape, info.ggml_type, info.n_bytes)
+    writer.layout()
+    return writer, changed
+
+
+def apply_patch(path, patch_path, output_path=None, verify=False, progress=None):
+    """
+    Apply a patch written by ``diff_gguf``
+
+    When every unchanged tensor keeps its offset, the file is patched in
+    place: the header is rewritten, the changed tensors are written at
+    their offsets and the file is truncated to its new size, so only the
+    changed bytes are written. A file with other hardlinks is first given
+    its own copy. Otherwise, or when ``output_path`` is given, the target
+    is streamed to a new file through ``GGUFWriter``.
+
+    The base is checked against its ``.sha256`` sidecar, or rehashed when
+    it has none or with ``verify``, so the target's sidecar is only ever
+    written for a result built from the right base.
+
+    Args:
+        path: GGUF file to patch
+        patch_path: Patch file
+        output_path: Write the result here instead of patching ``path``
+        verify: Hash the base before and the result after patching
+        progress: Optional ``progress(nbytes)`` callback, called per tensor written
+
+    Returns:
+        True if ``path`` was patched in place
+    """
+    with GGUFReader(patch_path) as patch:
+        version = patch.get(f"{_DELTA_PREFIX}version")
+        if version != DELTA_VERSION:
+            raise ValueError(f"{patch_path} is not a version {DELTA_VERSION} GGUF patch")
+        base_digest = patch.get(f"{_DELTA_PREFIX}base_sha256")
+        target_digest = patch.get(f"{_DELTA_PREFIX}target_sha256")
+        digest = None if verify else read_sidecar(path)
+        if digest is None:
+            digest = file_sha256(path)
+        if digest != base_digest:
+            raise ValueError(f"{path} is not the base of {patch_path} (sha256 {digest}, expected {base_digest})")
+
+        output_path = output_path or path
+        with GGUFReader(path) as base:
+            writer, changed = _patched_layout(base, patch)
+            in_place = os.path.abspath(output_path) == os.path.abspath(path) and all(
+                info.name in changed or info.data_offset == base.tensor(info.name).data_offset
+                for info in writer.tensors)
+            if not in_place:
+                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+                writer.path = f"{output_path}.partial"
+                try:
+                    writer.write_header()
+                    for info in writer.tensors:
+                        source = patch if info.name in changed else base
+                        writer.write_tensor_data(source.tensor_data(info.name))
+                        source.release_tensor(info.name)
+                        if progress is not None:
+                            progress(info.n_bytes)
+                    written_digest = writer.hexdigest()
+                    writer.close()
+                    if written_digest != target_digest:
+                        raise ValueError(f"Patched file has sha256 {written_digest}, expected {target_digest}")
+                    os.replace(writer.path, output_path)
+                finally:
+                    writer.close()
+                    if os.path.exists(writer.path):
+                        os.remove(writer.path)
+
+        if in_place:
+            break_link(path)
+            # Drop the sidecar first: an interrupted patch must not look complete
+            if os.path.exists(sidecar_path(path)):
+                os.remove(sidecar_path(path))
+            writer.path = path
+            try:
+                writer.write_header("r+b")
+                writer.preallocate()
+                for info in writer.tensors:
+                    if info.name in changed:
+                        writer.write_tensor_data_at(info.name, patch.tensor_data(info.name))
+                        if progress is not None:
+                            progress(info.n_bytes)
+            finally:
+                writer.close()
+
+    if verify:
+        digest = file_sha256(output_path)
+        if digest != target_digest:
+            raise ValueError(f"Patched file has sha256 {digest}, expected {target_digest}")
+    write_sidecar(output_path, target_digest)
+    return in_place
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tensor-level delta updates for GGUF models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff = commands.add_parser("diff", help="Write a patch with the metadata and tensors that differ between two models")
+    diff.add_argument("base_file", help="Path to the GGUF model the patch applies to")
+    diff.add_argument("target_file", help="Path to the GGUF model the patch produces")
+    diff.add_argument("--output", required=True, help="Path to the patch file to write")
+    apply = commands.add_parser("apply", help="Patch a GGUF model, in place when its layout allows")
+    apply.add_argument("model_file", help="Path to the GGUF model to patch")
+    apply.add_argument("patch_file", help="Path to the patch file")
+    apply.add_argument("--output", help="Write the patched model here instead of patching in place")
+    apply.add_argument("--verify", action="store_true", help="Hash the model before and after patching")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "diff":
+            changed_keys, changed_tensors = diff_gguf(args.base_file, args.target_file, args.output)
+            print(f"Patch written to {args.output}: {changed_keys} metadata entries and {changed_tensors} tensors "
+                  f"changed ({os.path.getsize(args.output)} bytes)")
+        else:
+            in_place = apply_patch(args.model_file, args.patch_file, args.output, args.verify)
+            print(f"Patched {args.model_file} {'in place' if in_place else 'into ' + (args.output or args.model_file)}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,673 @@
+import os
+import mmap
+import hashlib
+import struct
+import argparse
+from collections import namedtuple
+
+GGUF_MAGIC = b"GGUF"
+GGUF_VERSION = 3
+GGUF_DEFAULT_ALIGNMENT = 32
+
+
+class GGUFValueType:
+    UINT8 = 0
+    INT8 = 1
+    UINT16 = 2
+    INT16 = 3
+    UINT32 = 4
+    INT32 = 5
+    FLOAT32 = 6
+    BOOL = 7
+    STRING = 8
+    ARRAY = 9
+    UINT64 = 10
+    INT64 = 11
+    FLOAT64 = 12
+
+
+class GGMLType:
+    F32 = 0
+    F16 = 1
+    Q4_0 = 2
+    Q4_1 = 3
+    Q5_0 = 6
+    Q5_1 = 7
+    Q8_0 = 8
+    Q8_1 = 9
+    Q2_K = 10
+    Q3_K = 11
+    Q4_K = 12
+    Q5_K = 13
+    Q6_K = 14
+    Q8_K = 15
+    I8 = 24
+    I16 = 25
+    I32 = 26
+    I64 = 27
+    F64 = 28
+    BF16 = 30
+
+
+# ggml type -> (elements per block, bytes per block)
+GGML_BLOCK_SIZES = {
+    GGMLType.F32: (1, 4),
+    GGMLType.F16: (1, 2),
+    GGMLType.Q4_0: (32, 18),
+    GGMLType.Q4_1: (32, 20),
+    GGMLType.Q5_0: (32, 22),
+    GGMLType.Q5_1: (32, 24),
+    GGMLType.Q8_0: (32, 34),
+    GGMLType.Q8_1: (32, 36),
+    GGMLType.Q2_K: (256, 84),
+    GGMLType.Q3_K: (256, 110),
+    GGMLType.Q4_K: (256, 144),
+    GGMLType.Q5_K: (256, 176),
+    GGMLType.Q6_K: (256, 210),
+    GGMLType.Q8_K: (256, 292),
+    GGMLType.I8: (1, 1),
+    GGMLType.I16: (1, 2),
+    GGMLType.I32: (1, 4),
+    GGMLType.I64: (1, 8),
+    GGMLType.F64: (1, 8),
+    GGMLType.BF16: (1, 2),
+}
+
+GGML_TYPE_NAMES = {value: name for name, value in vars(GGMLType).items() if not name.startswith("_")}
+
+_SCALAR_FORMATS = {
+    GGUFValueType.UINT8: "B",
+    GGUFValueType.INT8: "b",
+    GGUFValueType.UINT16: "H",
+    GGUFValueType.INT16: "h",
+    GGUFValueType.UINT32: "I",
+    GGUFValueType.INT32: "i",
+    GGUFValueType.FLOAT32: "f",
+    GGUFValueType.BOOL: "?",
+    GGUFValueType.UINT64: "Q",
+    GGUFValueType.INT64: "q",
+    GGUFValueType.FLOAT64: "d",
+}
+
+# A metadata entry; ``item_type`` is only set for arrays
+GGUFField = namedtuple("GGUFField", ["type", "value", "item_type"])
+
+
+def align_offset(offset, alignment):
+    """Round ``offset`` up to the next multiple of ``alignment``."""
+    return offset + (alignment - offset % alignment) % alignment
+
+
+def tensor_nbytes(shape, ggml_type):
+    """
+    Size in bytes of a tensor's data
+
+    Args:
+        shape: Dimensions in ggml order (``shape[0]`` is the row length)
+        ggml_type: A ``GGMLType`` value
+    """
+    if ggml_type not in GGML_BLOCK_SIZES:
+        raise ValueError(f"Unsupported ggml type {ggml_type}")
+    block_elems, block_bytes = GGML_BLOCK_SIZES[ggml_type]
+    if shape and shape[0] % block_elems:
+        raise ValueError(f"Row length {shape[0]} is not a multiple of the {GGML_TYPE_NAMES[ggml_type]} block size {block_elems}")
+    n_elements = 1
+    for dim in shape:
+        n_elements *= dim
+    return n_elements // block_elems * block_bytes
+
+
+class TensorInfo:
+    """Tensor-info table entry; ``data_offset`` is absolute within the file."""
+
+    __slots__ = ("name", "shape", "ggml_type", "offset", "data_offset")
+
+    def __init__(self, name, shape, ggml_type, offset, data_offset):
+        self.name = name
+        self.shape = tuple(shape)
+        self.ggml_type = ggml_type
+        self.offset = offset
+        self.data_offset = data_offset
+
+    @property
+    def n_elements(self):
+        n = 1
+        for dim in self.shape:
+            n *= dim
+        return n
+
+    @property
+    def n_bytes(self):
+        return tensor_nbytes(self.shape, self.ggml_type)
+
+    @property
+    def type_name(self):
+        return GGML_TYPE_NAMES.get(self.ggml_type, str(self.ggml_type))
+
+    def __repr__(self):
+        return f"TensorInfo({self.name!r}, shape={self.shape}, type={self.type_name}, offset={self.offset})"
+
+
+class GGUFReader:
+    """
+    Memory-mapped GGUF reader
+
+    Only the fixed header is parsed on open. The KV metadata and tensor-info
+    table are parsed on first access, and tensor data is never read: it is
+    exposed as zero-copy views into the mapping.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty, not a GGUF file")
+        if self._mmap[:4] != GGUF_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a GGUF file")
+        self.version, self.tensor_count, self.kv_count = struct.unpack_from("<IQQ", self._mmap, 4)
+        if self.version not in (2, 3):
+            self.close()
+            raise ValueError(f"Unsupported GGUF version {self.version} in {path}")
+        self._pos = 24
+        self._fields = None
+        self._tensors = None
+        self._tensor_index = None
+        self.data_offset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Tensor views are still alive; the mapping is released with them
+                pass
+            self._mmap = None
+        self._file.close()
+
+    @property
+    def file_size(self):
+        return len(self._mmap)
+
+    def _read(self, fmt):
+        values = struct.unpack_from(fmt, self._mmap, self._pos)
+        self._pos += struct.calcsize(fmt)
+        return values
+
+    def _read_string(self):
+        (length,) = self._read("<Q")
+        value = self._mmap[self._pos:self._pos + length].decode("utf-8", errors="replace")
+        self._pos += length
+        return value
+
+    def _read_value(self, vtype):
+        if vtype == GGUFValueType.STRING:
+            return self._read_string(), None
+        if vtype == GGUFValueType.ARRAY:
+            item_type, count = self._read("<IQ")
+            if item_type in _SCALAR_FORMATS:
+                return list(self._read(f"<{count}{_SCALAR_FORMATS[item_type]}")), item_type
+            return [self._read_value(item_type)[0] for _ in range(count)], item_type
+        if vtype in _SCALAR_FORMATS:
+            return self._read("<" + _SCALAR_FORMATS[vtype])[0], None
+        raise ValueError(f"Unknown GGUF value type {vtype} at offset {self._pos}")
+
+    def _skip_value(self, vtype):
+        if vtype == GGUFValueType.STRING:
+            (length,) = self._read("<Q")
+            self._pos += length
+        elif vtype == GGUFValueType.ARRAY:
+            item_type, count = self._read("<IQ")
+            if item_type in _SCALAR_FORMATS:
+                self._pos += count * struct.calcsize(_SCALAR_FORMATS[item_type])
+            else:
+                for _ in range(count):
+                    self._skip_value(item_type)
+        elif vtype in _SCALAR_FORMATS:
+            self._pos += struct.calcsize(_SCALAR_FORMATS[vtype])
+        else:
+            raise ValueError(f"Unknown GGUF value type {vtype} at offset {self._pos}")
+
+    def scan_metadata(self):
+        """
+        Read scalar metadata without decoding arrays
+
+        The tokenizer vocabulary and merges make up nearly all of a model's
+        metadata; skipping them only touches their length prefixes.
+
+        Returns:
+            ``(values, array_lengths)``: scalar and string values by key, and
+            the item count of every array by key
+        """
+        if self._fields is not None:
+            values = {key: field.value for key, field in self.fields.items() if field.type != GGUFValueType.ARRAY}
+            lengths = {key: len(field.value) for key, field in self.fields.items() if field.type == GGUFValueType.ARRAY}
+            return values, lengths
+        values = {}
+        lengths = {}
+        pos = self._pos
+        try:
+            for _ in range(self.kv_count):
+                key = self._read_string()
+                (vtype,) = self._read("<I")
+                if vtype == GGUFValueType.ARRAY:
+                    lengths[key] = struct.unpack_from("<Q", self._mmap, self._pos + 4)[0]
+                    self._skip_value(vtype)
+                else:
+                    values[key] = self._read_value(vtype)[0]
+        finally:
+            self._pos = pos
+        return values, lengths
+
+    def _parse_fields(self):
+        fields = {}
+        for _ in range(self.kv_count):
+            key = self._read_string()
+            (vtype,) = self._read("<I")
+            value, item_type = self._read_value(vtype)
+            fields[key] = GGUFField(vtype, value, item_type)
+        self._fields = fields
+
+    def _parse_tensors(self):
+        if self._fields is None:
+            self._parse_fields()
+        infos = []
+        for _ in range(self.tensor_count):
+            name = self._read_string()
+            (n_dims,) = self._read("<I")
+            shape = self._read(f"<{n_dims}Q")
+            ggml_type, offset = self._read("<IQ")
+            infos.append((name, shape, ggml_type, offset))
+        self.data_offset = align_offset(self._pos, self.alignment)
+        self._tensors = [TensorInfo(name, shape, ggml_type, offset, self.data_offset + offset)
+                         for name, shape, ggml_type, offset in infos]
+        self._tensor_index = {info.name: info for info in self._tensors}
+
+    @property
+    def fields(self):
+        """Ordered mapping of metadata key -> ``GGUFField``."""
+        if self._fields is None:
+            self._parse_fields()
+        return self._fields
+
+    @property
+    def metadata(self):
+        """Ordered mapping of metadata key -> plain Python value."""
+        return {key: field.value for key, field in self.fields.items()}
+
+    def get(self, key, default=None):
+        field = self.fields.get(key)
+        return default if field is None else field.value
+
+    @property
+    def alignment(self):
+        return self.get("general.alignment", GGUF_DEFAULT_ALIGNMENT)
+
+    @property
+    def tensors(self):
+        """Tensor-info table in file order."""
+        if self._tensors is None:
+            self._parse_tensors()
+        return self._tensors
+
+    def tensor(self, name):
+        if self._tensors is None:
+            self._parse_tensors()
+        return self._tensor_index[name]
+
+    def tensor_data(self, info):
+        """Zero-copy view of a tensor's raw bytes."""
+        if isinstance(info, str):
+            info = self.tensor(info)
+        return memoryview(self._mmap)[info.data_offset:info.data_offset + info.n_bytes]
+
+    def tensor_array(self, info):
+        """
+        NumPy view of an unquantized tensor in row-major (reversed ggml) shape
+
+        BF16 tensors are returned as their raw ``uint16`` bits.
+        """
+        import numpy as np
+
+        if isinstance(info, str):
+            info = self.tensor(info)
+        dtypes = {
+            GGMLType.F32: np.float32, GGMLType.F16: np.float16, GGMLType.BF16: np.uint16,
+            GGMLType.F64: np.float64, GGMLType.I8: np.int8, GGMLType.I16: np.int16,
+            GGMLType.I32: np.int32, GGMLType.I64: np.int64,
+        }
+        if info.ggml_type not in dtypes:
+            raise ValueError(f"Tensor {info.name} is {info.type_name}, not an unquantized type")
+        array = np.frombuffer(self._mmap, dtype=dtypes[info.ggml_type], count=info.n_elements, offset=info.data_offset)
+        return array.reshape(tuple(reversed(info.shape)))
+
+    def release_tensor(self, info, start=0, end=None):
+        """
+        Drop processed pages of a tensor from this process's resident set
+
+        ``start``/``end`` are byte offsets within the tensor data (the whole
+        tensor by default). The data stays in the page cache and is faulted
+        back in if touched again; without ``madvise`` support this does
+        nothing.
+        """
+        if isinstance(info, str):
+            info = self.tensor(info)
+        end = info.n_bytes if end is None else end
+        release_pages(self._mmap, info.data_offset + start, info.data_offset + end)
+
+
+def release_pages(mapping, start, end):
+    """``madvise(MADV_DONTNEED)`` the whole pages of ``mapping`` inside [start, end)."""
+    if not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    start = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE
+    end = end // mmap.PAGESIZE * mmap.PAGESIZE
+    if end > start:
+        mapping.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def _infer_value_type(value):
+    if isinstance(value, bool):
+        return GGUFValueType.BOOL
+    if isinstance(value, int):
+        if 0 <= value < 2 ** 32:
+            return GGUFValueType.UINT32
+        if -2 ** 31 <= value < 0:
+            return GGUFValueType.INT32
+        return GGUFValueType.UINT64 if value > 0 else GGUFValueType.INT64
+    if isinstance(value, float):
+        return GGUFValueType.FLOAT32
+    if isinstance(value, str):
+        return GGUFValueType.STRING
+    if isinstance(value, (list, tuple)):
+        return GGUFValueType.ARRAY
+    raise ValueError(f"Cannot infer GGUF type for {type(value).__name__}")
+
+
+def _infer_item_type(values):
+    if not values:
+        return GGUFValueType.INT32
+    first = values[0]
+    if isinstance(first, bool):
+        return GGUFValueType.BOOL
+    if isinstance(first, int):
+        low, high = min(values), max(values)
+        if -2 ** 31 <= low and high < 2 ** 31:
+            return GGUFValueType.INT32
+        if -2 ** 63 <= low and high < 2 ** 63:
+            return GGUFValueType.INT64
+        if 0 <= low and high < 2 ** 64:
+            return GGUFValueType.UINT64
+        raise ValueError(f"Integer array values {low}..{high} do not fit a GGUF integer type")
+    return _infer_value_type(first)
+
+
+def _pack_string(value):
+    data = value.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _pack_value(vtype, value, item_type=None):
+    if vtype == GGUFValueType.STRING:
+        return _pack_string(value)
+    if vtype == GGUFValueType.ARRAY:
+        if item_type is None:
+            item_type = _infer_item_type(value)
+        head = struct.pack("<IQ", item_type, len(value))
+        if item_type in _SCALAR_FORMATS:
+            return head + struct.pack(f"<{len(value)}{_SCALAR_FORMATS[item_type]}", *value)
+        return head + b"".join(_pack_value(item_type, item) for item in value)
+    return struct.pack("<" + _SCALAR_FORMATS[vtype], value)
+
+
+class GGUFWriter:
+    """
+    Streaming GGUF writer
+
+    Metadata and tensor infos are declared first, then ``write_header`` lays
+    out the file and tensor data is streamed in declaration order with the
+    alignment padding inserted automatically. Tensor data offsets are fixed
+    once the header is written, so callers may instead ``preallocate`` the
+    file and write tensors at ``tensor_data_offset`` in any order.
+
+    A file written front to back is hashed as it is written, so its sha256
+    is available from ``hexdigest`` without reading it back.
+    """
+
+    def __init__(self, path, alignment=GGUF_DEFAULT_ALIGNMENT):
+        self.path = path
+        self.alignment = alignment
+        self._fields = {}
+        self._tensors = []
+        self._tensor_index = {}
+        self._data_size = 0
+        self._file = None
+        self.data_offset = None
+        self._next_tensor = 0
+        self._digest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_field(self, key, value, vtype=None, item_type=None):
+        """Add or replace a metadata entry, inferring its GGUF type when not given."""
+        if self._file is not None:
+            raise RuntimeError("Metadata must be added before the header is written")
+        if vtype is None:
+            vtype = _infer_value_type(value)
+        if vtype == GGUFValueType.ARRAY and item_type is None:
+            item_type = _infer_item_type(value)
+        if key == "general.alignment":
+            self.alignment = int(value)
+            self._place_tensors()
+        self._fields[key] = GGUFField(vtype, value, item_type)
+
+    def copy_fields(self, reader, skip=()):
+        """Copy metadata entries from a ``GGUFReader`` preserving their types."""
+        for key, field in reader.fields.items():
+            if key not in skip:
+                self.add_field(key, field.value, field.type, field.item_type)
+
+    def remove_field(self, key):
+        self._fields.pop(key, None)
+
+    @property
+    def fields(self):
+        """Ordered mapping of metadata key -> ``GGUFField`` declared so far."""
+        return self._fields
+
+    def add_tensor_info(self, name, shape, ggml_type, n_bytes=None):
+        """
+        Declare a tensor
+
+        Args:
+            name: Tensor name
+            shape: Dimensions in ggml order (``shape[0]`` is the row length)
+            ggml_type: A ``GGMLType`` value
+            n_bytes: Data size; computed from shape and type when omitted
+        """
+        if self._file is not None:
+            raise RuntimeError("Tensors must be declared before the header is written")
+        if name in self._tensor_index:
+            raise ValueError(f"Duplicate tensor {name}")
+        if n_bytes is None:
+            n_bytes = tensor_nbytes(shape, ggml_type)
+        offset = align_offset(self._data_size, self.alignment)
+        info = TensorInfo(name, shape, ggml_type, offset, None)
+        self._tensors.append((info, n_bytes))
+        self._tensor_index[name] = len(self._tensors) - 1
+        self._data_size = offset + n_bytes
+
+    def _place_tensors(self):
+        # Recompute the relative offsets of tensors declared before the alignment changed
+        self._data_size = 0
+        for info, n_bytes in self._tensors:
+            info.offset = align_offset(self._data_size, self.alignment)
+            self._data_size = info.offset + n_bytes
+
+    @property
+    def tensors(self):
+        return [info for info, _ in self._tensors]
+
+    def _header_bytes(self):
+        parts = [GGUF_MAGIC, struct.pack("<IQQ", GGUF_VERSION, len(self._tensors), len(self._fields))]
+        for key, field in self._fields.items():
+            parts.append(_pack_string(key))
+            parts.append(struct.pack("<I", field.type))
+            parts.append(_pack_value(field.type, field.value, field.item_type))
+        for info, _ in self._tensors:
+            parts.append(_pack_string(info.name))
+            parts.append(struct.pack(f"<I{len(info.shape)}Q", len(info.shape), *info.shape))
+            parts.append(struct.pack("<IQ", info.ggml_type, info.offset))
+        return b"".join(parts)
+
+    def layout_digest(self):
+        """sha256 of the header, metadata and tensor-info table; equal digests mean identical layouts."""
+        return hashlib.sha256(self._header_bytes()).hexdigest()
+
+    def layout(self):
+        """Fix the absolute data offset and each tensor's ``data_offset`` without writing; return the data offset."""
+        return self._place(len(self._header_bytes()))
+
+    def _place(self, header_size):
+        self.data_offset = align_offset(header_size, self.alignment)
+        for info, _ in self._tensors:
+            info.data_offset = self.data_offset + info.offset
+        return self.data_offset
+
+    def write_header(self, mode="wb"):
+        """
+        Write header, metadata and tensor infos; return the absolute data offset
+
+        Pass ``mode="r+b"`` to rewrite the header of an existing file in place
+        without truncating the tensor data after it. A file written from
+        scratch replaces a hardlinked one instead of truncating the data
+        its other links share.
+        """
+        header = self._header_bytes()
+        self._place(len(header))
+        if mode == "wb" and os.path.isfile(self.path) and os.stat(self.path).st_nlink > 1:
+            os.remove(self.path)
+        self._file = open(self.path, mode)
+        self._file.seek(0)
+        # Only a file written sequentially from scratch can be hashed on the fly
+        self._digest = hashlib.sha256() if mode == "wb" else None
+        self._write(header)
+        self._write(b"\0" * (self.data_offset - len(header)))
+        return self.data_offset
+
+    def _write(self, data):
+        self._file.write(data)
+        if self._digest is not None:
+            self._digest.update(data)
+
+    @property
+    def total_size(self):
+        """Final file size; only valid once the header is written."""
+        return self.data_offset + align_offset(self._data_size, self.alignment) if self._tensors else self.data_offset
+
+    def preallocate(self):
+        """Extend the file to its final size so tensors can be written at their offsets."""
+        self._file.truncate(self.total_size)
+        self._digest = None
+
+    def tensor_data_offset(self, name):
+        return self._tensors[self._tensor_index[name]][0].data_offset
+
+    def write_tensor_data_at(self, name, data):
+        """
+        Write one tensor's data, and the zero padding up to the next tensor, at its offset
+
+        For files that are preallocated or rewritten in place, where tensors
+        are written in any order.
+        """
+        info, n_bytes = self._tensors[self._tensor_index[name]]
+        view = memoryview(data).cast("B")
+        if view.nbytes != n_bytes:
+            raise ValueError(f"Tensor {name} expects {n_bytes} bytes, got {view.nbytes}")
+        self._file.seek(info.data_offset)
+        self._file.write(view)
+        self._file.write(b"\0" * (align_offset(n_bytes, self.alignment) - n_bytes))
+
+    def write_tensor_data(self, data):
+        """
+        Stream the next declared tensor's data
+
+        Args:
+            data: Bytes-like object (bytes, memoryview, contiguous NumPy array)
+                or an iterable of bytes-like chunks
+        """
+        if self._next_tensor >= len(self._tensors):
+            raise RuntimeError("All declared tensors have already been written")
+        info, n_bytes = self._tensors[self._next_tensor]
+        if self._digest is None:
+            self._file.seek(info.data_offset)
+        else:
+            # Pad explicitly rather than seeking, so the padding is hashed too
+            self._write(b"\0" * (info.data_offset - self._file.tell()))
+        written = 0
+        chunks = [data] if _is_buffer(data) else data
+        for chunk in chunks:
+            view = memoryview(chunk).cast("B")
+            self._write(view)
+            written += view.nbytes
+        if written != n_bytes:
+            raise ValueError(f"Tensor {info.name} expects {n_bytes} bytes, got {written}")
+        self._next_tensor += 1
+        if self._next_tensor == len(self._tensors):
+            end = self.data_offset + self._data_size
+            self._write(b"\0" * (self.total_size - end))
+
+    def hexdigest(self):
+        """sha256 of the whole file once written sequentially, else None."""
+        if self._digest is None or self._next_tensor < len(self._tensors):
+            return None
+        return self._digest.hexdigest()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _is_buffer(data):
+    try:
+        memoryview(data)
+    except TypeError:
+        return False
+    return True
+
+
+def _format_value(field):
+    value = field.value
+    if field.type == GGUFValueType.ARRAY:
+        preview = ", ".join(repr(v) for v in value[:5])
+        return f"[{preview}{', ...' if len(value) > 5 else ''}] ({len(value)} items)"
+    return repr(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dump the header, metadata and tensor infos of a GGUF file")
+    parser.add_argument("input_file", help="Path to GGUF file")
+    parser.add_argument("--no-tensors", action="store_true", help="Only print metadata")
+
+    args = parser.parse_args()
+    with GGUFReader(args.input_file) as reader:
+        print(f"GGUF v{reader.version}: {reader.kv_count} metadata entries, {reader.tensor_count} tensors")
+        for key, field in reader.fields.items():
+            print(f"  {key} = {_format_value(field)}")
+        if not args.no_tensors:
+            for info in reader.tensors:
+                print(f"  {info.name}: {info.type_name} {list(info.shape)} @ {info.data_offset} ({info.n_bytes} bytes)")
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+
+# Minimum seconds between progress events of one span
+PROGRESS_INTERVAL = 1.0
+
+_MB = 1024 ** 2
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process or any finished child, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+class MetricsLog:
+    """
+    JSON-lines sink for instrumentation events
+
+    Each event is one line, written and flushed under a lock so events
+    from several threads never interleave. ``path`` of ``-`` writes to
+    stderr, keeping stdout for the scripts' own output.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if path == "-":
+            self._file = sys.stderr
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def emit(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stderr:
+            self._file.close()
+
+
+_log = None
+_span_ids = itertools.count(1)
+_local = threading.local()
+
+
+def configure(path):
+    """Send events to the JSON-lines file at ``path`` (``-`` for stderr); None turns them off."""
+    global _log
+    if _log is not None:
+        _log.close()
+    _log = MetricsLog(path) if path else None
+
+
+def emit(event, **fields):
+    """Write one event, stamped with the wall-clock time and process id, if a sink is configured."""
+    if _log is None:
+        return
+    _log.emit(dict(event=event, time=round(time.time(), 3), pid=os.getpid(), **fields))
+
+
+class Span:
+    """
+    Timed stage with byte and item counters
+
+    Entering emits ``span_start`` and leaving emits ``span_end`` with the
+    duration, totals, throughput, peak RSS and whether the stage raised.
+    In between, ``advance`` is the progress callback handed to hot loops:
+    it only adds to two counters and compares a clock against a deadline,
+    and emits a ``progress`` event (with throughput and, when the total is
+    known, an ETA) at most every ``interval`` seconds. It may be called
+    from several threads at once. Spans nest per thread; each event
+    carries its parent's id.
+    """
+
+    def __init__(self, name, total_bytes=None, interval=PROGRESS_INTERVAL, **attrs):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.attrs = attrs
+        self.bytes = 0
+        self.items = 0
+        self.id = None
+        self.parent = None
+        self._start = None
+        self._next_report = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("spans", [])
+        self.id = next(_span_ids)
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self._start = time.monotonic()
+        self._next_report = self._start + self.interval
+        emit("span_start", span=self.name, id=self.id, parent=self.parent, total_bytes=self.total_bytes, **self.attrs)
+        return self
+
+    def advance(self, nbytes=0, items=0):
+        """Record ``nbytes`` bytes and ``items`` items (tensors, files) of progress."""
+        with self._lock:
+            self.bytes += nbytes
+            self.items += items
+            if _log is not None:
+                now = time.monotonic()
+                if now >= self._next_report:
+                    self._next_report = now + self.interval
+                    self._report("progress", now, eta=True)
+
+    def set(self, **attrs):
+        """Attach result attributes (method used, tensor count, ...) to the ``span_end`` event."""
+        self.attrs.update(attrs)
+
+    def _rates(self, now, eta=False):
+        elapsed = now - self._start
+        rates = {
+            "elapsed_s": round(elapsed, 3),
+            "bytes": self.bytes,
+            "items": self.items,
+            "mb_per_s": round(self.bytes / _MB / elapsed, 2) if elapsed > 0 else None,
+            "items_per_s": round(self.items / elapsed, 2) if elapsed > 0 else None,
+        }
+        if self.total_bytes:
+            rates["total_bytes"] = self.total_bytes
+            rates["percent"] = round(100.0 * self.bytes / self.total_bytes, 1)
+            if eta and self.bytes and elapsed > 0:
+                rates["eta_s"] = round(max(self.total_bytes - self.bytes, 0) * elapsed / self.bytes, 1)
+        return rates
+
+    def _report(self, event, now, eta=False, **fields):
+        emit(event, span=self.name, id=self.id, parent=self.parent, peak_rss_bytes=peak_rss(),
+             **self._rates(now, eta), **fields)
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.spans.remove(self)
+        status = {"status": "ok"} if exc_type is None else {"status": "error", "error": f"{exc_type.__name__}: {exc}"}
+        with self._lock:
+            self._report("span_end", time.monotonic(), **status, **self.attrs)
+        return False
+
+
+def span(name, total_bytes=None, **attrs):
+    """``with span("quantize", total_bytes=size) as s: ... s.advance(n)`` - see ``Span``."""
+    return Span(name, total_bytes, **attrs)
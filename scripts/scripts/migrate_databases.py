@@ -0,0 +1,298 @@
+import os
+import re
+import sqlite3
+import hashlib
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+# File patterns searched for databases, as migrate_blocks_timestamps_all.bat did
+DATABASE_PATTERNS = (".db", ".sqlite", ".sqlite3", ".data")
+SQLITE_MAGIC = b"SQLite format 3\0"
+
+# Rows updated per backfill transaction; each batch holds the write lock
+# for milliseconds, so the app can keep using the database meanwhile
+DEFAULT_BATCH_SIZE = 5000
+
+# Tables every Neonote database has; SQLite files without them belong to
+# something else and are left untouched
+APP_TABLES = ("blocks",)
+
+# Applied versions live in their own table: PRAGMA user_version belongs to
+# the app's sqflite schema version
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Session pragmas for migrating: WAL lets readers continue during the
+# backfill, NORMAL sync is durable in WAL mode, and a larger page cache and
+# mmap keep big-table scans off the read() path
+_PRAGMAS = [
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+]
+
+_ADD_COLUMN = re.compile(r"^ALTER\s+TABLE\s+[\"`\[]?(\w+)[\"`\]]?\s+ADD\s+(?:COLUMN\s+)?[\"`\[]?(\w+)", re.IGNORECASE)
+_BACKFILL = re.compile(r"^--\s*backfill:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+_UPDATE = re.compile(r"^UPDATE\s+[\"`\[]?(\w+)[\"`\]]?\s+SET\s+(.+?)(?:\s+WHERE\s+(.+?))?\s*;?\s*$",
+                     re.IGNORECASE | re.DOTALL)
+
+Migration = namedtuple("Migration", ["version", "name", "path", "checksum", "statements", "backfills"])
+Backfill = namedtuple("Backfill", ["table", "assignments", "condition"])
+MigrationResult = namedtuple("MigrationResult", ["path", "applied", "backfilled_rows", "error", "skipped"],
+                             defaults=[None])
+
+
+def split_statements(sql):
+    """Split a SQL script into complete statements (trigger bodies stay whole)."""
+    statements = []
+    pending = ""
+    for line in sql.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statement = "\n".join(l for l in pending.strip().splitlines() if not l.strip().startswith("--")).strip()
+            if statement.rstrip(";").strip():
+                statements.append(statement)
+            pending = ""
+    if any(l.strip() and not l.strip().startswith("--") for l in pending.splitlines()):
+        raise ValueError(f"Incomplete SQL statement: {pending.strip()[:80]}")
+    return statements
+
+
+def parse_backfill(statement):
+    """
+    Parse a ``-- backfill: UPDATE <table> SET ... [WHERE ...]`` directive
+
+    The update is run in batches of rows by ascending rowid, each batch in
+    its own short transaction, after the migration's schema changes commit.
+    """
+    match = _UPDATE.match(statement.strip())
+    if not match:
+        raise ValueError(f"Backfill must be a single-table UPDATE: {statement}")
+    return Backfill(*match.groups())
+
+
+def load_migrations(migrations_dir=DEFAULT_MIGRATIONS_DIR):
+    """
+    Load ``<version>_<name>.sql`` migrations in version order
+
+    Lines starting with ``-- backfill:`` hold an UPDATE that fills existing
+    rows after the schema change (see ``parse_backfill``).
+    """
+    migrations = []
+    for filename in sorted(os.listdir(migrations_dir)):
+        if not filename.endswith(".sql"):
+            continue
+        version, _, name = os.path.splitext(filename)[0].partition("_")
+        path = os.path.join(migrations_dir, filename)
+        with open(path, "r", encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append(Migration(version, name or version, path, hashlib.sha256(sql.encode("utf-8")).hexdigest(),
+                                    split_statements(sql), [parse_backfill(m) for m in _BACKFILL.findall(sql)]))
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {migrations_dir}")
+    return migrations
+
+
+def find_databases(paths):
+    """SQLite files among ``paths``; directories are searched recursively."""
+    candidates = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                candidates += [os.path.join(root, f) for f in sorted(files) if f.endswith(DATABASE_PATTERNS)]
+        else:
+            candidates.append(path)
+    databases = []
+    for path in candidates:
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC:
+                    databases.append(path)
+        except OSError:
+            continue
+    return databases
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _is_app_database(conn):
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return all(table in tables for table in APP_TABLES)
+
+
+def _applied(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TEXT NOT NULL,
+            backfill_step INTEGER NOT NULL DEFAULT 0,
+            backfill_rowid INTEGER
+        )
+    """)
+    return {row[0]: row[1:] for row in conn.execute(
+        f"SELECT version, checksum, backfill_step, backfill_rowid FROM {MIGRATIONS_TABLE}")}
+
+
+def _apply(conn, migration):
+    # All of a migration's statements commit together or not at all.
+    # Columns that already exist (from the app's own schema, or an earlier
+    # ad hoc run) are not added again
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in migration.statements:
+            match = _ADD_COLUMN.match(statement)
+            if match and match.group(2) in _columns(conn, match.group(1)):
+                continue
+            conn.execute(statement)
+        conn.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, checksum, applied_at) "
+                     f"VALUES (?, ?, ?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))",
+                     (migration.version, migration.name, migration.checksum))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _backfill(conn, migration, step, rowid, batch_size):
+    # Keyset pagination over rowid: each batch is the next ``batch_size``
+    # rowids after the last one done, updated and checkpointed in one
+    # transaction, so an interrupted backfill resumes where it stopped
+    updated = 0
+    for index in range(step, len(migration.backfills)):
+        backfill = migration.backfills[index]
+        condition = f" AND ({backfill.condition})" if backfill.condition else ""
+        last = rowid if index == step and rowid is not None else 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(f'SELECT rowid FROM "{backfill.table}" WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?',
+                                   (last, batch_size - 1)).fetchone()
+                if row is None:
+                    row = conn.execute(f'SELECT max(rowid) FROM "{backfill.table}" WHERE rowid > ?', (last,)).fetchone()
+                end = row[0]
+                if end is not None:
+                    cursor = conn.execute(f'UPDATE "{backfill.table}" SET {backfill.assignments} '
+                                          f'WHERE rowid > ? AND rowid <= ?{condition}', (last, end))
+                    updated += cursor.rowcount
+                    conn.execute(f"UPDATE {MIGRATIONS_TABLE} SET backfill_step = ?, backfill_rowid = ? WHERE version = ?",
+                                 (index, end, migration.version))
+                else:
+                    conn.execute(f"UPDATE {MIGRATIONS_TABLE} SET backfill_step = ?, backfill_rowid = NULL "
+                                 f"WHERE version = ?", (index + 1, migration.version))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if end is None:
+                break
+            last = end
+    return updated
+
+
+def migrate_database(path, migrations, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Bring one database up to date
+
+    Applied migrations must still match their recorded checksum. Pending
+    migrations are applied in version order, each in one
+    transaction recorded in ``schema_migrations``, followed by their
+    backfills in batches. The database runs in WAL mode meanwhile and is
+    checkpointed and returned to its previous journal mode afterwards, so
+    the app finds a self-contained file.
+
+    A database without the app's tables is not a Neonote database and
+    is skipped before anything is written to it.
+
+    Returns:
+        ``MigrationResult`` with the versions applied, rows backfilled, the
+        error that stopped migration and why the database was skipped, if any
+    """
+    applied = []
+    updated = 0
+    try:
+        conn = sqlite3.connect(path, isolation_level=None)
+    except sqlite3.Error as e:
+        return MigrationResult(path, applied, updated, f"{type(e).__name__}: {e}")
+    try:
+        if not _is_app_database(conn):
+            return MigrationResult(path, applied, updated, None, f"no {', '.join(APP_TABLES)} table, not a Neonote database")
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        try:
+            done = _applied(conn)
+            # A migration edited after it was applied would leave this
+            # database on a different schema than fresh ones; stop before
+            # applying anything else
+            changed = [migration.version for migration in migrations
+                       if migration.version in done and done[migration.version][0] != migration.checksum]
+            if changed:
+                return MigrationResult(path, applied, updated,
+                                       f"migration {', '.join(changed)} changed since it was applied (checksum mismatch)")
+            for migration in migrations:
+                if migration.version not in done:
+                    _apply(conn, migration)
+                    applied.append(migration.version)
+                    step, rowid = 0, None
+                else:
+                    _checksum, step, rowid = done[migration.version]
+                if step < len(migration.backfills):
+                    updated += _backfill(conn, migration, step, rowid, batch_size)
+        finally:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if journal_mode.lower() != "wal":
+                conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    except sqlite3.Error as e:
+        return MigrationResult(path, applied, updated, f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+    return MigrationResult(path, applied, updated, None)
+
+
+def migrate_databases(paths, migrations_dir=DEFAULT_MIGRATIONS_DIR, jobs=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Migrate every database under ``paths`` on ``jobs`` threads
+
+    Each database is migrated independently (sqlite3 releases the GIL while
+    it works), so one failing database does not stop the others.
+
+    Returns:
+        List of ``MigrationResult`` in database order
+    """
+    migrations = load_migrations(migrations_dir)
+    databases = find_databases(paths)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(databases) or 1))
+    with ThreadPoolExecutor(jobs) as pool:
+        return list(pool.map(lambda path: migrate_database(path, migrations, batch_size), databases))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply scripts/migrations to Neonote SQLite databases")
+    parser.add_argument("paths", nargs="+", help="Database files, or directories searched for *.db/*.sqlite/*.sqlite3/*.data")
+    parser.add_argument("--migrations-dir", default=DEFAULT_MIGRATIONS_DIR, help="Directory of <version>_<name>.sql migrations")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of databases migrated concurrently")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows updated per backfill transaction")
+
+    args = parser.parse_args()
+    results = migrate_databases(args.paths, args.migrations_dir, args.jobs, args.batch_size)
+    for result in results:
+        if result.skipped:
+            print(f"{result.path}: skipped ({result.skipped})")
+        elif result.error:
+            print(f"{result.path}: failed ({result.error}); applied {', '.join(result.applied) or 'nothing'} before it")
+        else:
+            print(f"{result.path}: applied {', '.join(result.applied) or 'nothing (up to date)'}, "
+                  f"{result.backfilled_rows} rows backfilled")
+    if not results:
+        print("No databases found. If the app has not created its database yet, run this again afterwards.")
+    raise SystemExit(1 if any(result.error for result in results) else 0)
@@ -0,0 +1,129 @@
+import os
+import json
+import argparse
+
+from gguf_file import GGUFReader
+
+# config.json key -> GGUF metadata key suffix under the "<architecture>." prefix
+_ARCH_KEYS = {
+    "num_hidden_layers": "block_count",
+    "max_position_embeddings": "context_length",
+    "hidden_size": "embedding_length",
+    "intermediate_size": "feed_forward_length",
+    "num_attention_heads": "attention.head_count",
+    "num_key_value_heads": "attention.head_count_kv",
+    "rms_norm_eps": "attention.layer_norm_rms_epsilon",
+    "rope_theta": "rope.freq_base",
+    "sliding_window": "attention.sliding_window",
+}
+
+# config.json key -> tokenizer metadata key
+_TOKEN_KEYS = {
+    "bos_token_id": "tokenizer.ggml.bos_token_id",
+    "eos_token_id": "tokenizer.ggml.eos_token_id",
+    "pad_token_id": "tokenizer.ggml.padding_token_id",
+}
+
+
+def load_params(params_path):
+    """Load an Ollama params layer, returning {} when there is none."""
+    if not params_path or not os.path.exists(params_path):
+        return {}
+    with open(params_path, "r") as f:
+        return json.load(f)
+
+
+def model_config(gguf_path, params=None):
+    """
+    Build a Hugging Face style config from a GGUF file's metadata
+
+    Only the KV metadata section is parsed and tokenizer arrays are skipped
+    over rather than decoded; tensor data is never touched, however large
+    the model is.
+
+    Args:
+        gguf_path: Path to a GGUF model (e.g. an Ollama weights blob)
+        params: Ollama params layer; ``num_ctx`` sets the runtime context
+            length and the whole dict is kept under ``ollama_params``
+
+    Returns:
+        Config dict
+    """
+    params = params or {}
+    with GGUFReader(gguf_path) as reader:
+        values, array_lengths = reader.scan_metadata()
+
+    arch = values.get("general.architecture")
+    if not arch:
+        raise ValueError(f"{gguf_path} has no general.architecture metadata")
+
+    config = {
+        "model_type": arch,
+        "model_name": values.get("general.name"),
+    }
+    for name, suffix in _ARCH_KEYS.items():
+        value = values.get(f"{arch}.{suffix}")
+        if isinstance(value, float):
+            # GGUF stores float32; drop the binary noise (1e-06, not 9.99999997e-07)
+            value = float(f"{value:.7g}")
+        if value is not None:
+            config[name] = value
+    if "num_attention_heads" in config and "num_key_value_heads" not in config:
+        config["num_key_value_heads"] = config["num_attention_heads"]
+
+    head_dim = values.get(f"{arch}.attention.key_length")
+    if head_dim is None and config.get("hidden_size") and config.get("num_attention_heads"):
+        head_dim = config["hidden_size"] // config["num_attention_heads"]
+    if head_dim is not None:
+        config["head_dim"] = head_dim
+
+    vocab_size = values.get(f"{arch}.vocab_size", array_lengths.get("tokenizer.ggml.tokens"))
+    if vocab_size is not None:
+        config["vocab_size"] = vocab_size
+
+    scaling_type = values.get(f"{arch}.rope.scaling.type")
+    if scaling_type and scaling_type != "none":
+        config["rope_scaling"] = {
+            "type": scaling_type,
+            "factor": values.get(f"{arch}.rope.scaling.factor"),
+            "original_max_position_embeddings": values.get(f"{arch}.rope.scaling.original_context_length"),
+        }
+
+    for name, key in _TOKEN_KEYS.items():
+        if key in values:
+            config[name] = values[key]
+
+    if "general.file_type" in values:
+        config["file_type"] = values["general.file_type"]
+
+    # The runtime context the model was packaged with; the app sizes its KV cache from it
+    context_length = params.get("num_ctx", config.get("max_position_embeddings"))
+    if context_length is not None:
+        config["context_length"] = context_length
+    if params:
+        config["ollama_params"] = params
+
+    return config
+
+
+def write_model_config(gguf_path, config_path, params=None, **extra):
+    """Write ``model_config(gguf_path, params)`` plus ``extra`` entries as JSON to ``config_path``."""
+    config = model_config(gguf_path, params)
+    config.update(extra)
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive config.json from a GGUF model's metadata")
+    parser.add_argument("gguf_file", help="Path to GGUF model file or Ollama weights blob")
+    parser.add_argument("--params", help="Path to the Ollama params layer")
+    parser.add_argument("--output", help="Write the config here instead of printing it")
+
+    args = parser.parse_args()
+    params = load_params(args.params)
+    if args.output:
+        write_model_config(args.gguf_file, args.output, params)
+    else:
+        print(json.dumps(model_config(args.gguf_file, params), indent=2))
@@ -0,0 +1,368 @@
+import os
+import json
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from checksums import file_sha256
+
+# Ollama layer media types we care about, mapped to short layer kinds
+MEDIA_TYPES = {
+    "application/vnd.ollama.image.model": "model",
+    "application/vnd.ollama.image.params": "params",
+    "application/vnd.ollama.image.template": "template",
+    "application/vnd.ollama.image.adapter": "adapter",
+    "application/vnd.ollama.image.projector": "projector",
+    "application/vnd.ollama.image.system": "system",
+    "application/vnd.ollama.image.license": "license",
+    "application/vnd.ollama.image.messages": "messages",
+}
+
+DEFAULT_REGISTRY = "registry.ollama.ai"
+DEFAULT_NAMESPACE = "library"
+DEFAULT_TAG = "latest"
+
+INDEX_VERSION = 1
+
+# Read buffer of each verification thread; hashlib releases the GIL while
+# hashing it, so threads hash different blobs in parallel
+VERIFY_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Outcome of ``BlobCatalog.verify``: blob names hashed and found intact,
+# intact per the cache, {name: problem} of damaged blobs, leftover partial
+# download files, and intact blobs no manifest references
+VerifyReport = namedtuple("VerifyReport", ["verified", "cached", "corrupt", "partial", "orphaned"])
+
+
+def default_index_path():
+    """Return the default location of the on-disk blob index."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "neonote", "ollama-blob-index.json")
+
+
+def find_models_dir(path):
+    """
+    Locate the Ollama ``models`` directory from a user supplied path
+
+    Accepts the Ollama root (``~/.ollama``), the ``models`` directory itself
+    or its ``blobs``/``manifests`` subdirectories.
+    """
+    path = os.path.abspath(path)
+    candidates = [path, os.path.join(path, "models")]
+    if os.path.basename(path) in ("blobs", "manifests"):
+        candidates.insert(0, os.path.dirname(path))
+    for candidate in candidates:
+        if os.path.isdir(os.path.join(candidate, "blobs")) and os.path.isdir(os.path.join(candidate, "manifests")):
+            return candidate
+    raise FileNotFoundError(f"Could not find an Ollama models directory (blobs + manifests) at {path}")
+
+
+def parse_model_name(name):
+    """
+    Split an Ollama model reference into its manifest path components
+
+    ``qwen2.5:7b`` -> (registry.ollama.ai, library, qwen2.5, 7b)
+    ``user/model`` -> (registry.ollama.ai, user, model, latest)
+    ``host/ns/model:tag`` -> (host, ns, model, tag)
+    """
+    if not name:
+        raise ValueError("Model name must not be empty")
+    path, tag = name, DEFAULT_TAG
+    if ":" in name.rsplit("/", 1)[-1]:
+        path, tag = name.rsplit(":", 1)
+    parts = path.split("/")
+    if len(parts) == 1:
+        return DEFAULT_REGISTRY, DEFAULT_NAMESPACE, parts[0], tag
+    if len(parts) == 2:
+        return DEFAULT_REGISTRY, parts[0], parts[1], tag
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2], tag
+    raise ValueError(f"Invalid Ollama model name: {name}")
+
+
+def digest_to_blob_name(digest):
+    """Convert a manifest digest (``sha256:<hex>``) to its blob filename (``sha256-<hex>``)."""
+    return digest.replace(":", "-", 1)
+
+
+def blob_name_to_digest(name):
+    """Return the hex sha256 carried by a blob filename, or None if it is not a blob."""
+    if not name.startswith("sha256-"):
+        return None
+    hexdigest = name[len("sha256-"):]
+    if len(hexdigest) != 64:
+        return None
+    return hexdigest
+
+
+class BlobCatalog:
+    """
+    Resolve Ollama model references to their layer blobs via the manifests
+
+    Parsed manifests are cached in a JSON index keyed by manifest path and
+    invalidated by the manifest's mtime and size, so repeated resolution of
+    the same model costs one ``stat`` call instead of a scan of the blobs
+    directory. The index also remembers which blobs were verified, keyed by
+    inode, size and mtime.
+    """
+
+    def __init__(self, ollama_dir, index_path=None):
+        self.models_dir = find_models_dir(ollama_dir)
+        self.blobs_dir = os.path.join(self.models_dir, "blobs")
+        self.manifests_dir = os.path.join(self.models_dir, "manifests")
+        self.index_path = index_path or default_index_path()
+        self._index = None
+        self._verified = None
+        self._dirty = False
+
+    def manifest_path(self, name):
+        """Return the manifest file path for a model reference."""
+        return os.path.join(self.manifests_dir, *parse_model_name(name))
+
+    def blob_path(self, digest):
+        """Return the blob file path for a manifest digest."""
+        return os.path.join(self.blobs_dir, digest_to_blob_name(digest))
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        index = {}
+        verified = {}
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                index = data.get("manifests", {})
+                verified = data.get("verified", {})
+        except (OSError, ValueError):
+            pass
+        self._index = index
+        self._verified = verified
+        return index
+
+    def save(self):
+        """Persist the index if any manifest was (re)parsed or blob verified since loading."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "manifests": self._index, "verified": self._verified}, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def _parse_manifest(self, manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        layers = {}
+        for layer in manifest.get("layers", []):
+            kind = MEDIA_TYPES.get(layer.get("mediaType"))
+            digest = layer.get("digest")
+            if not kind or not digest:
+                continue
+            layers.setdefault(kind, []).append({
+                "digest": digest,
+                "blob": digest_to_blob_name(digest),
+                "size": layer.get("size", 0),
+            })
+        config = manifest.get("config") or {}
+        return {
+            "layers": layers,
+            "config_digest": config.get("digest"),
+        }
+
+    def _entry(self, manifest_path):
+        try:
+            st = os.stat(manifest_path)
+        except FileNotFoundError:
+            return None
+        index = self._load_index()
+        key = os.path.abspath(manifest_path)
+        entry = index.get(key)
+        if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+            return entry
+        entry = self._parse_manifest(manifest_path)
+        entry["mtime_ns"] = st.st_mtime_ns
+        entry["size"] = st.st_size
+        index[key] = entry
+        self._dirty = True
+        return entry
+
+    def resolve(self, name):
+        """
+        Resolve a model reference to its layers
+
+        Args:
+            name: Ollama model reference, e.g. ``qwen2.5:7b``
+
+        Returns:
+            Dict mapping layer kind (model, params, template, adapter, ...) to a
+            list of ``{"digest", "blob", "size", "path"}`` entries
+        """
+        manifest_path = self.manifest_path(name)
+        entry = self._entry(manifest_path)
+        if entry is None:
+            raise FileNotFoundError(f"No Ollama manifest for {name} at {manifest_path}")
+        self.save()
+        layers = {}
+        for kind, items in entry["layers"].items():
+            layers[kind] = [dict(item, path=os.path.join(self.blobs_dir, item["blob"])) for item in items]
+        return layers
+
+    def model_blob(self, name):
+        """Return the path of the weights (``model`` layer) blob for a model reference."""
+        layers = self.resolve(name).get("model")
+        if not layers:
+            raise FileNotFoundError(f"Manifest for {name} has no model layer")
+        path = layers[0]["path"]
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Model blob for {name} is missing: {path}")
+        return path
+
+    def iter_models(self):
+        """Yield every model reference (``registry/ns/model:tag``) with a manifest on disk."""
+        for root, _dirs, files in os.walk(self.manifests_dir):
+            rel = os.path.relpath(root, self.manifests_dir)
+            parts = [] if rel == "." else rel.split(os.sep)
+            if len(parts) != 3:
+                continue
+            for tag in files:
+                yield f"{'/'.join(parts)}:{tag}"
+
+    def referenced_blobs(self):
+        """Return the set of blob filenames referenced by any manifest, including config blobs."""
+        referenced = set()
+        for name in self.iter_models():
+            entry = self._entry(self.manifest_path(name))
+            if entry is None:
+                continue
+            for items in entry["layers"].values():
+                referenced.update(item["blob"] for item in items)
+            if entry.get("config_digest"):
+                referenced.add(digest_to_blob_name(entry["config_digest"]))
+        self.save()
+        return referenced
+
+    def blobs(self, name):
+        """Blob filenames of a model reference: every layer plus the config blob."""
+        blobs = [item["blob"] for items in self.resolve(name).values() for item in items]
+        config_digest = self._entry(self.manifest_path(name)).get("config_digest")
+        if config_digest:
+            blobs.append(digest_to_blob_name(config_digest))
+        return blobs
+
+    def _layer_sizes(self):
+        # Blob name -> size recorded in the manifests that reference it
+        sizes = {}
+        for name in self.iter_models():
+            entry = self._entry(self.manifest_path(name))
+            if entry is None:
+                continue
+            for items in entry["layers"].values():
+                sizes.update((item["blob"], item["size"]) for item in items if item.get("size"))
+        return sizes
+
+    def verify(self, blobs=None, threads=None, chunk_size=VERIFY_CHUNK_SIZE, progress=None):
+        """
+        Check blobs against the sha256 in their names
+
+        Blobs are hashed concurrently on ``threads`` threads, largest first,
+        each streaming through its own ``chunk_size`` buffer. A blob whose
+        size differs from its manifest layer is reported without hashing it,
+        and one whose inode, size and mtime match an earlier successful
+        check is not hashed again.
+
+        Args:
+            blobs: Blob filenames to check (default: every blob in the store)
+            threads: Hashing threads (default: CPU count)
+            chunk_size: Read buffer size of each thread
+            progress: Optional ``progress(nbytes, items)`` callback, called per
+                chunk hashed and with one item per blob hashed or found
+                unchanged; it is called from the hashing threads
+
+        Returns:
+            ``VerifyReport``; orphans are only reported when checking the whole store
+        """
+        check_all = blobs is None
+        if check_all:
+            blobs = sorted(os.listdir(self.blobs_dir))
+        self._load_index()
+        sizes = self._layer_sizes()
+        verified, cached, corrupt, partial, pending = [], [], {}, [], []
+        for name in blobs:
+            digest = blob_name_to_digest(name)
+            if digest is None:
+                if name.startswith("sha256-"):
+                    partial.append(name)
+                continue
+            path = os.path.join(self.blobs_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                corrupt[name] = "missing"
+                continue
+            if name in sizes and st.st_size != sizes[name]:
+                corrupt[name] = f"size {st.st_size}, manifest says {sizes[name]}"
+                continue
+            key = [st.st_ino, st.st_size, st.st_mtime_ns]
+            if self._verified.get(path) == key:
+                cached.append(name)
+                if progress is not None:
+                    progress(0, 1)
+            else:
+                pending.append((st.st_size, name, path, key))
+
+        def check(item):
+            _size, name, path, key = item
+            digest = file_sha256(path, chunk_size, progress)
+            if progress is not None:
+                progress(0, 1)
+            return name, path, key, digest
+
+        pending.sort(reverse=True)
+        with ThreadPoolExecutor(max(1, threads or os.cpu_count() or 1)) as pool:
+            for name, path, key, digest in pool.map(check, pending):
+                if digest == blob_name_to_digest(name):
+                    verified.append(name)
+                    self._verified[path] = key
+                else:
+                    corrupt[name] = f"sha256 {digest}"
+                    self._verified.pop(path, None)
+                self._dirty = True
+
+        orphaned = []
+        if check_all:
+            referenced = self.referenced_blobs()
+            orphaned = sorted(name for name in verified + cached if name not in referenced)
+        self.save()
+        return VerifyReport(sorted(verified), sorted(cached), corrupt, sorted(partial), orphaned)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve Ollama models to their layer blobs")
+    parser.add_argument("--ollama-dir", required=True, help="Path to Ollama directory, models directory or blobs directory")
+    parser.add_argument("--model", help="Model reference to resolve (e.g. qwen2.5:7b); lists all models if omitted")
+    parser.add_argument("--index", help="Path to the blob index file")
+    parser.add_argument("--verify", action="store_true", help="Check every blob (or the --model's blobs) against its sha256 and list orphaned blobs")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Number of hashing threads for --verify")
+
+    args = parser.parse_args()
+    catalog = BlobCatalog(args.ollama_dir, args.index)
+    if args.verify:
+        blobs = None
+        if args.model:
+            blobs = catalog.blobs(args.model)
+        report = catalog.verify(blobs, args.threads)
+        print(f"{len(report.verified)} blobs verified, {len(report.cached)} unchanged since their last check")
+        for name, problem in sorted(report.corrupt.items()):
+            print(f"Corrupt: {name} ({problem})")
+        for name in report.partial:
+            print(f"Partial download: {name}")
+        for name in report.orphaned:
+            print(f"Orphaned: {name} ({os.path.getsize(os.path.join(catalog.blobs_dir, name))} bytes)")
+        raise SystemExit(1 if report.corrupt else 0)
+    if args.model:
+        print(json.dumps(catalog.resolve(args.model), indent=2))
+    else:
+        for model in catalog.iter_models():
+            print(model)
@@ -0,0 +1,478 @@
+import os
+import queue
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import ggml_quants
+from build_cache import ArtifactCache
+from convert_to_gguf import OUTTYPES, SOURCE_TYPES, from_float32, plan_checkpoint
+from file_transfer import write_sidecar
+from gguf_file import GGUF_DEFAULT_ALIGNMENT, GGUFReader, GGUFValueType, GGUFWriter, TensorInfo, tensor_nbytes
+from ollama_blobs import BlobCatalog, parse_model_name
+from optimize_model import PAGE_ALIGNMENT, execution_order, layer_index_path, write_layer_index
+from quantize_model import (DEFAULT_MEMORY_BUDGET, FILE_TYPES, GGML_QUANTIZATION_VERSION, MemoryBudget, decoded_cost,
+                            prequantized_types, row_slices, tensor_types)
+from safetensors_file import SafetensorsReader, checkpoint_files
+
+# A tensor as the source provides it: ``info`` carries the unquantized GGUF
+# name, shape and type, ``load()`` returns the raw source data of
+# ``source_type`` (a zero-copy view into the source mapping) and
+# ``release()`` drops its pages from the resident set once it is written
+PipelineTensor = namedtuple("PipelineTensor", ["info", "source_type", "load", "release"])
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def _gguf_source(reader, writer):
+    """Tensors of a GGUF file (e.g. an Ollama blob); its metadata is copied to ``writer``."""
+    writer.copy_fields(reader)
+    tensors = []
+    for info in reader.tensors:
+        if info.ggml_type in ggml_quants.FLOAT_TYPES:
+            load = lambda info=info: reader.tensor_array(info)
+        else:
+            load = lambda info=info: reader.tensor_data(info)
+        tensors.append(PipelineTensor(info, info.ggml_type, load, lambda info=info: reader.release_tensor(info)))
+    return tensors
+
+
+def _checkpoint_source(model_dir, readers, writer, outtype):
+    """Tensors of a Hugging Face Qwen2 safetensors checkpoint; its metadata is declared on ``writer``."""
+    tensors = []
+    for reader, st_info, name, output_type in plan_checkpoint(model_dir, readers, writer, outtype):
+        info = TensorInfo(name, tuple(reversed(st_info.shape)), output_type, 0, None)
+        tensors.append(PipelineTensor(info, SOURCE_TYPES[st_info.dtype],
+                                      lambda reader=reader, st_info=st_info: reader.tensor_array(st_info.name),
+                                      lambda reader=reader, st_info=st_info: reader.release_tensor(st_info.name)))
+    return tensors
+
+
+def _put(q, item, stop):
+    # Bounded put that gives up once a downstream stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _run_stage(inbox, outbox, func, stop):
+    try:
+        while True:
+            item = _get(inbox, stop) if isinstance(inbox, queue.Queue) else next(inbox, _DONE)
+            if item is _DONE or isinstance(item, _Failure):
+                _put(outbox, item, stop)
+                return
+            if stop.is_set():
+                return
+            _put(outbox, func(item), stop)
+    except BaseException as e:
+        _put(outbox, _Failure(e), stop)
+
+
+def _release_when_done(futures, budget, cost):
+    # Return ``cost`` to the budget once the last of ``futures`` has finished
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            budget.release(cost)
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _encode(values, target_type):
+    if ggml_quants.can_quantize(target_type):
+        return ggml_quants.quantize(values, target_type)
+    return from_float32(values, target_type)
+
+
+def _chunks(result):
+    # A converted tensor is a buffer, or a list of buffers and futures of buffers in file order
+    if not isinstance(result, list):
+        return result
+    return (part.result() if isinstance(part, Future) else part for part in result)
+
+
+def stream_tensors(tensors, target_types, writers, threads=1, queue_depth=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Stream tensors through reader -> converter -> quantizer -> writer stages
+
+    The reader and converter run on their own threads and quantization on a
+    pool of ``threads`` threads (the NumPy kernels release the GIL), all
+    connected by bounded queues, so at most ``queue_depth`` tensors are held
+    between any two stages. Each tensor is read once and decoded a slice of
+    rows at a time; every slice is fanned out to one quantization or
+    conversion task per distinct target type and only admitted while the
+    decoded working sets in flight fit in ``memory_budget``. The writers
+    consume results in declaration order on the calling thread, after which
+    the tensor's source pages are released. The encoded size of a tensor is
+    charged to ``memory_budget`` before its first slice is decoded and only
+    returned once every writer has written it, so results waiting for the
+    writer in the queues count against the budget too.
+
+    Args:
+        tensors: ``PipelineTensor`` list in output order
+        target_types: For each writer, the output ggml type of each tensor
+        writers: ``GGUFWriter`` list whose headers have been written
+        threads: Quantization threads
+        queue_depth: Capacity of each queue (default ``2 * threads``)
+        memory_budget: Bytes of decoded tensor data (plus quantization
+            temporaries) and encoded results allowed in flight
+    """
+    queue_depth = queue_depth or 2 * max(1, threads)
+    read_queue = queue.Queue(queue_depth)
+    quantize_queue = queue.Queue(queue_depth)
+    stop = threading.Event()
+    budget = MemoryBudget(memory_budget)
+    slice_cost = memory_budget // max(1, threads)
+
+    def read(index):
+        tensor = tensors[index]
+        return index, tensor.load()
+
+    def convert(item):
+        index, data = item
+        info = tensors[index].info
+        source_type = tensors[index].source_type
+        encode_types = sorted({types[index] for types in target_types if types[index] != source_type})
+        encoded = {target_type: [] for target_type in encode_types}
+        reserved = sum(tensor_nbytes(info.shape, target_type) for target_type in encode_types)
+        if encode_types:
+            # The encoded tensor is held until the writer is done with it; a
+            # slice is admitted next to it once nothing else is in flight
+            if not budget.acquire(reserved, stop):
+                return index, [], 0
+            rows = data.reshape(-1, info.shape[0])
+            for start, end in row_slices(info, slice_cost // len(encode_types)):
+                cost = decoded_cost(info, end - start) * len(encode_types)
+                if not budget.acquire(cost, stop, held=reserved):
+                    return index, [], reserved
+                values = ggml_quants.to_float32(rows[start:end], source_type)
+                futures = [pool.submit(_encode, values, target_type) for target_type in encode_types]
+                _release_when_done(futures, budget, cost)
+                for target_type, future in zip(encode_types, futures):
+                    encoded[target_type].append(future)
+        return index, [data if types[index] == source_type else encoded[types[index]] for types in target_types], reserved
+
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        stages = [
+            threading.Thread(target=_run_stage, args=(iter(range(len(tensors))), read_queue, read, stop), daemon=True),
+            threading.Thread(target=_run_stage, args=(read_queue, quantize_queue, convert, stop), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            while True:
+                item = _get(quantize_queue, stop)
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                index, results, reserved = item
+                for writer, result in zip(writers, results):
+                    writer.write_tensor_data(_chunks(result))
+                tensors[index].release()
+                budget.release(reserved)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+
+
+def output_name(model_name, quantize):
+    """Asset file name of a build: ``qwen2.5:7b`` at q4_0 -> ``qwen2.5-7b-gguf-q4_0.bin``."""
+    _registry, _namespace, model, tag = parse_model_name(model_name)
+    return f"{model}-{tag}-gguf-{quantize}.bin"
+
+
+def build_variants(outputs, ollama_dir=None, model_name="qwen2.5:7b", checkpoint_dir=None, threads=1,
+                   outtype="f16", queue_depth=None, index_path=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                   alignment=None, layer_index=False):
+    """
+    Build quantized GGUF files of one model in a single pass over its source
+
+    Tensors are read from the memory-mapped source, decoded once, quantized
+    to every requested type and written straight to the output files, which
+    are the only files written; each gets a ``.sha256`` sidecar from its
+    writer's streaming digest.
+
+    With ``alignment`` the outputs are laid out as ``optimize_gguf`` would
+    lay them out: tensors in execution order, their data aligned to
+    ``alignment``. The source is then read in that order instead of file
+    order.
+
+    Args:
+        outputs: Mapping of quantization type (q4_0, q5_k_m, ...) -> output path
+        ollama_dir: Ollama directory holding ``model_name`` (GGUF weights blob)
+        model_name: Ollama model reference
+        checkpoint_dir: Hugging Face Qwen2 safetensors checkpoint, used instead of ``ollama_dir``
+        threads: Quantization threads
+        outtype: Type of unquantized 2-D weights from a checkpoint (f32, f16, bf16)
+        queue_depth: Capacity of each stage queue
+        index_path: Path to the cached Ollama blob index
+        memory_budget: Bytes of decoded tensor data allowed in flight
+        alignment: Optimize the outputs for mmap loading with this tensor data alignment, or None to keep the source layout
+        layer_index: Also write a ``.layers.json`` sidecar with per-layer offsets (optimized outputs only)
+
+    Returns:
+        Mapping of quantization type -> number of tensors that were quantized
+    """
+    # llama.cpp rejects a general.alignment that is not a power of two
+    if alignment is not None and (alignment <= 0 or alignment & (alignment - 1)):
+        raise ValueError(f"Alignment {alignment} is not a power of two")
+    for quantize in outputs:
+        if quantize not in ggml_quants.QUANTIZE_TYPES:
+            raise ValueError(f"Unsupported quantization type {quantize}, expected one of {', '.join(ggml_quants.QUANTIZE_TYPES)}")
+    if checkpoint_dir is None and ollama_dir is None:
+        raise ValueError("Either an Ollama directory or a checkpoint directory is required")
+
+    readers = []
+    writers = {}
+    try:
+        source = GGUFWriter(None)
+        if checkpoint_dir is not None:
+            readers = [SafetensorsReader(path) for path in checkpoint_files(checkpoint_dir)]
+            tensors = _checkpoint_source(checkpoint_dir, readers, source, outtype)
+        else:
+            blob_path = BlobCatalog(ollama_dir, index_path).model_blob(model_name)
+            print(f"Resolved {model_name} to model blob: {blob_path}")
+            readers = [GGUFReader(blob_path)]
+            tensors = _gguf_source(readers[0], source)
+        if alignment is not None:
+            by_name = {tensor.info.name: tensor for tensor in tensors}
+            tensors = [by_name[info.name] for info in execution_order([tensor.info for tensor in tensors])]
+
+        quantized = {}
+        target_types = []
+        for quantize, output_path in outputs.items():
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            writer = writers[quantize] = GGUFWriter(f"{output_path}.partial", alignment or source.alignment)
+            writer.copy_fields(source, skip=("general.alignment",) if alignment is not None else ())
+            types = tensor_types([tensor.info for tensor in tensors], quantize)
+            quantized[quantize] = sum(1 for tensor, t in zip(tensors, types) if t != tensor.info.ggml_type)
+            kept = prequantized_types([tensor.info for tensor in tensors], quantize)
+            if kept:
+                print(f"Warning: the source is already quantized ({', '.join(kept)}); those tensors are copied as is, "
+                      f"so {output_path} is not {quantize} throughout")
+            if quantized[quantize]:
+                writer.remove_field("general.quantization_version")
+                writer.remove_field("general.file_type")
+                writer.add_field("general.quantization_version", GGML_QUANTIZATION_VERSION, GGUFValueType.UINT32)
+                writer.add_field("general.file_type", FILE_TYPES[quantize], GGUFValueType.UINT32)
+            if alignment is not None and alignment != GGUF_DEFAULT_ALIGNMENT:
+                writer.add_field("general.alignment", alignment, GGUFValueType.UINT32)
+            for tensor, tensor_type in zip(tensors, types):
+                writer.add_tensor_info(tensor.info.name, tensor.info.shape, tensor_type)
+            writer.write_header()
+            target_types.append(types)
+
+        stream_tensors(tensors, target_types, list(writers.values()), threads, queue_depth, memory_budget)
+        for quantize, writer in writers.items():
+            digest = writer.hexdigest()
+            writer.close()
+            os.replace(writer.path, outputs[quantize])
+            write_sidecar(outputs[quantize], digest)
+            _place_layer_index(outputs[quantize], writer, alignment is not None and layer_index)
+        return quantized
+    finally:
+        for writer in writers.values():
+            writer.close()
+            if os.path.exists(writer.path):
+                os.remove(writer.path)
+        for reader in readers:
+            reader.close()
+
+
+def _place_layer_index(path, layout, layer_index):
+    # ``layout`` is the writer of ``path`` or a reader of it (a cached build)
+    if layer_index:
+        write_layer_index(path, layout)
+    elif os.path.exists(layer_index_path(path)):
+        # An index from an earlier run would describe a different layout
+        os.remove(layer_index_path(path))
+
+
+def run_pipeline(output_path, ollama_dir=None, model_name="qwen2.5:7b", checkpoint_dir=None, quantize="q4_0",
+                 threads=1, outtype="f16", queue_depth=None, index_path=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 alignment=None, layer_index=False):
+    """Build one quantized GGUF file in a single streaming pass; return the number of tensors quantized."""
+    return build_variants({quantize: output_path}, ollama_dir, model_name, checkpoint_dir, threads, outtype,
+                          queue_depth, index_path, memory_budget, alignment, layer_index)[quantize]
+
+
+def _build_model(ollama_dir, model_name, outputs, threads, queue_depth, index_path, memory_budget, alignment,
+                 layer_index):
+    build_variants(outputs, ollama_dir, model_name, threads=threads, queue_depth=queue_depth, index_path=index_path,
+                   memory_budget=memory_budget, alignment=alignment, layer_index=layer_index)
+    return model_name
+
+
+def build_stage(alignment):
+    """Cache stage name of a pipeline build: plain quantization, or quantization optimized to ``alignment``."""
+    return "quantize" if alignment is None else f"quantize+optimize:{alignment}"
+
+
+def fetch_cached(cache, key, output_path, layer_index=False):
+    """Place a cached build at ``output_path`` and give it the requested layer index; False if not cached."""
+    if not cache.fetch(key, output_path):
+        return False
+    if layer_index:
+        with GGUFReader(output_path) as reader:
+            _place_layer_index(output_path, reader, True)
+    else:
+        _place_layer_index(output_path, None, False)
+    return True
+
+
+def build_batch(ollama_dir, models, quantizations, output_dir, jobs=1, threads=1, queue_depth=None,
+                index_path=None, cache=None, memory_budget=DEFAULT_MEMORY_BUDGET, alignment=None, layer_index=False):
+    """
+    Build every requested quantization of several Ollama models
+
+    Each model is read once for all of its quantizations. Models are
+    scheduled across ``jobs`` worker processes, each running its own
+    streaming pipeline with ``threads // jobs`` quantization threads and
+    ``memory_budget // jobs`` bytes of decoded data.
+    Variants already in the artifact cache are placed from it instead.
+
+    Args:
+        ollama_dir: Path to Ollama directory, models directory or blobs directory
+        models: Ollama model references (e.g. qwen2.5:7b)
+        quantizations: Quantization types to build for every model
+        output_dir: Directory receiving ``output_name(model, quantize)`` files
+        jobs: Models built concurrently
+        threads: Quantization threads shared by all jobs
+        queue_depth: Capacity of each stage queue
+        index_path: Path to the cached Ollama blob index
+        cache: ``ArtifactCache`` to reuse and store builds in, or None to always build
+        memory_budget: Bytes of decoded tensor data allowed in flight across all jobs
+        alignment: Optimize the outputs for mmap loading with this tensor data alignment, or None to keep the source layout
+        layer_index: Also write a ``.layers.json`` sidecar with per-layer offsets (optimized outputs only)
+
+    Returns:
+        Mapping of (model, quantize) -> output path
+    """
+    catalog = BlobCatalog(ollama_dir, index_path)
+    results = {}
+    pending = {}
+    cache_keys = {}
+    for model_name in models:
+        digest = cache.source_digest(catalog.model_blob(model_name)) if cache else None
+        for quantize in quantizations:
+            output_path = os.path.join(output_dir, output_name(model_name, quantize))
+            results[(model_name, quantize)] = output_path
+            if cache:
+                cache_keys[(model_name, quantize)] = cache.key(digest, build_stage(alignment), quantize)
+                if fetch_cached(cache, cache_keys[(model_name, quantize)], output_path,
+                                alignment is not None and layer_index):
+                    print(f"Using cached {quantize} build of {model_name}: {output_path}")
+                    continue
+            pending.setdefault(model_name, {})[quantize] = output_path
+
+    def finish(model_name):
+        print(f"Built {', '.join(pending[model_name])} of {model_name}")
+        if cache:
+            for quantize, output_path in pending[model_name].items():
+                cache.put(cache_keys[(model_name, quantize)], output_path)
+
+    jobs = max(1, min(jobs, len(pending)))
+    job_threads = max(1, threads // jobs)
+    job_budget = memory_budget // jobs
+    if jobs == 1:
+        for model_name, outputs in pending.items():
+            finish(_build_model(ollama_dir, model_name, outputs, job_threads, queue_depth, index_path, job_budget,
+                                alignment, layer_index))
+        return results
+
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(_build_model, ollama_dir, model_name, outputs, job_threads, queue_depth, index_path,
+                               job_budget, alignment, layer_index)
+                   for model_name, outputs in pending.items()]
+        for future in as_completed(futures):
+            finish(future.result())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build quantized Neonote models in one streaming pass per model")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ollama-dir", help="Path to Ollama directory, models directory or blobs directory")
+    source.add_argument("--checkpoint-dir", help="Path to a Hugging Face Qwen2 safetensors checkpoint")
+    parser.add_argument("--output-dir", required=True, help="Path to output directory for the final models")
+    parser.add_argument("--output-name", help="File name of the final model (single model and quantization only)")
+    parser.add_argument("--model", nargs="+", default=["qwen2.5:7b"], help="Ollama model references to build (e.g. qwen2.5:7b)")
+    parser.add_argument("--quantize", nargs="+", default=["q4_0"], choices=list(ggml_quants.QUANTIZE_TYPES), help="Quantization types to build")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Number of quantization threads")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of models built concurrently")
+    parser.add_argument("--outtype", default="f16", choices=list(OUTTYPES), help="Type of unquantized 2-D weights from a checkpoint")
+    parser.add_argument("--queue-depth", type=int, help="Tensors buffered between pipeline stages (default 2 x threads)")
+    parser.add_argument("--blob-index", help="Path to the cached Ollama blob index")
+    parser.add_argument("--cache-dir", help="Artifact cache directory; rebuilds of an unchanged Ollama blob reuse the cached output")
+    parser.add_argument("--max-memory", type=float, default=DEFAULT_MEMORY_BUDGET / 1024 ** 3,
+                        help="GB of decoded tensor data held at once, shared by all jobs")
+    parser.add_argument("--no-optimize", action="store_true", help="Keep the source's tensor order and alignment instead of laying the models out for mmap loading")
+    parser.add_argument("--alignment", type=int, default=PAGE_ALIGNMENT, help="Tensor data alignment in bytes of the optimized models (device page size)")
+    parser.add_argument("--layer-index", action="store_true", help="Also write a .layers.json sidecar with per-layer offsets next to each model")
+
+    args = parser.parse_args()
+    if args.output_name and (len(args.model) > 1 or len(args.quantize) > 1):
+        parser.error("--output-name only applies to a single model and quantization")
+    if args.no_optimize and args.layer_index:
+        parser.error("--layer-index requires the optimized layout")
+    if not args.no_optimize and (args.alignment <= 0 or args.alignment & (args.alignment - 1)):
+        parser.error(f"--alignment {args.alignment} is not a power of two")
+    memory_budget = int(args.max_memory * 1024 ** 3)
+    alignment = None if args.no_optimize else args.alignment
+
+    if args.checkpoint_dir:
+        outputs = {quantize: os.path.join(args.output_dir, args.output_name or output_name(args.model[0], quantize))
+                   for quantize in args.quantize}
+        quantized = build_variants(outputs, checkpoint_dir=args.checkpoint_dir, threads=args.threads,
+                                   outtype=args.outtype, queue_depth=args.queue_depth, memory_budget=memory_budget,
+                                   alignment=alignment, layer_index=args.layer_index)
+        for quantize, count in quantized.items():
+            print(f"Build complete. {count} tensors quantized, model saved to {outputs[quantize]}")
+    elif args.output_name:
+        output_path = os.path.join(args.output_dir, args.output_name)
+        cache = ArtifactCache(args.cache_dir) if args.cache_dir else None
+        if cache:
+            blob_path = BlobCatalog(args.ollama_dir, args.blob_index).model_blob(args.model[0])
+            cache_key = cache.key(cache.source_digest(blob_path), build_stage(alignment), args.quantize[0])
+        if cache and fetch_cached(cache, cache_key, output_path, args.layer_index):
+            print(f"Using cached {args.quantize[0]} build, model placed at {output_path}")
+        else:
+            quantized = run_pipeline(output_path, args.ollama_dir, args.model[0], quantize=args.quantize[0],
+                                     threads=args.threads, queue_depth=args.queue_depth, index_path=args.blob_index,
+                                     memory_budget=memory_budget, alignment=alignment, layer_index=args.layer_index)
+            if cache:
+                cache.put(cache_key, output_path)
+            print(f"Build complete. {quantized} tensors quantized, model saved to {output_path}")
+    else:
+        results = build_batch(args.ollama_dir, args.model, args.quantize, args.output_dir, args.jobs, args.threads,
+                              args.queue_depth, args.blob_index, ArtifactCache(args.cache_dir) if args.cache_dir else None,
+                              memory_budget, alignment, args.layer_index)
+        for (model_name, quantize), output_path in results.items():
+            print(f"{model_name} {quantize}: {output_path}")
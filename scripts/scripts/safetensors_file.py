@@ -0,0 +1,139 @@
+import os
+import mmap
+import json
+import struct
+import argparse
+
+from gguf_file import release_pages
+
+# safetensors dtype -> (NumPy dtype, bytes per element); BF16 is exposed as raw uint16
+SAFETENSORS_DTYPES = {
+    "F64": ("<f8", 8),
+    "F32": ("<f4", 4),
+    "F16": ("<f2", 2),
+    "BF16": ("<u2", 2),
+    "I64": ("<i8", 8),
+    "I32": ("<i4", 4),
+    "I16": ("<i2", 2),
+    "I8": ("i1", 1),
+    "U8": ("u1", 1),
+    "BOOL": ("?", 1),
+}
+
+
+class SafetensorsTensor:
+    """Header entry of one tensor; ``start``/``end`` are absolute file offsets."""
+
+    __slots__ = ("name", "dtype", "shape", "start", "end")
+
+    def __init__(self, name, dtype, shape, start, end):
+        self.name = name
+        self.dtype = dtype
+        self.shape = tuple(shape)
+        self.start = start
+        self.end = end
+
+    @property
+    def n_elements(self):
+        n = 1
+        for dim in self.shape:
+            n *= dim
+        return n
+
+    @property
+    def n_bytes(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"SafetensorsTensor({self.name!r}, dtype={self.dtype}, shape={self.shape})"
+
+
+class SafetensorsReader:
+    """
+    Memory-mapped safetensors reader
+
+    Parses the JSON header and exposes tensors as zero-copy NumPy views into
+    the mapping, so nothing is read until a tensor's pages are touched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty, not a safetensors file")
+        (header_size,) = struct.unpack_from("<Q", self._mmap, 0)
+        if 8 + header_size > len(self._mmap):
+            self.close()
+            raise ValueError(f"{path} is not a safetensors file")
+        header = json.loads(self._mmap[8:8 + header_size].decode("utf-8"))
+        self.metadata = header.pop("__metadata__", None) or {}
+        data_start = 8 + header_size
+        self.tensors = {}
+        for name, entry in header.items():
+            start, end = entry["data_offsets"]
+            if entry["dtype"] not in SAFETENSORS_DTYPES:
+                self.close()
+                raise ValueError(f"Tensor {name} in {path} has unsupported dtype {entry['dtype']}")
+            self.tensors[name] = SafetensorsTensor(name, entry["dtype"], entry["shape"],
+                                                   data_start + start, data_start + end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Tensor views are still alive; the mapping is released with them
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def tensor_array(self, name):
+        """NumPy view of a tensor in its stored shape; BF16 comes back as raw ``uint16`` bits."""
+        import numpy as np
+
+        info = self.tensors[name]
+        dtype, item_size = SAFETENSORS_DTYPES[info.dtype]
+        if info.n_elements * item_size != info.n_bytes:
+            raise ValueError(f"Tensor {name} in {self.path} has {info.n_bytes} bytes for shape {info.shape}")
+        array = np.frombuffer(self._mmap, dtype=dtype, count=info.n_elements, offset=info.start)
+        return array.reshape(info.shape)
+
+    def release_tensor(self, name):
+        """Drop a processed tensor's pages from this process's resident set (they stay in the page cache)."""
+        info = self.tensors[name]
+        release_pages(self._mmap, info.start, info.end)
+
+
+def checkpoint_files(model_dir):
+    """
+    Safetensors shards of a Hugging Face checkpoint directory
+
+    Uses ``model.safetensors.index.json`` when present, otherwise every
+    ``*.safetensors`` file in the directory, in name order.
+    """
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(model_dir, name) for name in sorted(set(weight_map.values()))]
+    return [os.path.join(model_dir, name) for name in sorted(os.listdir(model_dir)) if name.endswith(".safetensors")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the tensors of a safetensors file")
+    parser.add_argument("input_file", help="Path to safetensors file")
+
+    args = parser.parse_args()
+    with SafetensorsReader(args.input_file) as reader:
+        print(f"{len(reader.tensors)} tensors")
+        for info in reader.tensors.values():
+            print(f"  {info.name}: {info.dtype} {list(info.shape)} ({info.n_bytes} bytes)")
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from build_cache import ArtifactCache
+from checksums import file_sha256
+from file_transfer import read_sidecar, write_sidecar
+from gguf_file import GGMLType, GGUFWriter
+
+
+def write_model(path, seed=0):
+    writer = GGUFWriter(path)
+    writer.add_field("general.architecture", "qwen2")
+    writer.add_tensor_info("output.weight", (64, 8), GGMLType.Q8_0)
+    with writer:
+        writer.write_header()
+        writer.write_tensor_data(np.random.default_rng(seed).integers(0, 256, 8 * 2 * 34, dtype=np.uint8))
+    write_sidecar(path, file_sha256(path))
+    return path
+
+
+def test_hit_links_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "build")
+    build = write_model(str(tmp_path / "build" / "model.gguf"))
+    entry = cache.put("key", build)
+    assert cache.get("key") == entry
+    assert read_sidecar(entry) == read_sidecar(build)
+
+    output = str(tmp_path / "out" / "model.gguf")
+    assert cache.fetch("key", output)
+    assert os.path.samefile(output, entry)
+    assert read_sidecar(output) == read_sidecar(entry)
+    assert not cache.fetch("other", output)
+
+
+def test_rewriting_fetched_file_keeps_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "build")
+    build = write_model(str(tmp_path / "build" / "model.gguf"))
+    digest = file_sha256(build)
+    entry = cache.put("key", build)
+
+    write_model(build, seed=1)
+    assert not os.path.samefile(build, entry)
+    assert file_sha256(entry) == digest
+    assert cache.get("key") == entry
@@ -0,0 +1,32 @@
+import hashlib
+import os
+
+import pytest
+
+from file_transfer import read_sidecar, transfer_file
+
+
+def write_blob(directory, data, digest=None):
+    path = os.path.join(directory, f"sha256-{digest or hashlib.sha256(data).hexdigest()}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.mark.parametrize("allow_link", [True, False], ids=["link", "copy"])
+def test_verify_checks_blob_name(tmp_path, allow_link):
+    data = os.urandom(1 << 16)
+    blob = write_blob(str(tmp_path), data)
+    output = str(tmp_path / "out" / "model.bin")
+    transfer_file(blob, output, allow_link=allow_link, verify=True)
+    assert read_sidecar(output) == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("allow_link", [True, False], ids=["link", "copy"])
+def test_verify_rejects_mismatched_blob(tmp_path, allow_link):
+    blob = write_blob(str(tmp_path), os.urandom(1 << 16), digest="0" * 64)
+    output = str(tmp_path / "out" / "model.bin")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        transfer_file(blob, output, allow_link=allow_link, verify=True)
+    assert not os.path.exists(output)
+    assert read_sidecar(output) is None
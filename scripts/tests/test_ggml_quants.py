@@ -0,0 +1,89 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+import ggml_quants
+from gguf_file import GGML_TYPE_NAMES, GGMLType
+
+try:
+    from gguf import GGMLQuantizationType, quants as gguf_quants
+except ImportError:
+    gguf_quants = None
+
+requires_gguf_py = pytest.mark.skipif(gguf_quants is None, reason="gguf-py is not installed")
+
+# Types gguf-py can quantize itself: our bytes must match its bytes exactly
+REFERENCE_TYPES = [GGMLType.Q4_0, GGMLType.Q5_0, GGMLType.Q8_0]
+
+# gguf-py only dequantizes k-quants, so their bytes are checked against the
+# sha256 of llama.cpp's quantize_row_q*_K_ref output for ``samples()``
+K_TYPES = {
+    GGMLType.Q4_K: "e0a114d0045c4f6ebaed835bcaebd54cc8c3f0a7f059b5efff967d27faf029c3",
+    GGMLType.Q5_K: "d98c8a14cd0249aa2ded28ed007e9ee35008df09b32685b614752b03ccd23c07",
+    GGMLType.Q6_K: "6bf485804cb3d77ed765aa3dc89fcb85f9c4fcd4aac1c50970385ad00aa73fbc",
+}
+
+# Largest relative RMS error of a ``samples()`` row after a round trip
+MAX_RELATIVE_ERROR = {
+    GGMLType.Q4_0: 0.11, GGMLType.Q5_0: 0.06, GGMLType.Q8_0: 0.01,
+    GGMLType.Q4_K: 0.09, GGMLType.Q5_K: 0.05, GGMLType.Q6_K: 0.025,
+}
+
+
+def samples():
+    """Rows exercising small, large, sparse, constant, one-signed and heavy-tailed blocks."""
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((6, 1024)).astype(np.float32)
+    x[0] *= 1e-3
+    x[1] *= 20
+    x[2, ::2] = 0
+    x[3, :512] = 0
+    x[3, 512:] = 1.5
+    x[4] = np.abs(x[4])
+    x[5] = x[5] ** 3
+    return x
+
+
+@requires_gguf_py
+@pytest.mark.parametrize("ggml_type", REFERENCE_TYPES, ids=GGML_TYPE_NAMES.get)
+def test_quantize_matches_gguf_py(ggml_type):
+    x = samples()
+    expected = gguf_quants.quantize(x, GGMLQuantizationType(ggml_type))
+    assert bytes(ggml_quants.quantize(x, ggml_type)) == expected.tobytes()
+
+
+@requires_gguf_py
+@pytest.mark.parametrize("ggml_type", REFERENCE_TYPES + list(K_TYPES), ids=GGML_TYPE_NAMES.get)
+def test_dequantize_matches_gguf_py(ggml_type):
+    data = np.frombuffer(bytes(ggml_quants.quantize(samples(), ggml_type)), dtype=np.uint8)
+    expected = gguf_quants.dequantize(data, GGMLQuantizationType(ggml_type)).reshape(-1)
+    np.testing.assert_array_equal(ggml_quants.dequantize(data, ggml_type).reshape(-1), expected)
+
+
+@pytest.mark.parametrize("ggml_type", REFERENCE_TYPES, ids=GGML_TYPE_NAMES.get)
+def test_round_trip_error(ggml_type):
+    x = samples()
+    data = ggml_quants.quantize(x, ggml_type)
+    y = ggml_quants.dequantize(data, ggml_type).reshape(x.shape)
+    # Within one quantization step of each block (the value opposite the
+    # signed absmax of a Q4_0/Q5_0 block is clipped by up to a step), plus
+    # the fp16 rounding of the block scale
+    levels = {GGMLType.Q4_0: 8, GGMLType.Q5_0: 16, GGMLType.Q8_0: 127}[ggml_type]
+    blocks = np.abs(x.reshape(-1, ggml_quants.QK)).max(axis=1, keepdims=True)
+    error = np.abs((x - y).reshape(-1, ggml_quants.QK))
+    assert (error <= blocks / levels * 1.01 + 1e-7).all()
+
+
+@pytest.mark.parametrize("ggml_type", list(K_TYPES), ids=GGML_TYPE_NAMES.get)
+def test_k_quants_match_llama_cpp(ggml_type):
+    data = bytes(ggml_quants.quantize(samples(), ggml_type))
+    assert hashlib.sha256(data).hexdigest() == K_TYPES[ggml_type]
+
+
+@pytest.mark.parametrize("ggml_type", list(MAX_RELATIVE_ERROR), ids=GGML_TYPE_NAMES.get)
+def test_relative_error(ggml_type):
+    x = samples()
+    y = ggml_quants.dequantize(ggml_quants.quantize(x, ggml_type), ggml_type).reshape(x.shape)
+    error = np.sqrt(((x - y) ** 2).mean(axis=1) / (x ** 2).mean(axis=1))
+    assert error.max() <= MAX_RELATIVE_ERROR[ggml_type]
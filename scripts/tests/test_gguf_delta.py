@@ -0,0 +1,119 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import gguf_delta
+from checksums import file_sha256
+from file_transfer import read_sidecar
+from gguf_delta import apply_patch, diff_gguf
+from gguf_file import GGMLType, GGUFValueType, GGUFWriter
+
+TENSORS = ["token_embd.weight", "blk.0.attn_q.weight", "blk.0.ffn_down.weight", "output.weight"]
+
+
+def write_model(path, alignment=32, template="{{ messages }}", name="base", seeds=None):
+    """Write a small Q8_0 model; ``seeds`` overrides the data seed of individual tensors."""
+    seeds = seeds or {}
+    writer = GGUFWriter(path)
+    writer.add_field("general.architecture", "qwen2")
+    writer.add_field("general.name", name)
+    writer.add_field("tokenizer.chat_template", template)
+    if alignment != 32:
+        writer.add_field("general.alignment", alignment, GGUFValueType.UINT32)
+    for tensor in TENSORS:
+        writer.add_tensor_info(tensor, (64, 8), GGMLType.Q8_0)
+    with writer:
+        writer.write_header()
+        for index, tensor in enumerate(TENSORS):
+            rng = np.random.default_rng(seeds.get(tensor, index))
+            writer.write_tensor_data(rng.integers(0, 256, 8 * 2 * 34, dtype=np.uint8))
+    return path
+
+
+@pytest.fixture(params=[32, 16384], ids=["align32", "align16k"])
+def models(request, tmp_path):
+    alignment = request.param
+    base = write_model(str(tmp_path / "base.gguf"), alignment)
+    target = write_model(str(tmp_path / "target.gguf"), alignment, name="target",
+                         seeds={"blk.0.ffn_down.weight": 100, "output.weight": 101})
+    patch = str(tmp_path / "update.patch")
+    return base, target, patch
+
+
+def test_diff_carries_only_changes(models):
+    base, target, patch = models
+    assert diff_gguf(base, target, patch) == (1, 2)
+    assert os.path.getsize(patch) < os.path.getsize(target)
+
+
+def test_apply_in_place(models, tmp_path):
+    base, target, patch = models
+    diff_gguf(base, target, patch)
+    work = str(tmp_path / "work.gguf")
+    link = str(tmp_path / "link.gguf")
+    os.link(base, work)
+    os.link(base, link)
+    base_digest = file_sha256(base)
+
+    assert apply_patch(work, patch, verify=True)
+    assert file_sha256(work) == file_sha256(target) == read_sidecar(work)
+    # Other links to the patched file keep the old data
+    assert file_sha256(link) == file_sha256(base) == base_digest
+
+
+def test_apply_to_new_file(models, tmp_path):
+    base, target, patch = models
+    diff_gguf(base, target, patch)
+    output = str(tmp_path / "out" / "patched.gguf")
+    base_digest = file_sha256(base)
+
+    assert not apply_patch(base, patch, output)
+    assert file_sha256(output) == file_sha256(target) == read_sidecar(output)
+    assert file_sha256(base) == base_digest
+    assert not os.path.exists(f"{output}.partial")
+
+
+def test_apply_rewrites_when_layout_changes(tmp_path):
+    # A longer chat template moves every tensor at 32-byte alignment
+    base = write_model(str(tmp_path / "base.gguf"))
+    target = write_model(str(tmp_path / "target.gguf"), template="{{ messages }} " * 50)
+    patch = str(tmp_path / "update.patch")
+    assert diff_gguf(base, target, patch) == (1, 0)
+
+    work = str(tmp_path / "work.gguf")
+    os.link(base, work)
+    assert not apply_patch(work, patch, verify=True)
+    assert file_sha256(work) == file_sha256(target)
+    assert file_sha256(base) != file_sha256(target)
+
+
+def test_apply_rejects_wrong_base(models, tmp_path):
+    base, target, patch = models
+    diff_gguf(base, target, patch)
+    other = write_model(str(tmp_path / "other.gguf"), seeds={"token_embd.weight": 7})
+    digest = file_sha256(other)
+    with pytest.raises(ValueError, match="is not the base of"):
+        apply_patch(other, patch, verify=True)
+    assert file_sha256(other) == digest
+
+
+def test_apply_rehashes_base_without_sidecar(models, tmp_path):
+    base, target, patch = models
+    diff_gguf(base, target, patch)
+    other = write_model(str(tmp_path / "other.gguf"), seeds={"token_embd.weight": 7})
+    digest = file_sha256(other)
+    with pytest.raises(ValueError, match="is not the base of"):
+        apply_patch(other, patch)
+    assert file_sha256(other) == digest
+    assert read_sidecar(other) is None
+
+
+def test_cli_reports_errors(models, tmp_path, monkeypatch, capsys):
+    base, target, patch = models
+    diff_gguf(base, target, patch)
+    other = write_model(str(tmp_path / "other.gguf"), seeds={"token_embd.weight": 7})
+    monkeypatch.setattr(sys, "argv", ["gguf_delta.py", "apply", other, patch, "--verify"])
+    assert gguf_delta.main() == 1
+    assert capsys.readouterr().out.startswith("Error: ")
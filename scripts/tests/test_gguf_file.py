@@ -0,0 +1,109 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from gguf_file import GGMLType, GGUFReader, GGUFValueType, GGUFWriter
+
+FIELDS = {
+    "general.architecture": "qwen2",
+    "general.name": "round trip",
+    "qwen2.block_count": 2,
+    "qwen2.rope.freq_base": 1000000.0,
+    "tokenizer.ggml.add_bos_token": False,
+    "tokenizer.ggml.tokens": ["<s>", "</s>", "hello"],
+    "tokenizer.ggml.token_type": [1, 3, 1],
+    "test.int64_array": [0, 2 ** 40, -2 ** 40],
+}
+
+
+def _tensors():
+    rng = np.random.default_rng(0)
+    return {
+        "token_embd.weight": (GGMLType.F16, rng.standard_normal((3, 64)).astype(np.float16)),
+        "blk.0.attn_norm.weight": (GGMLType.F32, rng.standard_normal(64).astype(np.float32)),
+        "blk.0.attn_q.weight": (GGMLType.Q8_0, rng.integers(0, 256, 4 * 2 * 34, dtype=np.uint8)),
+        "output_norm.weight": (GGMLType.F32, rng.standard_normal(64).astype(np.float32)),
+    }
+
+
+def _shape(name, ggml_type, data):
+    if ggml_type == GGMLType.Q8_0:
+        return (64, 4)
+    return tuple(reversed(data.shape))
+
+
+def write_model(path, alignment=None, alignment_last=False):
+    """Write a small model; ``general.alignment`` is set before or after the tensors are declared."""
+    writer = GGUFWriter(path)
+    for key, value in FIELDS.items():
+        writer.add_field(key, value)
+    if alignment and not alignment_last:
+        writer.add_field("general.alignment", alignment, GGUFValueType.UINT32)
+    tensors = _tensors()
+    for name, (ggml_type, data) in tensors.items():
+        writer.add_tensor_info(name, _shape(name, ggml_type, data), ggml_type)
+    if alignment and alignment_last:
+        writer.add_field("general.alignment", alignment, GGUFValueType.UINT32)
+    with writer:
+        writer.write_header()
+        for ggml_type, data in tensors.values():
+            writer.write_tensor_data(data)
+        digest = writer.hexdigest()
+    return digest
+
+
+@pytest.mark.parametrize("alignment", [None, 64, 16384])
+def test_round_trip(tmp_path, alignment):
+    path = tmp_path / "model.gguf"
+    digest = write_model(path, alignment)
+    assert digest == hashlib.sha256(path.read_bytes()).hexdigest()
+
+    with GGUFReader(path) as reader:
+        for key, value in FIELDS.items():
+            assert reader.get(key) == value
+        assert reader.alignment == (alignment or 32)
+        assert [info.name for info in reader.tensors] == list(_tensors())
+        assert reader.data_offset % reader.alignment == 0
+        for name, (ggml_type, data) in _tensors().items():
+            info = reader.tensor(name)
+            assert info.ggml_type == ggml_type
+            assert info.data_offset % reader.alignment == 0
+            if ggml_type == GGMLType.Q8_0:
+                assert bytes(reader.tensor_data(info)) == data.tobytes()
+            else:
+                np.testing.assert_array_equal(reader.tensor_array(info), data)
+
+
+def test_int64_array_types(tmp_path):
+    path = tmp_path / "model.gguf"
+    write_model(path)
+    with GGUFReader(path) as reader:
+        assert reader.fields["test.int64_array"].item_type == GGUFValueType.INT64
+        assert reader.fields["tokenizer.ggml.token_type"].item_type == GGUFValueType.INT32
+
+
+def test_alignment_set_after_tensors(tmp_path):
+    before = tmp_path / "before.gguf"
+    after = tmp_path / "after.gguf"
+    write_model(before, 16384)
+    write_model(after, 16384, alignment_last=True)
+    with GGUFReader(before) as a, GGUFReader(after) as b:
+        assert [info.data_offset for info in a.tensors] == [info.data_offset for info in b.tensors]
+        assert all(info.data_offset % 16384 == 0 for info in b.tensors)
+
+
+@pytest.mark.parametrize("alignment", [None, 16384])
+def test_readable_by_gguf_py(tmp_path, alignment):
+    gguf = pytest.importorskip("gguf")
+    path = tmp_path / "model.gguf"
+    write_model(path, alignment)
+    reader = gguf.GGUFReader(path)
+    assert reader.alignment == (alignment or 32)
+    tensors = {tensor.name: tensor for tensor in reader.tensors}
+    assert list(tensors) == list(_tensors())
+    for name, (ggml_type, data) in _tensors().items():
+        assert tensors[name].data_offset % reader.alignment == 0
+        assert tensors[name].data.tobytes() == data.tobytes()
+    assert reader.fields["general.name"].contents() == FIELDS["general.name"]
+    assert reader.fields["test.int64_array"].contents() == FIELDS["test.int64_array"]
@@ -0,0 +1,125 @@
+import shutil
+import sqlite3
+
+import pytest
+
+import migrate_databases
+from migrate_databases import DEFAULT_MIGRATIONS_DIR, load_migrations, migrate_database
+
+ROWS = 1050
+BATCH = 100
+VERSIONS = ["20250626", "20250718"]
+
+
+def make_database(path, rows=ROWS):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE blocks (id TEXT PRIMARY KEY, content TEXT)")
+    conn.execute("CREATE TABLE workspaces (key TEXT PRIMARY KEY)")
+    conn.executemany("INSERT INTO blocks VALUES (?, ?)", ((f"b{i}", f"block {i}") for i in range(rows)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def query(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def missing_timestamps(path):
+    return query(path, "SELECT count(*) FROM blocks WHERE created_at IS NULL OR updated_at IS NULL")[0][0]
+
+
+class InterruptingConnection(sqlite3.Connection):
+    """Raises ``KeyboardInterrupt`` on the ``limit``-th batch update of blocks."""
+
+    limit = None
+    batches = 0
+
+    def execute(self, sql, *args):
+        if sql.startswith('UPDATE "blocks"'):
+            type(self).batches += 1
+            if type(self).batches == self.limit:
+                raise KeyboardInterrupt
+        return super().execute(sql, *args)
+
+
+@pytest.fixture
+def database(tmp_path):
+    return make_database(str(tmp_path / "neonote.db"))
+
+
+@pytest.fixture
+def migrations():
+    return load_migrations(DEFAULT_MIGRATIONS_DIR)
+
+
+def test_migrate_populated_database(database, migrations):
+    result = migrate_database(database, migrations, batch_size=BATCH)
+    assert result.error is None and result.skipped is None
+    assert result.applied == VERSIONS
+    assert result.backfilled_rows == 2 * ROWS
+    assert missing_timestamps(database) == 0
+    assert query(database, "SELECT version, backfill_step, backfill_rowid FROM schema_migrations ORDER BY version") == [
+        ("20250626", 2, None), ("20250718", 0, None)]
+    # The database is handed back in its original journal mode
+    assert query(database, "PRAGMA journal_mode")[0][0] == "delete"
+
+    again = migrate_database(database, migrations, batch_size=BATCH)
+    assert again.error is None
+    assert again.applied == [] and again.backfilled_rows == 0
+
+
+def test_resume_interrupted_backfill(database, migrations, monkeypatch):
+    monkeypatch.setattr(InterruptingConnection, "limit", 4)
+    connect = sqlite3.connect
+    monkeypatch.setattr(migrate_databases.sqlite3, "connect",
+                        lambda path, **kwargs: connect(path, factory=InterruptingConnection, **kwargs))
+    with pytest.raises(KeyboardInterrupt):
+        migrate_database(database, migrations, batch_size=BATCH)
+    monkeypatch.undo()
+
+    # The first three batches were committed and checkpointed, the fourth
+    # rolled back, and the next migration was never applied
+    assert query(database, "SELECT version, backfill_step, backfill_rowid FROM schema_migrations") == [
+        ("20250626", 0, 3 * BATCH)]
+    assert query(database, "SELECT count(*) FROM blocks WHERE created_at IS NOT NULL")[0][0] == 3 * BATCH
+    assert query(database, "SELECT max(rowid) FROM blocks WHERE created_at IS NOT NULL")[0][0] == 3 * BATCH
+
+    result = migrate_database(database, migrations, batch_size=BATCH)
+    assert result.error is None
+    assert result.applied == ["20250718"]
+    assert result.backfilled_rows == (ROWS - 3 * BATCH) + ROWS
+    assert missing_timestamps(database) == 0
+    assert query(database, "SELECT count(*) FROM schema_migrations")[0][0] == len(VERSIONS)
+
+
+def test_changed_migration_is_refused(database, tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    shutil.copytree(DEFAULT_MIGRATIONS_DIR, migrations_dir)
+    assert migrate_database(database, load_migrations(str(migrations_dir)), batch_size=BATCH).error is None
+
+    edited = migrations_dir / "20250626_add_timestamps_to_blocks.sql"
+    edited.write_bytes(edited.read_bytes() + b"-- edited\r\n")
+    result = migrate_database(database, load_migrations(str(migrations_dir)), batch_size=BATCH)
+    assert result.error == "migration 20250626 changed since it was applied (checksum mismatch)"
+    assert result.applied == []
+
+
+def test_foreign_database_is_skipped(tmp_path, migrations):
+    path = str(tmp_path / "other.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE notes (body TEXT)")
+    conn.commit()
+    conn.close()
+    with open(path, "rb") as f:
+        before = f.read()
+
+    result = migrate_database(path, migrations, batch_size=BATCH)
+    assert result.error is None and result.skipped
+    assert result.applied == []
+    with open(path, "rb") as f:
+        assert f.read() == before
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import pipeline
+from gguf_file import GGMLType, GGUFReader, GGUFWriter
+from quantize_model import MemoryBudget, tensor_types
+
+TENSORS = ["token_embd.weight", "blk.0.attn_q.weight", "blk.0.ffn_down.weight", "output.weight"]
+QUANTIZE = ["q4_k_m", "q5_k_m", "q8_0"]
+
+
+class PeakBudget(MemoryBudget):
+    instances = []
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.peak = 0
+        PeakBudget.instances.append(self)
+
+    def acquire(self, cost, stop=None, held=0):
+        admitted = super().acquire(cost, stop, held)
+        with self._cond:
+            self.peak = max(self.peak, self.used)
+        return admitted
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / "source.gguf")
+    rng = np.random.default_rng(0)
+    writer = GGUFWriter(path)
+    writer.add_field("general.architecture", "qwen2")
+    for name in TENSORS:
+        writer.add_tensor_info(name, (512, 64), GGMLType.F32)
+    with writer:
+        writer.write_header()
+        for _name in TENSORS:
+            writer.write_tensor_data(rng.standard_normal((64, 512)).astype(np.float32))
+    return path
+
+
+def build(source, output_dir, memory_budget):
+    """Stream ``source`` to every type in QUANTIZE; return the output digests."""
+    with GGUFReader(source) as reader:
+        layout = GGUFWriter(None)
+        tensors = pipeline._gguf_source(reader, layout)
+        writers, target_types = [], []
+        for quantize in QUANTIZE:
+            writer = GGUFWriter(str(output_dir / f"{quantize}.gguf"), layout.alignment)
+            writer.copy_fields(layout)
+            types = tensor_types([tensor.info for tensor in tensors], quantize)
+            for tensor, tensor_type in zip(tensors, types):
+                writer.add_tensor_info(tensor.info.name, tensor.info.shape, tensor_type)
+            writer.write_header()
+            writers.append(writer)
+            target_types.append(types)
+        try:
+            pipeline.stream_tensors(tensors, target_types, writers, threads=4, memory_budget=memory_budget)
+            return [writer.hexdigest() for writer in writers]
+        finally:
+            for writer in writers:
+                writer.close()
+
+
+@pytest.mark.parametrize("memory_budget", [256 * 1024, 4096], ids=["bounded", "oversized"])
+def test_stream_within_budget(source, tmp_path, monkeypatch, memory_budget):
+    expected = build(source, tmp_path, 1 << 30)
+    monkeypatch.setattr(pipeline, "MemoryBudget", PeakBudget)
+    assert build(source, tmp_path, memory_budget) == expected
+
+    budget = PeakBudget.instances.pop()
+    # Encoded results are charged until written, and all of it is returned
+    assert budget.used == 0
+    if memory_budget > 4096:
+        assert 0 < budget.peak <= memory_budget
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from gguf_file import GGMLType, GGUFReader, GGUFWriter
+from quantize_model import quantize_gguf
+
+
+def write_model(path, ggml_type):
+    writer = GGUFWriter(path)
+    writer.add_field("general.architecture", "qwen2")
+    writer.add_tensor_info("blk.0.attn_q.weight", (64, 8), ggml_type)
+    writer.add_tensor_info("output_norm.weight", (64,), GGMLType.F32)
+    rng = np.random.default_rng(0)
+    with writer:
+        writer.write_header()
+        if ggml_type == GGMLType.F32:
+            writer.write_tensor_data(rng.standard_normal((8, 64)).astype(np.float32))
+        else:
+            writer.write_tensor_data(rng.integers(0, 256, 8 * 2 * 34, dtype=np.uint8))
+        writer.write_tensor_data(np.ones(64, dtype=np.float32))
+    return path
+
+
+@pytest.mark.parametrize("input_type, quantize, warned", [
+    (GGMLType.F32, "q4_0", False),
+    (GGMLType.Q8_0, "q8_0", False),
+    (GGMLType.Q8_0, "q4_0", True),
+])
+def test_prequantized_input_is_copied(tmp_path, capsys, input_type, quantize, warned):
+    source = write_model(str(tmp_path / "source.gguf"), input_type)
+    output = str(tmp_path / "output.gguf")
+    quantize_gguf(source, output, quantize)
+    assert ("Warning: " in capsys.readouterr().out) == warned
+    with GGUFReader(output) as reader:
+        expected = GGMLType.Q4_0 if input_type == GGMLType.F32 else input_type
+        assert reader.tensor("blk.0.attn_q.weight").ggml_type == expected